@@ -1,8 +1,15 @@
 #!/usr/bin/python
 
+import os
 import time
+import json
 from Adafruit_I2C import Adafruit_I2C
 
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
 # ===========================================================================
 # BMP085 Class
 # ===========================================================================
@@ -28,11 +35,24 @@ class BMP085 :
   __BMP085_CAL_MB            = 0xBA  # R   Calibration data (16 bits)
   __BMP085_CAL_MC            = 0xBC  # R   Calibration data (16 bits)
   __BMP085_CAL_MD            = 0xBE  # R   Calibration data (16 bits)
+  __BMP085_CHIPID            = 0xD0  # R   Chip ID (8 bits)
+  __BMP085_CHIPID_VALUE      = 0x55
   __BMP085_CONTROL           = 0xF4
   __BMP085_TEMPDATA          = 0xF6
   __BMP085_PRESSUREDATA      = 0xF6
   __BMP085_READTEMPCMD       = 0x2E
   __BMP085_READPRESSURECMD   = 0x34
+  __BMP085_CONTROL_SCO       = 0x20  # Start of conversion, cleared when done
+
+  # Conversion times in seconds (pressure is indexed by mode)
+  __BMP085_TEMPDELAY         = 0.005
+  __BMP085_PRESSUREDELAY     = (0.005, 0.008, 0.014, 0.026)
+
+  # Datasheet example values (raw temperature, raw pressure in ULTRALOWPOWER
+  # mode and calibration coefficients AC1 to MD in EEPROM order)
+  DATASHEET_UT = 27898
+  DATASHEET_UP = 23843
+  DATASHEET_CAL = (408, -72, -14383, 32741, 32757, 23153, 6190, 4, -32768, -8711, 2868)
 
   # Private Fields
   _cal_AC1 = 0
@@ -46,13 +66,26 @@ class BMP085 :
   _cal_MB = 0
   _cal_MC = 0
   _cal_MD = 0
+  _pending = None  # (command, deadline, delay) of the running conversion
+  _b5 = None       # B5 of the last temperature conversion
+  _b5Time = 0.0
+  _b5Samples = 0   # pressure samples compensated with the cached B5
 
   # Constructor
-  def __init__(self, address=0x77, mode=1, debug=False):
-    self.i2c = Adafruit_I2C(address)
+  def __init__(self, address=0x77, mode=1, debug=False, calCache=None,
+               tempMaxAge=0, tempMaxSamples=0, busnum=-1, bus=None):
+    self.i2c = Adafruit_I2C(address, busnum, bus=bus)
 
     self.address = address
     self.debug = debug
+    # Optional calibration cache file. The whole EEPROM is a single block read,
+    # the same number of transactions as a validated cache hit, so it is off
+    # by default
+    self.calCache = calCache
+    # Reuse one temperature conversion for up to tempMaxAge seconds and/or
+    # tempMaxSamples pressure samples (0 disables the respective limit)
+    self.tempMaxAge = tempMaxAge
+    self.tempMaxSamples = tempMaxSamples
     # Make sure the specified mode is in the appropriate range
     if ((mode < 0) | (mode > 3)):
       if (self.debug):
@@ -60,37 +93,112 @@ class BMP085 :
       self.mode = self.__BMP085_STANDARD
     else:
       self.mode = mode
-    # Read the calibration data
-    self.readCalibrationData()
+    # Read the calibration data, not keeping a reference on the shared bus
+    # if the device cannot be set up
+    try:
+      self.readCalibrationData()
+    except:
+      self.i2c.close()
+      raise
+
+  def reopen(self):
+    """Re-opens the I2C bus after I/O errors and drops the state of a
+    conversion the errors may have interrupted; calibration is kept"""
+    self.i2c.reopen()
+    self._pending = None
+    self._b5 = None
+    self._b5Samples = 0
 
   def readS16(self, register):
     "Reads a signed 16-bit value"
-    hi = self.i2c.readS8(register)
-    lo = self.i2c.readU8(register+1)
-    return (hi << 8) + lo
+    return self.i2c.readStruct(register, '>h')[0]
 
   def readU16(self, register):
     "Reads an unsigned 16-bit value"
-    hi = self.i2c.readU8(register)
-    lo = self.i2c.readU8(register+1)
-    return (hi << 8) + lo
+    return self.i2c.readStruct(register, '>H')[0]
+
+  def readChipID(self):
+    "Reads the chip ID register (0x55 for BMP085 and BMP180)"
+    return self.i2c.readU8(self.__BMP085_CHIPID)
 
   def readCalibrationData(self):
-    "Reads the calibration data from the IC"
-    self._cal_AC1 = self.readS16(self.__BMP085_CAL_AC1)   # INT16
-    self._cal_AC2 = self.readS16(self.__BMP085_CAL_AC2)   # INT16
-    self._cal_AC3 = self.readS16(self.__BMP085_CAL_AC3)   # INT16
-    self._cal_AC4 = self.readU16(self.__BMP085_CAL_AC4)   # UINT16
-    self._cal_AC5 = self.readU16(self.__BMP085_CAL_AC5)   # UINT16
-    self._cal_AC6 = self.readU16(self.__BMP085_CAL_AC6)   # UINT16
-    self._cal_B1 = self.readS16(self.__BMP085_CAL_B1)     # INT16
-    self._cal_B2 = self.readS16(self.__BMP085_CAL_B2)     # INT16
-    self._cal_MB = self.readS16(self.__BMP085_CAL_MB)     # INT16
-    self._cal_MC = self.readS16(self.__BMP085_CAL_MC)     # INT16
-    self._cal_MD = self.readS16(self.__BMP085_CAL_MD)     # INT16
+    "Reads the calibration data from the cache or from the IC"
+    chipID = None
+    cal = None
+    if (self.calCache is not None):
+      chipID = self.readChipID()
+      if (chipID < 0):
+        # readU8 returns -1 on a failed read, bypass the cache altogether
+        chipID = None
+      elif (self.debug and chipID != self.__BMP085_CHIPID_VALUE):
+        print "DBG: Unexpected chip ID 0x%02X" % (chipID & 0xFF)
+      if (chipID is not None):
+        cal = self.loadCalibrationCache(chipID)
+    if (cal is None):
+      # Pull the whole 0xAA-0xBF EEPROM block in a single transaction
+      # INT16 AC1-AC3, UINT16 AC4-AC6, INT16 B1, B2, MB, MC, MD (big endian)
+      cal = self.i2c.readStruct(self.__BMP085_CAL_AC1, '>hhhHHHhhhhh')
+      if (chipID is not None):
+        self.saveCalibrationCache(chipID, cal)
+    (self._cal_AC1, self._cal_AC2, self._cal_AC3,
+     self._cal_AC4, self._cal_AC5, self._cal_AC6,
+     self._cal_B1, self._cal_B2,
+     self._cal_MB, self._cal_MC, self._cal_MD) = cal
     if (self.debug):
       self.showCalibrationData()
 
+  def calibrationCacheKey(self):
+    "Returns the calibration cache key for this device (bus and address)"
+    return "%d-0x%02X" % (self.i2c.busnum, self.address)
+
+  def loadCalibrationCache(self, chipID):
+    """Returns cached calibration values or None if they are missing or stale.
+    Every BMP085 and BMP180 has the same chip ID, so AC1 is re-read from the
+    EEPROM to tell a swapped sensor at the same bus and address apart."""
+    try:
+      with open(self.calCache, 'r') as f:
+        entry = json.load(f).get(self.calibrationCacheKey())
+    except (IOError, ValueError, AttributeError):
+      return None
+    if (not isinstance(entry, dict) or entry.get('chipid') != chipID):
+      return None
+    cal = entry.get('cal')
+    if (not isinstance(cal, list) or len(cal) != 11):
+      return None
+    try:
+      if (self.readS16(self.__BMP085_CAL_AC1) != cal[0]):
+        if (self.debug):
+          print "DBG: Calibration cache %s belongs to another sensor" % self.calCache
+        return None
+    except IOError:
+      return None
+    if (self.debug):
+      print "DBG: Using cached calibration data from %s" % self.calCache
+    return tuple(cal)
+
+  def saveCalibrationCache(self, chipID, cal):
+    "Stores calibration values in the cache, keyed by bus, address and chip ID"
+    # Never cache an EEPROM read that came back blank or floating
+    for value in cal:
+      if ((value & 0xFFFF) in (0x0000, 0xFFFF)):
+        return
+    try:
+      with open(self.calCache, 'r') as f:
+        entries = json.load(f)
+      if (not isinstance(entries, dict)):
+        entries = {}
+    except (IOError, ValueError):
+      entries = {}
+    entries[self.calibrationCacheKey()] = {'chipid': chipID, 'cal': list(cal)}
+    tmpFile = "%s.%d.tmp" % (self.calCache, os.getpid())
+    try:
+      with open(tmpFile, 'w') as f:
+        json.dump(entries, f)
+      os.rename(tmpFile, self.calCache)
+    except (IOError, OSError), err:
+      if (self.debug):
+        print "DBG: Unable to write calibration cache %s: %s" % (self.calCache, err)
+
   def showCalibrationData(self):
       "Displays the calibration values for debugging purposes"
       print "DBG: AC1 = %6d" % (self._cal_AC1)
@@ -105,58 +213,89 @@ class BMP085 :
       print "DBG: MC  = %6d" % (self._cal_MC)
       print "DBG: MD  = %6d" % (self._cal_MD)
 
+  def startTemperature(self):
+    "Starts a temperature conversion and returns the time it is ready at"
+    return self.startConversion(self.__BMP085_READTEMPCMD,
+                                self.__BMP085_TEMPDELAY)
+
+  def startPressure(self):
+    "Starts a pressure conversion and returns the time it is ready at"
+    return self.startConversion(self.__BMP085_READPRESSURECMD + (self.mode << 6),
+                                self.__BMP085_PRESSUREDELAY[self.mode])
+
+  def startConversion(self, command, delay):
+    """Writes a conversion command to the control register without waiting.
+    Threads sharing one device must hold i2c.transaction() until collect()"""
+    if (self.i2c.write8(self.__BMP085_CONTROL, command) == -1):
+      raise IOError("Unable to start BMP085 conversion at 0x%02X" % self.address)
+    deadline = time.time() + delay
+    self._pending = (command, deadline, delay)
+    return deadline
+
+  def isReady(self, poll=False):
+    "Checks whether the pending conversion has finished"
+    if (self._pending is None):
+      return False
+    if (time.time() >= self._pending[1]):
+      return True
+    if (poll):
+      # BMP180 clears the SCO bit once done, BMP085 only signals it on EOC
+      return (self.i2c.readU8(self.__BMP085_CONTROL) & self.__BMP085_CONTROL_SCO) == 0
+    return False
+
+  def collect(self, poll=False):
+    "Reads the raw result of the pending conversion, waiting only if needed"
+    if (self._pending is None):
+      raise RuntimeError("No BMP085 conversion in progress")
+    command, deadline, delay = self._pending
+    if (not self.isReady(poll)):
+      # Never trust the wall clock for more than one conversion time
+      time.sleep(max(0.0, min(deadline - time.time(), delay)))
+    self._pending = None
+    if (command == self.__BMP085_READTEMPCMD):
+      raw = self.readU16(self.__BMP085_TEMPDATA)
+      if (self.debug):
+        print "DBG: Raw Temp: 0x%04X (%d)" % (raw & 0xFFFF, raw)
+    else:
+      msb, lsb, xlsb = self.i2c.readStruct(self.__BMP085_PRESSUREDATA, '>BBB')
+      raw = ((msb << 16) + (lsb << 8) + xlsb) >> (8 - (command >> 6))
+      if (self.debug):
+        print "DBG: Raw Pressure: 0x%04X (%d)" % (raw & 0xFFFF, raw)
+    return raw
+
   def readRawTemp(self):
     "Reads the raw (uncompensated) temperature from the sensor"
-    self.i2c.write8(self.__BMP085_CONTROL, self.__BMP085_READTEMPCMD)
-    time.sleep(0.005)  # Wait 5ms
-    raw = self.readU16(self.__BMP085_TEMPDATA)
-    if (self.debug):
-      print "DBG: Raw Temp: 0x%04X (%d)" % (raw & 0xFFFF, raw)
-    return raw
+    with self.i2c.transaction():
+      self.startTemperature()
+      return self.collect()
 
   def readRawPressure(self):
     "Reads the raw (uncompensated) pressure level from the sensor"
-    self.i2c.write8(self.__BMP085_CONTROL, self.__BMP085_READPRESSURECMD + (self.mode << 6))
-    if (self.mode == self.__BMP085_ULTRALOWPOWER):
-      time.sleep(0.005)
-    elif (self.mode == self.__BMP085_HIGHRES):
-      time.sleep(0.014)
-    elif (self.mode == self.__BMP085_ULTRAHIGHRES):
-      time.sleep(0.026)
-    else:
-      time.sleep(0.008)
-    msb = self.i2c.readU8(self.__BMP085_PRESSUREDATA)
-    lsb = self.i2c.readU8(self.__BMP085_PRESSUREDATA+1)
-    xlsb = self.i2c.readU8(self.__BMP085_PRESSUREDATA+2)
-    raw = ((msb << 16) + (lsb << 8) + xlsb) >> (8 - self.mode)
-    if (self.debug):
-      print "DBG: Raw Pressure: 0x%04X (%d)" % (raw & 0xFFFF, raw)
-    return raw
-
-  def readTemperature(self):
-    "Gets the compensated temperature in degrees celcius"
-    UT = 0
-    X1 = 0
-    X2 = 0
-    B5 = 0
-    temp = 0.0
+    with self.i2c.transaction():
+      self.startPressure()
+      return self.collect()
 
-    # Read raw temp before aligning it with the calibration values
-    UT = self.readRawTemp()
+  def calcB5(self, UT):
+    "Aligns the raw temperature with the calibration values (B5)"
     X1 = ((UT - self._cal_AC6) * self._cal_AC5) >> 15
     X2 = (self._cal_MC << 11) / (X1 + self._cal_MD)
     B5 = X1 + X2
+    if (self.debug):
+      print "DBG: X1 = %d" % (X1)
+      print "DBG: X2 = %d" % (X2)
+      print "DBG: B5 = %d" % (B5)
+    return B5
+
+  def calcTemperature(self, B5):
+    "Gets the compensated temperature in degrees celcius from B5"
     temp = ((B5 + 8) >> 4) / 10.0
     if (self.debug):
       print "DBG: Calibrated temperature = %f C" % temp
     return temp
 
-  def readPressure(self):
-    "Gets the compensated pressure in pascal"
-    UT = 0
-    UP = 0
+  def calcPressure(self, UP, B5):
+    "Gets the compensated pressure in pascal from the raw pressure and B5"
     B3 = 0
-    B5 = 0
     B6 = 0
     X1 = 0
     X2 = 0
@@ -165,41 +304,6 @@ class BMP085 :
     B4 = 0
     B7 = 0
 
-    UT = self.readRawTemp()
-    UP = self.readRawPressure()
-
-    # You can use the datasheet values to test the conversion results
-    # dsValues = True
-    dsValues = False
-
-    if (dsValues):
-      UT = 27898
-      UP = 23843
-      self._cal_AC6 = 23153
-      self._cal_AC5 = 32757
-      self._cal_MB = -32768;
-      self._cal_MC = -8711
-      self._cal_MD = 2868
-      self._cal_B1 = 6190
-      self._cal_B2 = 4
-      self._cal_AC3 = -14383
-      self._cal_AC2 = -72
-      self._cal_AC1 = 408
-      self._cal_AC4 = 32741
-      self.mode = self.__BMP085_ULTRALOWPOWER
-      if (self.debug):
-        self.showCalibrationData()
-
-    # True Temperature Calculations
-    X1 = ((UT - self._cal_AC6) * self._cal_AC5) >> 15
-    X2 = (self._cal_MC << 11) / (X1 + self._cal_MD)
-    B5 = X1 + X2
-    if (self.debug):
-      print "DBG: X1 = %d" % (X1)
-      print "DBG: X2 = %d" % (X2)
-      print "DBG: B5 = %d" % (B5)
-      print "DBG: True Temperature = %.2f C" % (((B5 + 8) >> 4) / 10.0)
-
     # Pressure Calculations
     B6 = B5 - 4000
     X1 = (self._cal_B2 * (B6 * B6) >> 12) >> 11
@@ -247,13 +351,213 @@ class BMP085 :
 
     return p
 
+  def readTemperature(self):
+    "Gets the compensated temperature in degrees celcius"
+    UT = 0
+    B5 = 0
+
+    # Read raw temp before aligning it with the calibration values
+    UT = self.readRawTemp()
+    B5 = self.calcB5(UT)
+    return self.calcTemperature(B5)
+
+  def readPressure(self):
+    "Gets the compensated pressure in pascal"
+    UT = 0
+    UP = 0
+    B5 = 0
+
+    UT = self.readRawTemp()
+    UP = self.readRawPressure()
+
+    # You can use the datasheet values to test the conversion results
+    # dsValues = True
+    dsValues = False
+
+    if (dsValues):
+      UT = self.DATASHEET_UT
+      UP = self.DATASHEET_UP
+      (self._cal_AC1, self._cal_AC2, self._cal_AC3,
+       self._cal_AC4, self._cal_AC5, self._cal_AC6,
+       self._cal_B1, self._cal_B2,
+       self._cal_MB, self._cal_MC, self._cal_MD) = self.DATASHEET_CAL
+      self.mode = self.__BMP085_ULTRALOWPOWER
+      if (self.debug):
+        self.showCalibrationData()
+
+    # True Temperature Calculations
+    B5 = self.calcB5(UT)
+    if (self.debug):
+      print "DBG: True Temperature = %.2f C" % (((B5 + 8) >> 4) / 10.0)
+
+    return self.calcPressure(UP, B5)
+
+  def tempExpired(self):
+    "Checks whether the cached B5 is too old to compensate another pressure sample"
+    if (self._b5 is None):
+      return True
+    if (self.tempMaxAge <= 0 and self.tempMaxSamples <= 0):
+      return True
+    if (self.tempMaxAge > 0):
+      age = time.time() - self._b5Time
+      if ((age < 0) or (age >= self.tempMaxAge)):
+        return True
+    if ((self.tempMaxSamples > 0) and (self._b5Samples >= self.tempMaxSamples)):
+      return True
+    return False
+
+  def updateTemperature(self, UT):
+    "Computes B5 from a raw temperature and caches it for later pressure samples"
+    self._b5 = self.calcB5(UT)
+    self._b5Time = time.time()
+    self._b5Samples = 0
+    return self._b5
+
+  def readB5(self):
+    "Gets B5, running a temperature conversion only when the cached one expired"
+    if (self.tempExpired()):
+      self.updateTemperature(self.readRawTemp())
+    return self._b5
+
+  def calcAll(self, UP, altitude=False, seaLevelPressure=101325):
+    "Compensates a raw pressure with the cached B5 into temperature, pressure and altitude"
+    if (self._b5 is None):
+      raise RuntimeError("No BMP085 temperature conversion available")
+    self._b5Samples += 1
+    temp = self.calcTemperature(self._b5)
+    pressure = self.calcPressure(UP, self._b5)
+    if (altitude):
+      return (temp, pressure, self.calcAltitude(pressure, seaLevelPressure))
+    return (temp, pressure)
+
+  def readAll(self, altitude=False, seaLevelPressure=101325):
+    "Gets temperature, pressure and optionally altitude from one UT/UP pair"
+    with self.i2c.transaction():
+      self.readB5()
+      UP = self.readRawPressure()
+    return self.calcAll(UP, altitude, seaLevelPressure)
+
+  def readBurst(self, samples=8, method='median', trim=0.25):
+    """Takes samples back-to-back pressure conversions sharing one temperature
+    conversion and returns (temperature, pressure, spread), with pressure and
+    spread in pascal. A pressure conversion already started by the caller is
+    collected as the first sample and compensated with the same temperature
+    as the rest of the burst."""
+    if (samples < 1):
+      raise ValueError("Invalid burst size: %d" % samples)
+    raw = []
+    with self.i2c.transaction():
+      if ((self._pending is not None) and (self._pending[0] != self.__BMP085_READTEMPCMD)):
+        raw.append(self.collect())
+      # Refresh an expired temperature even after a caller-started pressure
+      # conversion, the pressure collected above stays valid
+      self.readB5()
+      while (len(raw) < samples):
+        self.startPressure()
+        raw.append(self.collect())
+    self._b5Samples += 1
+    pressure, spread = self.filterSamples([self.calcPressure(UP, self._b5) for UP in raw],
+                                          method, trim)
+    if (self.debug):
+      print "DBG: Burst Pressure = %.2f Pa (spread %.2f Pa, %d samples)" % (pressure, spread, len(raw))
+    return (self.calcTemperature(self._b5), pressure, spread)
+
+  @staticmethod
+  def filterSamples(values, method='median', trim=0.25):
+    """Drops the trim fraction of lowest and highest values and returns the
+    median or mean ('median' or 'trimmed') of the rest with its range"""
+    values = sorted(values)
+    cut = int(len(values) * trim)
+    if (0 < cut) and (2 * cut < len(values)):
+      values = values[cut:-cut]
+    count = len(values)
+    if (method == 'median'):
+      value = (values[(count - 1) // 2] + values[count // 2]) / 2.0
+    elif (method == 'trimmed'):
+      value = sum(values) / float(count)
+    else:
+      raise ValueError("Invalid burst filter: %s" % method)
+    return (value, float(values[-1] - values[0]))
+
+  def compensator(self):
+    "Returns a batch compensator built from the current calibration data"
+    return BMP085Compensator((self._cal_AC1, self._cal_AC2, self._cal_AC3,
+                              self._cal_AC4, self._cal_AC5, self._cal_AC6,
+                              self._cal_B1, self._cal_B2,
+                              self._cal_MB, self._cal_MC, self._cal_MD),
+                             self.mode)
+
+  def calcAltitude(self, pressure, seaLevelPressure=101325):
+    "Calculates the altitude in meters from the compensated pressure"
+    altitude = 44330.0 * (1.0 - pow(float(pressure) / seaLevelPressure, 0.1903))
+    if (self.debug):
+      print "DBG: Altitude = %d" % (altitude)
+    return altitude
+
   def readAltitude(self, seaLevelPressure=101325):
     "Calculates the altitude in meters"
     altitude = 0.0
     pressure = float(self.readPressure())
-    altitude = 44330.0 * (1.0 - pow(pressure / seaLevelPressure, 0.1903))
-    if (self.debug):
-      print "DBG: Altitude = %d" % (altitude)
+    altitude = self.calcAltitude(pressure, seaLevelPressure)
     return altitude
 
-    return 0
+# ===========================================================================
+# BMP085Compensator Class
+# ===========================================================================
+
+class BMP085Compensator :
+  """Vectorized BMP085 compensation of raw UT/UP arrays with NumPy. Matches
+  BMP085.calcB5/calcTemperature/calcPressure bit for bit (floor division and
+  arithmetic shifts on int64)."""
+
+  def __init__(self, cal, mode=1):
+    "Takes the 11 calibration coefficients in EEPROM order (AC1 to MD)"
+    if numpy is None:
+      raise ImportError("BMP085Compensator requires NumPy")
+    if ((mode < 0) | (mode > 3)):
+      raise ValueError("Invalid Mode: %d" % mode)
+    (self.AC1, self.AC2, self.AC3, self.AC4, self.AC5, self.AC6,
+     self.B1, self.B2, self.MB, self.MC, self.MD) = [int(value) for value in cal]
+    self.mode = mode
+
+  def calcB5(self, UT):
+    "Aligns an array of raw temperatures with the calibration values (B5)"
+    UT = numpy.asarray(UT, dtype=numpy.int64)
+    X1 = ((UT - self.AC6) * self.AC5) >> 15
+    X2 = numpy.floor_divide(self.MC << 11, X1 + self.MD)
+    return X1 + X2
+
+  def calcTemperature(self, B5):
+    "Gets compensated temperatures in degrees celcius from B5"
+    return ((numpy.asarray(B5, dtype=numpy.int64) + 8) >> 4) / 10.0
+
+  def calcPressure(self, UP, B5):
+    "Gets compensated pressures in pascal from raw pressures and B5"
+    UP = numpy.asarray(UP, dtype=numpy.int64)
+    B5 = numpy.asarray(B5, dtype=numpy.int64)
+
+    B6 = B5 - 4000
+    X1 = (self.B2 * (B6 * B6) >> 12) >> 11
+    X2 = (self.AC2 * B6) >> 11
+    X3 = X1 + X2
+    B3 = numpy.floor_divide(((self.AC1 * 4 + X3) << self.mode) + 2, 4)
+
+    X1 = (self.AC3 * B6) >> 13
+    X2 = (self.B1 * ((B6 * B6) >> 12)) >> 16
+    X3 = ((X1 + X2) + 2) >> 2
+    B4 = (self.AC4 * (X3 + 32768)) >> 15
+    B7 = (UP - B3) * (50000 >> self.mode)
+
+    p = numpy.where(B7 < 0x80000000,
+                    numpy.floor_divide(B7 * 2, B4),
+                    numpy.floor_divide(B7, B4) * 2)
+
+    X1 = (p >> 8) * (p >> 8)
+    X1 = (X1 * 3038) >> 16
+    X2 = (-7357 * p) >> 16
+    return p + ((X1 + X2 + 3791) >> 4)
+
+  def compensate(self, UT, UP):
+    "Gets (temperatures, pressures) arrays from raw UT and UP arrays"
+    B5 = self.calcB5(UT)
+    return (self.calcTemperature(B5), self.calcPressure(UP, B5))
@@ -1,12 +1,178 @@
 #!/usr/bin/python
 
-import smbus
+import time
+import bisect
+import struct
+import threading
+
+try:
+  import smbus
+except ImportError:
+  smbus = None
+
+# ===========================================================================
+# I2CStats Class
+# ===========================================================================
+
+class I2CStats :
+  """Transaction counters, byte counts, error counts and latency histograms
+  by transaction kind. Updated under the bus lock, so recording is a few
+  dict and list operations with no locking of its own."""
+
+  # Latency histogram bucket upper bounds in seconds (last bucket is open)
+  BUCKETS = (0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1)
+
+  def __init__(self):
+    self.reset()
+
+  def reset(self):
+    "Clears all counters"
+    self.kinds = {}  # kind -> [count, errors, bytes, seconds, histogram]
+
+  def record(self, kind, length, elapsed, error=False):
+    "Accounts for one transaction"
+    entry = self.kinds.get(kind)
+    if entry is None:
+      entry = self.kinds[kind] = [0, 0, 0, 0.0, [0] * (len(self.BUCKETS) + 1)]
+    entry[0] += 1
+    if error:
+      entry[1] += 1
+    else:
+      entry[2] += length
+    entry[3] += elapsed
+    entry[4][bisect.bisect_left(self.BUCKETS, elapsed)] += 1
+
+  def snapshot(self):
+    "Returns a copy of the counters as plain dicts (JSON serializable)"
+    kinds = {}
+    totals = {'count': 0, 'errors': 0, 'bytes': 0, 'seconds': 0.0}
+    for kind, (count, errors, length, seconds, histogram) in self.kinds.items():
+      kinds[kind] = {'count': count, 'errors': errors, 'bytes': length,
+                     'seconds': seconds, 'histogram': list(histogram)}
+      totals['count'] += count
+      totals['errors'] += errors
+      totals['bytes'] += length
+      totals['seconds'] += seconds
+    totals['kinds'] = kinds
+    totals['buckets'] = list(self.BUCKETS)
+    return totals
+
+# ===========================================================================
+# I2CBus Class
+# ===========================================================================
+
+class I2CBus :
+  "Shared handle of one I2C bus: backend, transaction lock and statistics"
+
+  def __init__(self, busnum, backend):
+    self.busnum = busnum
+    self.backend = backend
+    # Reentrant, so a multi-step transaction can wrap single transfers
+    self.lock = threading.RLock()
+    self.refs = 0
+    self.reopens = 0
+    self.transactions = {}  # transfers per device address
+    self.stats = I2CStats()
+
+  def transfer(self, address, stats, kind, length, name, *args):
+    """Runs one backend call for a device under the bus lock, accounting it
+    in the bus and device statistics"""
+    with self.lock:
+      self.transactions[address] = self.transactions.get(address, 0) + 1
+      start = time.time()
+      try:
+        result = getattr(self.backend, name)(address, *args)
+      except IOError:
+        elapsed = time.time() - start
+        self.stats.record(kind, length, elapsed, True)
+        stats.record(kind, length, elapsed, True)
+        raise
+      elapsed = time.time() - start
+      self.stats.record(kind, length, elapsed)
+      stats.record(kind, length, elapsed)
+      return result
+
+# ===========================================================================
+# I2CBusManager Class
+# ===========================================================================
+
+class I2CBusManager :
+  "Hands out one shared I2CBus handle per bus number for the whole process"
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._buses = {}
+
+  def open(self, busnum, backend=None):
+    "Returns the shared handle for a bus, opening the bus on first use"
+    with self._lock:
+      handle = self._buses.get(busnum)
+      if handle is None:
+        # Any object with the smbus.SMBus methods can be injected as the backend
+        if backend is None:
+          if smbus is None:
+            raise ImportError("smbus module is required without an injected bus")
+          backend = smbus.SMBus(busnum)
+        handle = I2CBus(busnum, backend)
+        self._buses[busnum] = handle
+      elif backend is not None and backend is not handle.backend:
+        raise ValueError("I2C bus %d is already open with another backend" % busnum)
+      handle.refs += 1
+      return handle
+
+  def release(self, busnum):
+    "Drops one reference to a bus and closes it when nobody uses it"
+    with self._lock:
+      handle = self._buses.get(busnum)
+      if handle is None:
+        return
+      handle.refs -= 1
+      if handle.refs <= 0:
+        del self._buses[busnum]
+        if hasattr(handle.backend, 'close'):
+          handle.backend.close()
+
+  def reopen(self, busnum):
+    """Closes and re-opens the backend of a bus after I/O errors (e.g. a
+    loose wire), keeping the shared handle, its lock and statistics"""
+    with self._lock:
+      handle = self._buses.get(busnum)
+      if handle is None:
+        raise ValueError("I2C bus %d is not open" % busnum)
+    with handle.lock:
+      backend = handle.backend
+      if hasattr(backend, 'close'):
+        try:
+          backend.close()
+        except IOError:
+          pass
+      # smbus.SMBus and compatible backends re-open the device in place
+      if hasattr(backend, 'open'):
+        backend.open(busnum)
+      handle.reopens += 1
+
+  def transactions(self):
+    "Returns transfer counts per bus number and device address"
+    with self._lock:
+      return dict((busnum, dict(handle.transactions))
+                  for busnum, handle in self._buses.items())
+
+  def stats(self):
+    "Returns statistics snapshots per bus number"
+    with self._lock:
+      handles = self._buses.items()
+    stats = {}
+    for busnum, handle in handles:
+      with handle.lock:
+        stats[busnum] = handle.stats.snapshot()
+    return stats
 
 # ===========================================================================
 # Adafruit_I2C Class
 # ===========================================================================
 
 class Adafruit_I2C :
+  busManager = I2CBusManager()
 
   @staticmethod
   def getPiRevision():
@@ -25,19 +191,66 @@ class Adafruit_I2C :
   def getPiI2CBusNumber():
     # Gets the I2C bus number /dev/i2c#
     return 1 if Adafruit_I2C.getPiRevision() > 1 else 0
- 
-  def __init__(self, address, busnum=-1, debug=False):
-    self.address = address
+
+  @staticmethod
+  def resolveBusNumber(busnum=-1):
+    "Gets the bus number used for busnum, picking the default one if negative"
     # By default, the correct I2C bus is auto-detected using /proc/cpuinfo
     # Alternatively, you can hard-code the bus version below:
-    # self.bus = smbus.SMBus(0); # Force I2C0 (early 256MB Pi's)
-    self.bus = smbus.SMBus(1); # Force I2C1 (512MB Pi's)
+    # busnum = 0 # Force I2C0 (early 256MB Pi's)
+    if busnum < 0:
+      busnum = 1 # Force I2C1 (512MB Pi's)
+    return busnum
+
+  @classmethod
+  def reopenBus(cls, busnum=-1):
+    """Re-opens a shared bus after I/O errors before a device on it is
+    constructed again; returns False if nobody has the bus open, as the next
+    device then opens it afresh anyway"""
+    try:
+      cls.busManager.reopen(cls.resolveBusNumber(busnum))
+    except ValueError:
+      return False
+    return True
+ 
+  def __init__(self, address, busnum=-1, debug=False, bus=None):
+    self.address = address
+    self.busnum = self.resolveBusNumber(busnum)
+    # One shared, locked handle per bus no matter how many devices use it
+    self.handle = self.busManager.open(self.busnum, bus)
+    self.bus = self.handle.backend
     self.debug = debug
+    self.stats = I2CStats()
+
+  def close(self):
+    "Releases the shared bus handle"
+    if self.handle is not None:
+      self.busManager.release(self.busnum)
+      self.handle = None
+
+  def reopen(self):
+    "Re-opens the shared bus after I/O errors"
+    self.busManager.reopen(self.busnum)
+    self.bus = self.handle.backend
+
+  def transaction(self):
+    """Returns the bus lock, to be held with 'with' around multi-step
+    sequences such as a command write followed by a result read"""
+    return self.handle.lock
+
+  def transfer(self, kind, length, name, *args):
+    "Runs one smbus call on the shared bus as a transaction of the given kind"
+    return self.handle.transfer(self.address, self.stats, kind, length, name, *args)
+
+  def statistics(self):
+    "Returns a snapshot of this device's transaction statistics"
+    with self.handle.lock:
+      return self.stats.snapshot()
 
   def reverseByteOrder(self, data):
     "Reverses the byte order of an int (16-bit) or long (32-bit) value"
     # Courtesy Vishal Sapre
-    byteCount = len(hex(data)[2:].replace('L','')[::2])
+    byteCount = max(1, (data.bit_length() + 7) >> 3)
     val       = 0
     for i in range(byteCount):
       val    = (val << 8) | (data & 0xff)
@@ -51,7 +264,7 @@ class Adafruit_I2C :
   def write8(self, reg, value):
     "Writes an 8-bit value to the specified register/address"
     try:
-      self.bus.write_byte_data(self.address, reg, value)
+      self.transfer('write8', 1, 'write_byte_data', reg, value)
       if self.debug:
         print "I2C: Wrote 0x%02X to register 0x%02X" % (value, reg)
     except IOError, err:
@@ -60,7 +273,7 @@ class Adafruit_I2C :
   def write16(self, reg, value):
     "Writes a 16-bit value to the specified register/address pair"
     try:
-      self.bus.write_word_data(self.address, reg, value)
+      self.transfer('write16', 2, 'write_word_data', reg, value)
       if self.debug:
         print ("I2C: Wrote 0x%02X to register pair 0x%02X,0x%02X" %
          (value, reg, reg+1))
@@ -73,14 +286,14 @@ class Adafruit_I2C :
       if self.debug:
         print "I2C: Writing list to register 0x%02X:" % reg
         print list
-      self.bus.write_i2c_block_data(self.address, reg, list)
+      self.transfer('writeList', len(list), 'write_i2c_block_data', reg, list)
     except IOError, err:
       return self.errMsg()
 
   def readList(self, reg, length):
     "Read a list of bytes from the I2C device"
     try:
-      results = self.bus.read_i2c_block_data(self.address, reg, length)
+      results = self.transfer('readList', length, 'read_i2c_block_data', reg, length)
       if self.debug:
         print ("I2C: Device 0x%02X returned the following from reg 0x%02X" %
          (self.address, reg))
@@ -92,7 +305,7 @@ class Adafruit_I2C :
   def readU8(self, reg):
     "Read an unsigned byte from the I2C device"
     try:
-      result = self.bus.read_byte_data(self.address, reg)
+      result = self.transfer('readU8', 1, 'read_byte_data', reg)
       if self.debug:
         print ("I2C: Device 0x%02X returned 0x%02X from reg 0x%02X" %
          (self.address, result & 0xFF, reg))
@@ -103,7 +316,7 @@ class Adafruit_I2C :
   def readS8(self, reg):
     "Reads a signed byte from the I2C device"
     try:
-      result = self.bus.read_byte_data(self.address, reg)
+      result = self.transfer('readS8', 1, 'read_byte_data', reg)
       if result > 127: result -= 256
       if self.debug:
         print ("I2C: Device 0x%02X returned 0x%02X from reg 0x%02X" %
@@ -112,26 +325,56 @@ class Adafruit_I2C :
     except IOError, err:
       return self.errMsg()
 
-  def readU16(self, reg):
+  def readU16(self, reg, little_endian=True):
     "Reads an unsigned 16-bit value from the I2C device"
     try:
-      result = self.bus.read_word_data(self.address,reg)
+      result = self.transfer('readU16', 2, 'read_word_data', reg)
+      # Swap bytes if using big endian because read_word_data assumes little
+      # endian on ARM (little endian) systems.
+      if not little_endian:
+        result = ((result << 8) & 0xFF00) + (result >> 8)
       if (self.debug):
         print "I2C: Device 0x%02X returned 0x%04X from reg 0x%02X" % (self.address, result & 0xFFFF, reg)
       return result
     except IOError, err:
       return self.errMsg()
 
-  def readS16(self, reg):
+  def readS16(self, reg, little_endian=True):
     "Reads a signed 16-bit value from the I2C device"
     try:
-      result = self.bus.read_word_data(self.address,reg)
-      if (self.debug):
-        print "I2C: Device 0x%02X returned 0x%04X from reg 0x%02X" % (self.address, result & 0xFFFF, reg)
+      result = self.readU16(reg, little_endian)
+      if result > 32767: result -= 65536
       return result
     except IOError, err:
       return self.errMsg()
 
+  def readStruct(self, reg, fmt):
+    """Reads consecutive registers in a single block transaction and decodes
+    them with a struct format, e.g. '>hH' for a big endian signed and
+    unsigned 16-bit pair. Raises IOError as -1 is a valid decoded value."""
+    length = struct.calcsize(fmt)
+    try:
+      results = self.transfer('readStruct', length, 'read_i2c_block_data', reg, length)
+    except IOError, err:
+      self.errMsg()
+      raise
+    if self.debug:
+      print ("I2C: Device 0x%02X returned the following from reg 0x%02X" %
+       (self.address, reg))
+      print results
+    if len(results) != length:
+      raise IOError("Short read from 0x%02X: %d of %d bytes" %
+       (self.address, len(results), length))
+    return struct.unpack(fmt, bytearray(results))
+
+  def readRegisters(self, reg, layout, big_endian=True):
+    """Reads consecutive registers in a single block transaction and returns
+    a dict decoded from a layout of (name, struct code) pairs, e.g.
+    (('msb', 'B'), ('word', 'h'))"""
+    fmt = ('>' if big_endian else '<') + ''.join([code for name, code in layout])
+    values = self.readStruct(reg, fmt)
+    return dict(zip([name for name, code in layout], values))
+
 if __name__ == '__main__':
   try:
     bus = Adafruit_I2C(address=0)
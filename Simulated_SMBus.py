@@ -0,0 +1,167 @@
+#!/usr/bin/python
+
+import time
+import errno
+import random
+import struct
+from Adafruit_BMP085 import BMP085
+
+# ===========================================================================
+# SimulatedSMBus Class
+# ===========================================================================
+
+class SimulatedSMBus :
+  """In-memory drop-in for smbus.SMBus that routes transactions to simulated
+  devices, with per-transaction latency and fault injection"""
+
+  def __init__(self, busnum=1, latency=0.0, faultRate=0.0, seed=None):
+    self.busnum = busnum
+    self.latency = latency      # seconds spent on every transaction
+    self.faultRate = faultRate  # probability of a transaction failing
+    self.devices = {}
+    self.transactions = 0
+    self.counts = {}
+    self._failNext = 0
+    self._random = random.Random(seed)
+
+  def attach(self, device):
+    "Connects a simulated device to the bus at its address"
+    self.devices[device.address] = device
+    return device
+
+  def failNext(self, count=1):
+    "Makes the next count transactions fail with IOError"
+    self._failNext += count
+
+  def resetCounts(self):
+    "Clears the transaction counters"
+    self.transactions = 0
+    self.counts = {}
+
+  def transaction(self, kind, address):
+    "Accounts for one transaction and returns the addressed device"
+    self.transactions += 1
+    self.counts[kind] = self.counts.get(kind, 0) + 1
+    if self.latency > 0:
+      time.sleep(self.latency)
+    if self._failNext > 0:
+      self._failNext -= 1
+      raise IOError(errno.EREMOTEIO, "Remote I/O error (injected)")
+    if self.faultRate > 0 and self._random.random() < self.faultRate:
+      raise IOError(errno.EREMOTEIO, "Remote I/O error (injected)")
+    if address not in self.devices:
+      raise IOError(errno.EREMOTEIO, "Remote I/O error (no device at 0x%02X)" % address)
+    return self.devices[address]
+
+  def read_byte_data(self, addr, cmd):
+    return self.transaction('read_byte_data', addr).read(cmd, 1)[0]
+
+  def write_byte_data(self, addr, cmd, val):
+    self.transaction('write_byte_data', addr).write(cmd, [val & 0xFF])
+
+  def read_word_data(self, addr, cmd):
+    lo, hi = self.transaction('read_word_data', addr).read(cmd, 2)
+    return (hi << 8) + lo
+
+  def write_word_data(self, addr, cmd, val):
+    self.transaction('write_word_data', addr).write(cmd, [val & 0xFF, (val >> 8) & 0xFF])
+
+  def read_i2c_block_data(self, addr, cmd, length=32):
+    return self.transaction('read_i2c_block_data', addr).read(cmd, length)
+
+  def write_i2c_block_data(self, addr, cmd, vals):
+    self.transaction('write_i2c_block_data', addr).write(cmd, [val & 0xFF for val in vals])
+
+  def open(self, busnum):
+    self.busnum = busnum
+
+  def close(self):
+    pass
+
+# ===========================================================================
+# SimulatedBMP085 Class
+# ===========================================================================
+
+class SimulatedBMP085 :
+  """Register map of a BMP085: calibration EEPROM, chip ID, a control
+  register that starts timed conversions and the result registers"""
+
+  # Conversion times in seconds from the datasheet (pressure is indexed by mode)
+  TEMPDELAY = 0.0045
+  PRESSUREDELAY = (0.0045, 0.0075, 0.0135, 0.0255)
+
+  def __init__(self, address=0x77, cal=BMP085.DATASHEET_CAL,
+               ut=BMP085.DATASHEET_UT, up=BMP085.DATASHEET_UP,
+               noise=0.0, chipID=0x55, seed=None):
+    self.address = address
+    self.ut = ut        # raw temperature
+    self.up = up        # raw pressure in ULTRALOWPOWER mode, scaled by mode
+    self.noise = noise  # standard deviation of raw pressure noise
+    self.regs = bytearray(256)
+    self.regs[0xAA:0xC0] = bytearray(struct.pack('>hhhHHHhhhhh', *cal))
+    self.regs[0xD0] = chipID
+    self.conversions = 0
+    self._pending = None  # (command, ready at) of the running conversion
+    self._random = random.Random(seed)
+
+  def update(self):
+    "Latches the conversion result once the conversion time has passed"
+    if self._pending is None:
+      return
+    command, readyAt = self._pending
+    if time.time() < readyAt:
+      return
+    self._pending = None
+    if command == 0x2E:
+      self.regs[0xF6:0xF8] = bytearray(struct.pack('>H', self.ut & 0xFFFF))
+    else:
+      mode = command >> 6
+      raw = (int(round(self._random.gauss(self.up, self.noise))) if self.noise > 0 else self.up) << mode
+      raw = (raw << (8 - mode)) & 0xFFFFFF
+      self.regs[0xF6:0xF9] = bytearray(struct.pack('>I', raw)[1:])
+    # Start of conversion bit clears once the result is available
+    self.regs[0xF4] &= ~0x20 & 0xFF
+
+  def read(self, reg, length):
+    self.update()
+    return [self.regs[(reg + i) & 0xFF] for i in range(length)]
+
+  def write(self, reg, values):
+    self.update()
+    for i, value in enumerate(values):
+      # Calibration EEPROM, chip ID and result registers are read-only
+      if (reg + i) == 0xF4:
+        self.control(value)
+
+  def control(self, value):
+    "Starts a temperature (0x2E) or pressure (0x34 + mode << 6) conversion"
+    command = value & 0x3F
+    if command == 0x2E:
+      delay = self.TEMPDELAY
+    elif command == 0x34:
+      delay = self.PRESSUREDELAY[value >> 6]
+    else:
+      self.regs[0xF4] = value
+      return
+    self.conversions += 1
+    self.regs[0xF4] = value | 0x20
+    self._pending = (value, time.time() + delay)
+
+if __name__ == '__main__':
+  # Benchmark BMP085 bus transactions and wall time on a simulated 100kHz bus
+  samples = 20
+  for mode in range(4):
+    bus = SimulatedSMBus(latency=0.0003)
+    chip = bus.attach(SimulatedBMP085())
+    bmp = BMP085(mode=mode, bus=bus)
+    for name, read in (('readTemperature+readPressure',
+                        lambda: (bmp.readTemperature(), bmp.readPressure())),
+                       ('readAll', bmp.readAll)):
+      bus.resetCounts()
+      start = time.time()
+      for i in range(samples):
+        read()
+      elapsed = time.time() - start
+      print "mode %d %-28s %5.1f transactions %7.2f ms per sample" % \
+        (mode, name, bus.transactions / float(samples), elapsed * 1000.0 / samples)
+    bmp.i2c.close()
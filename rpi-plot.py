@@ -33,11 +33,14 @@
    - Plotly library: pip install plotly
    - daemon library: pip install daemon
    - gspread library: pip install gspread
+   - NumPy library (optional, batch BMP085 compensation): pip install numpy
 
    Important notes:
    - Raspberry PI model A users need to edit Adafruit_I2C.py and do the following change:
 
-   self.bus = smbus.SMBus(0);
+   busnum = 0 # Force I2C0 (early 256MB Pi's)
+
+   - BMP085 calibration data is read from the EEPROM in one transaction; set BMP085_CAL_CACHE to cache it in $HOME
 
    - You can store Weather Underground configuration in /root/.weather_underground.rc:
 
@@ -73,19 +76,27 @@ import sys
 import os
 import socket
 import json
-import urllib2
 import atexit
 import threading
 import signal
 import logging
-import Queue
 
 import requests.exceptions
-import gspread
 import Adafruit_DHT
+import Adafruit_I2C
 import Adafruit_BMP085
+import rpi_acquisition
+import rpi_weather
+import rpi_gdocs
+import rpi_spool
+import rpi_plotly
+import rpi_store
+import rpi_rollup
+import rpi_metrics
+import rpi_deadband
+import rpi_dht
+import rpi_ring
 import daemon
-import plotly.exceptions
 import plotly.plotly
 import plotly.tools
 import RPi.GPIO
@@ -94,16 +105,51 @@ from plotly.graph_objs import Data, Layout, Figure, Stream, Scatter, YAxis, XAxi
 
 DHT_VER = 22  # 11, 22 or 2302
 DHT_GPIO = 4  # any connected GPIO
+DHT_INTERVAL = 2  # seconds between DHT read attempts (2 for DHT22 and DHT2302, 1 for DHT11)
+DHT_WINDOW = 3  # good DHT reads per readout median filtered against spikes, DHT_INTERVAL apart (1 = no filtering)
+DHT_TEMP_SERIES = False  # publish DHT temperature as its own series (needs a sixth Plotly stream id)
 BMP085_ADDRESS = 0x77  # I2C address
 BMP085_MODE = 1  # 0 = ULTRALOWPOWER, 1 = STANDARD, 2 = HIRES, 3 = ULTRAHIRES
+BMP085_CAL_CACHE = None  # calibration cache file in $HOME or None (the EEPROM is read in one transaction anyway)
+# one BMP temperature conversion is reused until either limit is reached; 0 disables that limit, and with both at 0
+# the temperature is converted on every sample
+BMP085_TEMP_MAX_AGE = 0  # seconds to reuse one BMP temperature conversion (0 = no age limit, see above)
+BMP085_TEMP_MAX_SAMPLES = 0  # pressure samples to reuse one BMP temperature conversion (0 = no count limit, see above)
+BMP085_BURST = 1  # back-to-back BMP pressure conversions filtered into one reading (1 = no burst)
+BMP085_BURST_FILTER = 'median'  # median or trimmed (mean) burst outlier rejection
 LED_GPIO = 27  # any connected GPIO or None if not used
 
-SLEEP_DELAY = 300  # poll delay (never set this to less than 2 seconds!)
+SLEEP_DELAY = 300  # default poll delay of each sensor (never set this to less than 2 seconds!)
 PLOTLY_CHART_NAME = 'Raspberry PI'  # graph title
 MAX_POINTS = 300  # graph data points
 TRACE_MODE = 'lines'  # lines or lines+markers trace type (recommended lines for a lot of data points)
 GRAPH_MODE = 'overwrite'  # append or overwrite previous traces (recommended overwrite)
+# trace streams in sample order
+PLOTLY_TRACES = ('cpu', 'temp', 'humidity', 'pressure', 'wu') + (('dht_temp',) if DHT_TEMP_SERIES else ())
+PLOTLY_HEARTBEAT = 30  # seconds of stream inactivity before a heartbeat keeps it open
+PLOTLY_MAX_BACKOFF = 1024  # maximal seconds between reconnects of a failed stream
+CHART_SPAN = None  # seconds of history drawn in MAX_POINTS chart points (e.g. 30 * 86400) or None for raw samples
+# change of each series needed to publish it (e.g. cpu 0.5, temp 0.1, humidity 0.5, pressure 0.1, wu 0.1), 0 for any
+# change or None to publish every sample; filtered samples are still kept in local history and rollups
+DEADBAND = {'cpu': None, 'temp': None, 'humidity': None, 'pressure': None, 'wu': None, 'dht_temp': None}
+DEADBAND_HEARTBEAT = 1800  # seconds after which an unchanged series is published anyway (None = never)
 LED_BLINK = 5  # seconds for background LED pulse
+CYCLE_DEADLINE = 60  # seconds for all sensors to be read in one cycle, late readouts are marked stale
+SENSOR_NAMES = ('cpu', 'dht', 'bmp', 'wu')
+# seconds for each sensor readout (dht only takes the last good value of its own reader thread)
+SENSOR_TIMEOUTS = {'cpu': 2, 'dht': 2, 'bmp': 5, 'wu': 30}
+# seconds between readouts of each sensor (e.g. cpu 5, bmp 30, dht 60, wu 900) and offset of the first readout
+SENSOR_PERIODS = {'cpu': SLEEP_DELAY, 'dht': SLEEP_DELAY, 'bmp': SLEEP_DELAY, 'wu': SLEEP_DELAY}
+SENSOR_PHASES = {'cpu': 0, 'dht': 0, 'bmp': 0, 'wu': 0}
+SENSOR_SERIES = {'cpu': ('temperature',), 'dht': ('humidity', 'temperature'), 'bmp': ('temperature', 'pressure'),
+                 'wu': ('temperature',)}  # values of each sensor readout
+SENSOR_BREAKER_THRESHOLD = 3  # consecutive failed readouts after which a sensor is degraded and publishes gaps
+SENSOR_RETRY_DELAY = 10  # initial seconds before a degraded sensor is retried (doubled on every failed retry)
+SENSOR_MAX_RETRY_DELAY = 600  # maximal seconds between retries of a degraded sensor
+SENSOR_ERRORS = {'cpu': 'CPU0 thermal zone reading failure: %s',
+                 'dht': 'GPIO DHT reading failure: %s',
+                 'bmp': 'I2C BMP085 reading failure: %s',
+                 'wu': 'Weather Underground reading failure: %s'}
 
 WU_KEY = None
 WU_STATE = None
@@ -111,13 +157,50 @@ WU_CITY = None
 WU_API_URL = 'http://api.wunderground.com/api/'
 WU_API_QUERY = '/geolookup/conditions/q/'
 WU_FAKE_TEMP = 21.0
+WU_CACHE_TTL = 600  # seconds to reuse the last observation before asking Weather Underground again
 
 GDOCS_EMAIL = None
 GDOCS_PASSWORD = None
 GDOCS_SHEET = None
 GDOCS_SHEET_PATTERN = '%Y-%B'  # Year-Month pattern in naming sheets (one sheet per each month)
-
-DATA_QUEUE = Queue.Queue()
+GDOCS_BATCH_ROWS = 10  # rows appended to Google Docs in one batch
+GDOCS_BATCH_AGE = 300  # seconds after which spooled rows are appended regardless of batch size
+GDOCS_MAX_BACKOFF = 1024  # maximal seconds between retries of a failed Google Docs append
+
+SPOOL_DIR = '/var/spool/rpi-plot'  # disk-backed queue of samples not yet published
+SPOOL_SEGMENT_RECORDS = 8192  # samples per spool segment file
+SPOOL_MAX_SEGMENTS = 64  # spool segment files kept before the oldest undelivered samples are dropped
+SPOOL_SYNC_RECORDS = 16  # samples written between two fsyncs of the spool
+SPOOL_SYNC_INTERVAL = 5  # maximum seconds a spooled sample or sink cursor stays unsynced
+
+STORE_DIR = '/var/lib/rpi-plot'  # local sample history or None if not used
+STORE_SEGMENT_ROWS = 65536  # samples per history segment file
+STORE_MAX_SEGMENTS = None  # history segment files kept before the oldest are deleted (None = keep everything)
+ROLLUP_RESOLUTIONS = (60, 3600, 86400)  # seconds per min/max/mean/count rollup bucket
+ROLLUP_HISTORY = (1440, 2160, 1095)  # rollup buckets kept per resolution (a day, 90 days and 3 years)
+ROLLUP_SNAPSHOT_INTERVAL = 3600  # seconds between rollup snapshots in STORE_DIR, startup only replays samples since
+
+METRICS_PORT = 9105  # Prometheus metrics endpoint port or None if not used
+METRICS_ADDRESS = ''  # metrics endpoint bind address (all interfaces if empty)
+STATS_LOG_INTERVAL = 3600  # seconds between pipeline statistics log lines (also dumped on SIGUSR1) or None
+
+SPLIT_PROCESSES = False  # acquire and publish in separate processes joined by a shared-memory ring buffer
+RING_CAPACITY = 4096  # samples the publishing process may fall behind before the oldest are lost
+ACQUISITION_PRIORITY = 0  # niceness taken off the acquisition process when split (e.g. 10), 0 to leave it as is
+PUBLISHER_METRICS_PORT = 9106  # metrics endpoint port of the publishing process when split or None if not used
+
+BMP = None  # BMP085 device structure, None until it could be initialized
+SPOOL = None
+STORE = None
+ROLLUP = None
+RING = None  # rpi_ring.SampleRing to the publishing process when split
+PUBLISHER = None  # process id of the publishing process while it is running
+SINKS = {}  # rpi_spool.SinkWorker per publishing sink name
+DEADBANDS = {}  # rpi_deadband.Deadband per publishing sink name
+CHART_NEXT = None  # start of the first chart point bucket not drawn yet if CHART_SPAN is set
+LATEST_READINGS = {}  # latest rpi_acquisition.Reading per sensor name
+BREAKERS = {}  # rpi_acquisition.CircuitBreaker per sensor name
+STATS = rpi_metrics.StageStats()  # latency, failures, retries and backoff per pipeline stage
 
 
 def led_pulse():
@@ -154,6 +237,8 @@ def init_logging(debug=False):
         logging.basicConfig(level=logging.DEBUG, format='%(asctime)-15s %(message)s')
     else:
         logging.basicConfig(level=logging.WARNING, format='%(asctime)-15s %(message)s')
+        # pipeline statistics are asked for (STATS_LOG_INTERVAL, SIGUSR1), so they are logged outside debug mode too
+        logging.getLogger('stats').setLevel(logging.INFO)
 
 
 def init_led():
@@ -192,25 +277,43 @@ def init_bmp():
     """
     Initializes BMP085, BMP180 or BMP183 devices.
 
-    :return: Returns initialized BMP085 device structure
+    :return: Returns initialized BMP085 device structure or None if it failed (retried by the BMP circuit breaker)
     """
     logger = logging.getLogger(sys._getframe().f_code.co_name)
 
-    try:
+    cal_cache = None
+    if not BMP085_CAL_CACHE is None:
+        cal_cache = ''.join([os.environ['HOME'], os.sep, BMP085_CAL_CACHE])
 
-        bmp = Adafruit_BMP085.BMP085(BMP085_ADDRESS, BMP085_MODE)
+    try:
+        bmp = Adafruit_BMP085.BMP085(BMP085_ADDRESS, BMP085_MODE, calCache=cal_cache,
+                                     tempMaxAge=BMP085_TEMP_MAX_AGE, tempMaxSamples=BMP085_TEMP_MAX_SAMPLES)
     except IOError, e:
-        logger.error('I2C BMP085 reading failure: %s' % e)
-        sys.exit(1)
+        logger.error('I2C BMP085 initialization failure: %s' % e)
+        return None
 
     return bmp
 
 
+def recover_bmp():
+    """
+    Re-open the I2C bus of a degraded BMP085, or initialize it if that never succeeded.
+    """
+    global BMP
+
+    if BMP is None:
+        # the failed initialization released its bus reference, but other devices may keep the bus open
+        Adafruit_I2C.Adafruit_I2C.reopenBus()
+        BMP = init_bmp()
+    else:
+        BMP.reopen()
+
+
 def init_plotly():
     """
     Prepares authenticate tokens for each trace, prepares layout and streams with corresponding scatter graph traces.
 
-    :return: Returns initialized stream IDs for each trace
+    :return: Returns started stream session with a stream for each trace
     """
     logger = logging.getLogger(sys._getframe().f_code.co_name)
 
@@ -218,7 +321,12 @@ def init_plotly():
     plotly_creds = plotly.tools.get_credentials_file()
     username = plotly_creds['username']
     api_key = plotly_creds['api_key']
-    token_cpu, token_temp, token_humidity, token_pressure, token_wu = plotly_creds['stream_ids'][0:5]
+    stream_ids = plotly_creds['stream_ids'][0:len(PLOTLY_TRACES)]
+    if len(stream_ids) < len(PLOTLY_TRACES):
+        logger.error('Plotly credentials hold %d stream ids, %d are needed (one per trace%s). Exiting...' %
+                     (len(stream_ids), len(PLOTLY_TRACES), ' with DHT_TEMP_SERIES' if DHT_TEMP_SERIES else ''))
+        sys.exit(1)
+    token_cpu, token_temp, token_humidity, token_pressure, token_wu = stream_ids[0:5]
 
     plotly.plotly.sign_in(username, api_key)
 
@@ -242,9 +350,14 @@ def init_plotly():
     my_scatter_wu = Scatter(x=[], y=[], stream=my_stream_wu, name='Outdoor temperature (Weather Underground)',
                             mode=TRACE_MODE)
 
+    my_scatters = [my_scatter_cpu, my_scatter_temp, my_scatter_humidity, my_scatter_pressure, my_scatter_wu]
+    if DHT_TEMP_SERIES:
+        my_stream_dht_temp = Stream(token=stream_ids[5], maxpoints=MAX_POINTS)
+        my_scatters.append(Scatter(x=[], y=[], stream=my_stream_dht_temp, name='Environment temperature (DHT)',
+                                   mode=TRACE_MODE))
+
     # prepare Data structure
-    my_data = Data([my_scatter_cpu, my_scatter_temp, my_scatter_humidity,
-                    my_scatter_pressure, my_scatter_wu])
+    my_data = Data(my_scatters)
 
     # create Layout structure where we have one shared X axis (time series) and two Y axis, one left side (temperature
     # and humidity) and one right side (pressure)
@@ -265,19 +378,20 @@ def init_plotly():
         logger.error('Cannot connect to PlotLy to create chart: %s. Exiting...' % e)
         sys.exit(1)
 
-    # initialize Stream structures with different stream ids, so that each has its own trace
-    s_cpu = plotly.plotly.Stream(token_cpu)
-    s_temp = plotly.plotly.Stream(token_temp)
-    s_humidity = plotly.plotly.Stream(token_humidity)
-    s_pressure = plotly.plotly.Stream(token_pressure)
-    s_wu = plotly.plotly.Stream(token_wu)
+    # initialize Stream structures with different stream ids, so that each has its own trace, and keep them open
+    session = rpi_plotly.StreamSession(dict(zip(PLOTLY_TRACES, [plotly.plotly.Stream(token) for token in stream_ids])),
+                                       heartbeat=PLOTLY_HEARTBEAT, max_delay=PLOTLY_MAX_BACKOFF, stats=STATS)
+    session.start()
+    atexit.register(session.close)
 
-    return s_cpu, s_humidity, s_pressure, s_temp, s_wu
+    return session
 
 
 def init_gdocs():
     """
-    Initialize Google Docs globals from $HOME/.google_docs.rc JSON if it exists.
+    Initialize Google Docs globals from $HOME/.google_docs.rc JSON if it exists and prepare a persistent session.
+
+    :return: Google Docs session or None if unconfigured
     """
     global GDOCS_EMAIL
     global GDOCS_PASSWORD
@@ -310,13 +424,23 @@ def init_gdocs():
     except IOError, e:
         logger.warning('Could not open/read Google Docs configuration in %s: %s' % (gdocs_file, e))
 
+    if GDOCS_EMAIL is None or GDOCS_PASSWORD is None or GDOCS_SHEET is None:
+        return None
+
+    header = rpi_gdocs.GDOCS_HEADER
+    if DHT_TEMP_SERIES:
+        header += ('DHT Temperature [C]',)
+
+    return rpi_gdocs.GDocsSession(GDOCS_EMAIL, GDOCS_PASSWORD, GDOCS_SHEET, GDOCS_SHEET_PATTERN, header=header,
+                                  stats=STATS)
+
 
 def init_weather_underground():
     """
     Initialize Weather Undeground API from either globals or $HOME/.weather_underground.rc JSON with later one
     being preferred.
 
-    :return: returns full Weather Underground API URL
+    :return: returns Weather Underground fetcher for full API URL or None if unconfigured
     """
     global WU_KEY
     global WU_STATE
@@ -353,33 +477,308 @@ def init_weather_underground():
         logger.warning('Weather Underground unconfigured. Simulating.')
         return None
     else:
-        return ''.join([WU_API_URL, WU_KEY, WU_API_QUERY, WU_STATE, '/', WU_CITY, '.json'])
+        wu_url = ''.join([WU_API_URL, WU_KEY, WU_API_QUERY, WU_STATE, '/', WU_CITY, '.json'])
+        return rpi_weather.WeatherUnderground(wu_url, ttl=WU_CACHE_TTL, timeout=SENSOR_TIMEOUTS['wu'],
+                                              fallback=WU_FAKE_TEMP)
+
 
+def init_spool():
+    """
+    Open the disk-backed sample spool, keeping samples left undelivered by a previous run.
 
-def backoff_sleep(reset=False, delay=2, max_delay=1024):
+    :return: rpi_spool.Spool object
     """
-    Sleep function with exponential backoff with deterministic maximum and option to reset delay to default.
+    spool = rpi_spool.Spool(SPOOL_DIR, fields=len(PLOTLY_TRACES), segment_records=SPOOL_SEGMENT_RECORDS,
+                            sync_records=SPOOL_SYNC_RECORDS, sync_interval=SPOOL_SYNC_INTERVAL,
+                            max_segments=SPOOL_MAX_SEGMENTS)
+    atexit.register(spool.close)
+
+    return spool
+
+
+def init_store():
+    """
+    Open the local sample history.
+
+    :return: rpi_store.TimeSeriesStore object or None if not used
+    """
+    if STORE_DIR is None:
+        return None
+
+    store = rpi_store.TimeSeriesStore(STORE_DIR, fields=len(PLOTLY_TRACES), segment_rows=STORE_SEGMENT_ROWS,
+                                      max_segments=STORE_MAX_SEGMENTS)
+    atexit.register(store.close)
 
-    :param reset: Resets the next run to default delay without backoff
-    :param delay: Initial backoff delay
-    :param max_delay: Maximal backoff after which delay becomes constant
+    return store
+
+
+def init_rollup():
     """
-    global _backoff_delay
+    Set up the rollups (including one point per chart bucket if CHART_SPAN is set) from their last snapshot and the
+    local history taken since, or from the whole local history they cover if there is no usable snapshot. The
+    snapshot is then saved every ROLLUP_SNAPSHOT_INTERVAL seconds and on exit.
 
+    :return: rpi_rollup.Rollup object
+    """
     logger = logging.getLogger(sys._getframe().f_code.co_name)
 
-    if reset:
-        _backoff_delay = None
+    resolutions = list(ROLLUP_RESOLUTIONS)
+    history = list(ROLLUP_HISTORY)
+    if CHART_SPAN is not None and chart_resolution() not in resolutions:
+        resolutions.append(chart_resolution())
+        history.append(2 * MAX_POINTS)
+
+    rollup = rpi_rollup.Rollup(resolutions, history, fields=len(PLOTLY_TRACES))
+
+    if STORE is None:
+        return rollup
+
+    snapshot = os.path.join(STORE_DIR, 'rollup.json')
+    if rollup.load(snapshot):
+        start = rollup.last
+        logger.info('Loaded rollup snapshot %s.' % snapshot)
     else:
-        if not '_backoff_delay' in globals() or _backoff_delay is None:
-            _backoff_delay = delay
+        start = time.time() - max(resolution * kept for resolution, kept in zip(resolutions, history))
+    count = rollup.replay(STORE.scan(start))
+    logger.info('Rebuilt rollups from %d samples of local history.' % count)
+
+    def save_rollup():
+        try:
+            rollup.save(snapshot)
+        except (IOError, OSError), e:
+            logger.warning('Unable to save rollup snapshot %s: %s' % (snapshot, e))
+
+    def rollup_snapshots():
+        while True:
+            time.sleep(ROLLUP_SNAPSHOT_INTERVAL)
+            save_rollup()
+
+    save_rollup()
+    t = threading.Thread(target=rollup_snapshots, name='rollup-snapshot')
+    t.daemon = True
+    t.start()
+    atexit.register(save_rollup)
+
+    return rollup
+
 
-        logger.info('Backoff initiated for the duration of %d seconds.' % _backoff_delay)
-        time.sleep(_backoff_delay)
+def acquisition_metrics(registry, dht, wu_fetcher, scheduler):
+    """
+    Register latest readouts and sensor counters.
+
+    :param registry: rpi_metrics.Registry object
+    :param dht: DHT reader
+    :param wu_fetcher: Weather Underground fetcher or None if unconfigured
+    :param scheduler: sensor scheduler
+    """
+    def readings():
+        # items() copies the dictionary atomically, so no lock is needed against queue_readings
+        return sorted(LATEST_READINGS.items())
+
+    def sensor_values():
+        for name, reading in readings():
+            values = reading.value if isinstance(reading.value, tuple) else (reading.value,)
+            for series, value in zip(SENSOR_SERIES[name], values):
+                yield {'sensor': name, 'series': series}, value
+
+    def sensor_ages():
+        now = time.time()
+        for name, reading in readings():
+            if reading.timestamp is not None:
+                yield {'sensor': name}, now - reading.timestamp
+
+    def i2c_kinds():
+        return sorted(BMP.i2c.stats.kinds.items()) if BMP is not None else []
+
+    def breakers():
+        return sorted(BREAKERS.items())
+
+    registry.register('sensor_value', 'gauge', 'Latest sensor readout.', sensor_values)
+    registry.register('sensor_timestamp_seconds', 'gauge', 'Capture time of the latest sensor readout.',
+                      lambda: (({'sensor': name}, reading.timestamp) for name, reading in readings()))
+    registry.register('sensor_age_seconds', 'gauge', 'Age of the latest sensor readout.', sensor_ages)
+    registry.register('sensor_stale', 'gauge', 'Whether the latest sensor readout is stale.',
+                      lambda: (({'sensor': name}, reading.stale) for name, reading in readings()))
+    registry.register('sensor_overruns_total', 'counter', 'Sensor readouts skipped as the previous one was running.',
+                      lambda: (({'sensor': name}, count) for name, count in sorted(scheduler.overruns.items())))
+    registry.register('sensor_degraded', 'gauge', 'Whether a sensor is degraded by its circuit breaker.',
+                      lambda: (({'sensor': name}, breaker.degraded) for name, breaker in breakers()))
+    registry.register('sensor_failures_total', 'counter', 'Failed sensor readouts.',
+                      lambda: (({'sensor': name}, breaker.failures) for name, breaker in breakers()))
+    registry.register('sensor_trips_total', 'counter', 'Times a sensor was degraded by its circuit breaker.',
+                      lambda: (({'sensor': name}, breaker.trips) for name, breaker in breakers()))
+    registry.register('sensor_recoveries_total', 'counter', 'Times a degraded sensor recovered.',
+                      lambda: (({'sensor': name}, breaker.recoveries) for name, breaker in breakers()))
+    registry.register('i2c_transactions_total', 'counter', 'BMP085 I2C transactions.',
+                      lambda: (({'kind': kind}, entry[0]) for kind, entry in i2c_kinds()))
+    registry.register('i2c_errors_total', 'counter', 'Failed BMP085 I2C transactions.',
+                      lambda: (({'kind': kind}, entry[1]) for kind, entry in i2c_kinds()))
+    registry.register('i2c_reopens_total', 'counter', 'BMP085 I2C bus re-opens after errors.',
+                      lambda: [({}, BMP.i2c.handle.reopens)] if BMP is not None else [])
+    registry.register('dht_attempts_total', 'counter', 'DHT read attempts.', lambda: [({}, dht.attempts)])
+    registry.register('dht_failed_attempts_total', 'counter', 'Failed DHT read attempts.',
+                      lambda: [({}, dht.failures)])
+    registry.register('dht_rejected_total', 'counter', 'DHT reads rejected as implausible.',
+                      lambda: [({}, dht.rejected)])
+    registry.register('dht_missed_total', 'counter', 'DHT readouts without a valid read.', lambda: [({}, dht.missed)])
+    registry.register('dht_retry_budget', 'gauge', 'DHT read attempts allowed per readout.',
+                      lambda: [({}, dht.budget())])
+    if wu_fetcher is not None:
+        registry.register('wu_requests_total', 'counter', 'Weather Underground API requests.',
+                          lambda: [({}, wu_fetcher.requests)])
+        registry.register('wu_not_modified_total', 'counter', 'Weather Underground API requests answered with 304.',
+                          lambda: [({}, wu_fetcher.not_modified)])
+    if RING is not None:
+        registry.register('ring_written_total', 'counter', 'Samples written to the publishing process ring.',
+                          lambda: [({}, RING.written)])
+
+
+def publishing_metrics(registry, session, gdocs):
+    """
+    Register spool, sink, history and publishing counters.
 
-        _backoff_delay *= 2
-        if _backoff_delay > max_delay:
-            _backoff_delay = max_delay
+    :param registry: rpi_metrics.Registry object
+    :param session: Plotly stream session
+    :param gdocs: Google Docs session or None if unconfigured
+    """
+    registry.register('spool_backlog', 'gauge', 'Spooled samples not yet delivered to a sink.',
+                      lambda: (({'sink': name}, SPOOL.depth(name)) for name in sorted(SINKS)))
+    registry.register('spool_oldest_age_seconds', 'gauge', 'Age of the oldest sample not yet delivered to a sink.',
+                      lambda: (({'sink': name}, sink_oldest_age(name)) for name in sorted(SINKS)))
+    registry.register('spool_dropped_total', 'counter', 'Undelivered samples dropped from a full spool.',
+                      lambda: [({}, SPOOL.dropped)])
+    registry.register('sink_delivered_total', 'counter', 'Samples delivered to a sink.',
+                      lambda: (({'sink': name}, worker.delivered) for name, worker in sorted(SINKS.items())))
+    registry.register('sink_skipped_total', 'counter', 'Samples skipped by a sink over its backlog limit.',
+                      lambda: (({'sink': name}, worker.skipped) for name, worker in sorted(SINKS.items())))
+    registry.register('sink_failures_total', 'counter', 'Failed sink deliveries.',
+                      lambda: (({'sink': name}, worker.failures) for name, worker in sorted(SINKS.items())))
+    registry.register('deadband_published_total', 'counter', 'Series values published past the deadband.',
+                      lambda: (({'sink': name, 'series': series}, count) for name, deadband in sorted(DEADBANDS.items())
+                               for series, count in zip(PLOTLY_TRACES, deadband.published)))
+    registry.register('deadband_dropped_total', 'counter', 'Unchanged series values not published.',
+                      lambda: (({'sink': name, 'series': series}, count) for name, deadband in sorted(DEADBANDS.items())
+                               for series, count in zip(PLOTLY_TRACES, deadband.dropped)))
+    if STORE is not None:
+        registry.register('store_samples', 'gauge', 'Samples kept in local history.', lambda: [({}, len(STORE))])
+    registry.register('plotly_writes_total', 'counter', 'Plotly stream writes.', lambda: [({}, session.writes)])
+    registry.register('plotly_failures_total', 'counter', 'Failed Plotly stream operations.',
+                      lambda: [({}, session.failures)])
+    registry.register('plotly_reconnects_total', 'counter', 'Plotly stream reconnects.',
+                      lambda: [({}, session.reconnects)])
+    registry.register('plotly_backoff_seconds_total', 'counter', 'Plotly stream reconnect backoff.',
+                      lambda: [({}, session.backoff_time)])
+    if gdocs is not None:
+        registry.register('gdocs_rows_total', 'counter', 'Rows appended to Google Docs.',
+                          lambda: [({}, gdocs.written)])
+    if RING is not None:
+        registry.register('ring_consumed_total', 'counter', 'Samples taken from the acquisition process ring.',
+                          lambda: [({}, RING.consumed)])
+        registry.register('ring_lost_total', 'counter', 'Samples overwritten in a full ring before being taken.',
+                          lambda: [({}, RING.lost)])
+
+
+def init_metrics(register, port):
+    """
+    Start a Prometheus metrics endpoint serving latest readouts and internal counters straight from memory.
+
+    :param register: callable registering the metrics of this process on a rpi_metrics.Registry
+    :param port: TCP port to listen on or None if not used
+    :return: rpi_metrics.MetricsServer object or None if not used
+    """
+    logger = logging.getLogger(sys._getframe().f_code.co_name)
+
+    if port is None:
+        return None
+
+    registry = rpi_metrics.Registry()
+    STATS.register(registry)
+    register(registry)
+
+    try:
+        server = rpi_metrics.MetricsServer(registry, port, METRICS_ADDRESS)
+    except socket.error, e:
+        logger.error('Cannot start metrics endpoint on port %d: %s' % (port, e))
+        return None
+    server.start()
+
+    return server
+
+
+def acquisition_stats(dht, scheduler):
+    """
+    :param dht: DHT reader
+    :param scheduler: sensor scheduler
+    :return: sensor statistics as plain dicts (JSON serializable)
+    """
+    stats = {'i2c': BMP.i2c.statistics() if BMP is not None else {},
+             'breakers': dict((name, {'degraded': breaker.degraded, 'failures': breaker.failures,
+                                      'trips': breaker.trips, 'recoveries': breaker.recoveries})
+                              for name, breaker in BREAKERS.items()),
+             'dht': {'attempts': dht.attempts, 'failures': dht.failures, 'rejected': dht.rejected,
+                     'missed': dht.missed, 'budget': dht.budget()},
+             'overruns': dict(scheduler.overruns)}
+    if RING is not None:
+        stats['ring'] = {'written': RING.written}
+
+    return stats
+
+
+def publishing_stats(session, gdocs):
+    """
+    :param session: Plotly stream session
+    :param gdocs: Google Docs session or None if unconfigured
+    :return: spool, sink and publishing statistics as plain dicts (JSON serializable)
+    """
+    stats = {}
+
+    stats['spool'] = {'dropped': SPOOL.dropped}
+    stats['sinks'] = dict((name, {'backlog': SPOOL.depth(name), 'oldest_age': sink_oldest_age(name),
+                                  'delivered': worker.delivered, 'skipped': worker.skipped,
+                                  'failures': worker.failures}) for name, worker in SINKS.items())
+    stats['deadband'] = dict((name, {'published': dict(zip(PLOTLY_TRACES, deadband.published)),
+                                     'dropped': dict(zip(PLOTLY_TRACES, deadband.dropped))})
+                             for name, deadband in DEADBANDS.items())
+    stats['plotly'] = {'writes': session.writes, 'failures': session.failures, 'reconnects': session.reconnects,
+                       'backoff_seconds': session.backoff_time}
+    if gdocs is not None:
+        stats['gdocs'] = {'written': gdocs.written}
+    if RING is not None:
+        stats['ring'] = {'consumed': RING.consumed, 'lost': RING.lost}
+
+    return stats
+
+
+def init_stats(collect):
+    """
+    Log pipeline statistics as JSON every STATS_LOG_INTERVAL seconds and on SIGUSR1.
+
+    :param collect: callable returning the statistics of this process as plain dicts, added to the stage ones
+    """
+    logger = logging.getLogger('stats')
+
+    dump = threading.Event()
+
+    def stats_logger():
+        while True:
+            dump.wait(STATS_LOG_INTERVAL)
+            dump.clear()
+            try:
+                stats = STATS.snapshot()
+                stats.update(collect())
+                logger.info('Pipeline statistics: %s' % json.dumps(stats, sort_keys=True))
+            except Exception, e:
+                logger.exception('Unable to collect pipeline statistics: %s' % e)
+
+    def stats_signal_handler(recvd_signal, stack_frame):
+        # only wake up the logger, as the interrupted thread may hold the locks the dump needs
+        dump.set()
+
+    t = threading.Thread(target=stats_logger, name='stats-log')
+    t.daemon = True
+    t.start()
+
+    signal.signal(signal.SIGUSR1, stats_signal_handler)
 
 
 def read_rpi_cpu():
@@ -401,267 +800,542 @@ def read_rpi_cpu():
     return cpu_temp
 
 
-def read_weather_underground(weather_underground_url=None):
+def read_weather_underground(fetcher=None):
     """
-    Poll Weather Underground API for current outdoor temperature in Celsius.
+    Poll Weather Underground API (through its TTL cache) for current outdoor temperature in Celsius.
 
-    :param weather_underground_url: Full Weather Underground API url for current city, state and with proper API key
-    :return: temperature in Celsius, real or fake temperature
+    :param fetcher: rpi_weather.WeatherUnderground fetcher or None if unconfigured
+    :return: rpi_acquisition.Reading of temperature in Celsius, real or fake temperature
     """
-    global WU_FAKE_TEMP
+    if fetcher is None:
+        return rpi_acquisition.Reading(WU_FAKE_TEMP, time.time(), False)
 
-    logger = logging.getLogger(sys._getframe().f_code.co_name)
+    return fetcher.read()
 
-    if weather_underground_url is None:
-        return WU_FAKE_TEMP
 
-    try:
-        f = urllib2.urlopen(weather_underground_url)
+def format_date_stamp(timestamp):
+    """
+    :param timestamp: epoch time
+    :return: date stamp as published to Plotly and Google Docs
+    """
+    return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S.%f')
 
-        try:
-            json_string = f.read()
-        finally:
-            f.close()
-    except urllib2.URLError, e:
-        logger.error('Could not communicate with Weather Underground API: %s' % e)
-        return WU_FAKE_TEMP
-    except Exception, e:
-        logger.exception('Unable to contact Weather Underground (unexpected situation): %s' % e)
-        return WU_FAKE_TEMP
 
-    try:
-        parsed_json = json.loads(json_string)
-    except ValueError, e:
-        logger.warning('Invalid JSON from Weather Undeground API: %s' % e)
-        return WU_FAKE_TEMP
+def chart_resolution():
+    """
+    :return: seconds per chart point if CHART_SPAN is set
+    """
+    return max(1, int(CHART_SPAN // MAX_POINTS))
 
-    try:
-        temp_c = parsed_json['current_observation']['temp_c']
-    except KeyError, e:
-        logger.warning('Invalid JSON from Weather Undeground API: %s' % e)
-        return WU_FAKE_TEMP
 
-    if isinstance(temp_c, int):
-        temp_c = float(temp_c)
-    elif not isinstance(temp_c, float):
-        logger.warning('Received non-float temperature from Weather Underground: %s' % str(temp_c))
-        return WU_FAKE_TEMP
+def chart_start(timestamp):
+    """
+    :return: start of the chart point bucket of an epoch time if CHART_SPAN is set
+    """
+    return timestamp - timestamp % chart_resolution()
 
-    WU_FAKE_TEMP = temp_c
-    return temp_c
 
+def raw_traces(samples, masks=None):
+    """
+    :param samples: list of sample tuples
+    :param masks: per sample lists of booleans selecting the values of each trace (None for all values)
+    :return: list of (date stamps, values) for each trace in PLOTLY_TRACES order
+    """
+    if masks is None:
+        x = [format_date_stamp(sample[0]) for sample in samples]
+        return [(x, [sample[field] for sample in samples]) for field in xrange(1, len(PLOTLY_TRACES) + 1)]
 
-def login_gdocs():
+    traces = []
+    for field in xrange(len(PLOTLY_TRACES)):
+        selected = [sample for sample, mask in zip(samples, masks) if mask[field]]
+        traces.append(([format_date_stamp(sample[0]) for sample in selected],
+                       [sample[field + 1] for sample in selected]))
+    return traces
+
+
+def chart_window(stop):
+    """
+    Draw the CHART_SPAN before stop from the finest rollup covering it, downsampled to MAX_POINTS with LTTB.
+
+    :param stop: epoch time of the end of the window
+    :return: list of (date stamps, values) for each trace in PLOTLY_TRACES order
     """
-    Login to Google Docs, open Spreadsheet and open a specific worksheet matching the current year
-    and month preferably.
+    resolution = ROLLUP.resolution(CHART_SPAN, stop)
 
-    :return: Google Docs Spreadsheet active worksheet object
+    traces = []
+    for field in xrange(len(PLOTLY_TRACES)):
+        points = rpi_rollup.lttb([(bucket.start, bucket.mean)
+                                  for bucket in ROLLUP.buckets(resolution, field, stop - CHART_SPAN, stop)],
+                                 MAX_POINTS)
+        traces.append(([format_date_stamp(x) for x, y in points], [y for x, y in points]))
+    return traces
+
+
+def chart_buckets(start, stop):
+    """
+    :param start: epoch time of the first chart point bucket
+    :param stop: epoch time after the last chart point bucket
+    :return: list of (date stamps, mean values) of the chart point buckets for each trace in PLOTLY_TRACES order
+    """
+    traces = []
+    for field in xrange(len(PLOTLY_TRACES)):
+        buckets = ROLLUP.buckets(chart_resolution(), field, start, stop)
+        traces.append(([format_date_stamp(bucket.start) for bucket in buckets], [bucket.mean for bucket in buckets]))
+    return traces
+
+
+def publish_plotly(session, traces):
+    """
+    Write to every trace stream, retrying only the streams which failed until all are written.
+
+    :param session: Plotly stream session
+    :param traces: list of (date stamp, value) or of (list of date stamps, list of values) for each trace in
+                   PLOTLY_TRACES order; traces with empty lists are skipped
     """
     logger = logging.getLogger(sys._getframe().f_code.co_name)
 
-    if GDOCS_EMAIL is None or GDOCS_PASSWORD is None or GDOCS_SHEET is None:
-        return None
+    pending = [(name, x, y) for name, (x, y) in zip(PLOTLY_TRACES, traces) if x != []]
+    while pending:
+        pending = [(name, x, y) for name, x, y in pending if not session.write(name, dict(x=x, y=y))]
+        if pending:
+            # the session accounts for the reconnect backoff itself
+            STATS.retry('plotly', len(pending))
+            time.sleep(session.retry_in([name for name, x, y in pending]))
+    logger.debug('Successfully published data to PlotLy.')
 
-    try:
-        g_conn = gspread.login(GDOCS_EMAIL, GDOCS_PASSWORD)
-    except gspread.GSpreadException, e:
-        logger.error('Problem with Google Docs authentication: %s' % e)
-        return None
-    except (socket.error, socket.gaierror, socket.timeout), e:
-        logger.error('Problem contacting Google Docs: %s. Continuing without.' % e)
-        return None
 
-    try:
-        gdc = g_conn.open(GDOCS_SHEET)
-    except gspread.SpreadsheetNotFound, e:
-        logger.error('No such spreadsheet on Google Docs account: %s' % e)
-        return None
-    except (socket.error, socket.gaierror, socket.timeout), e:
-        logger.error('Problem contacting Google Docs: %s' % e)
-        return None
-    except gspread.httpsession.HTTPError:
-        logger.error('Problem contacting Google Docs.')
-        return None
-    except Exception, e:
-        logger.exception('Unable to contact Google Docs (unexpected situation): %s' % e)
-        return None
+def backfill_plotly(session):
+    """
+    Redraw the chart up to the first sample not yet delivered to Plotly from local history (or the CHART_SPAN window
+    from the rollups), as a chart created with GRAPH_MODE overwrite starts out empty.
 
-    sheet_pattern = datetime.datetime.now().strftime(GDOCS_SHEET_PATTERN)
-    try:
-        gdc_worksheet = gdc.worksheet(sheet_pattern)
-    except gspread.WorksheetNotFound, e:
-        logger.info('No such worksheet on Google Docs account: %s. Will create it now.' % e)
+    :param session: Plotly stream session
+    """
+    global CHART_NEXT
 
-        # XXX: hardcoded number of columns for now and hardcoded descriptions
-        try:
-            gdc_worksheet = gdc.add_worksheet(title=sheet_pattern, rows=1, cols=5)
-
-            # date_stamp, cpu_temp, bmp_temp, dht_hum, bmp_pres, wu_temp)
-            gdc_worksheet.append_row((
-                'Date/Time', 'CPU Temperature [C]', 'BMP Temperature [C]', 'DHT Humidity [%]', 'BMP Pressure [hPa]',
-                'WU Temperature [C]'))
-            logger.debug('Successfully created Google Docs worksheet: %s' % sheet_pattern)
-        except gspread.GSpreadException, e:
-            logger.error('Unable to create new Google Docs worksheet: %s' % e)
-            return None
-    except gspread.GSpreadException, e:
-        logger.error('Could not open worksheet on Google Docs account: %s' % e)
-        return None
-    except gspread.httpsession.HTTPError:
-        logger.error('Could not open worksheet on Google Docs account.')
-        return None
-    except Exception, e:
-        logger.exception('Unable to open worksheet on Google Docs (unexpected situation): %s' % e)
-        return None
+    logger = logging.getLogger(sys._getframe().f_code.co_name)
+
+    records = SPOOL.read('plotly', timeout=0)
+    stop = records[0][1][0] if records else time.time()
+
+    if CHART_SPAN is not None:
+        CHART_NEXT = chart_start(stop)
+        if GRAPH_MODE == 'overwrite':
+            logger.info('Backfilling chart with the last %d hours from rollups.' % (CHART_SPAN // 3600))
+            publish_plotly(session, chart_window(CHART_NEXT))
+        return
+
+    if STORE is None or GRAPH_MODE != 'overwrite':
+        return
+
+    samples = STORE.tail(MAX_POINTS, stop)
+    if samples:
+        logger.info('Backfilling chart with %d samples from local history.' % len(samples))
+        publish_plotly(session, raw_traces(samples))
+
+
+def deliver_plotly(session, records):
+    """
+    Plotly sink: push a batch of samples in one write per trace. The sink keeps no more than MAX_POINTS samples
+    (all the chart shows) undelivered, so a backlog after an outage is pushed in a single bulk write. With
+    CHART_SPAN set, Plotly gets the mean of every chart point bucket once the bucket is over, or the whole window
+    redrawn once the samples have moved past it; otherwise only trace values past the DEADBAND are written.
+
+    :param session: Plotly stream session
+    :param records: list of (sequence number, sample) records
+    :return: number of delivered records
+    """
+    global CHART_NEXT
+
+    samples = [row for seq, row in records]
+
+    masks = None
+    if CHART_SPAN is None:
+        masks = DEADBANDS['plotly'].select(samples)
+        traces = raw_traces(samples, masks)
+    else:
+        # buckets which the samples have moved past are complete
+        stop = chart_start(samples[-1][0])
+        if stop - CHART_NEXT >= CHART_SPAN:
+            traces = chart_window(stop)
+        else:
+            traces = chart_buckets(CHART_NEXT, stop)
+        CHART_NEXT = max(CHART_NEXT, stop)
+
+    publish_plotly(session, traces)
+    if masks is not None:
+        DEADBANDS['plotly'].accept(samples, masks)
 
-    return gdc_worksheet
+    return len(records)
 
 
-def write_gdocs(date_stamp, cpu_temp, bmp_temp, dht_hum, bmp_pres, wu_temp):
+def deliver_gdocs(gdocs, records):
     """
-    Write a row with sensor data to Google Docs Spreadsheet active worksheet.
+    Google Docs sink: append a batch of samples as spreadsheet rows, skipping rows with no value past the DEADBAND.
 
-    :param date_stamp: date stamp readout
-    :param cpu_temp: CPU temperature readout
-    :param bmp_temp: BMP temperature readout
-    :param dht_hum: DHT humidity readout
-    :param bmp_pres: BMP pressure readout
-    :param wu_temp: Weather Underground temperature readout
+    :param gdocs: Google Docs session
+    :param records: list of (sequence number, sample) records
+    :return: number of delivered records, from the first one on
+    """
+    samples = [row for seq, row in records]
+    masks = DEADBANDS['gdocs'].select(samples, whole=True)
+    kept = [i for i, mask in enumerate(masks) if any(mask)]
+
+    written = gdocs.write([(format_date_stamp(samples[i][0]),) + samples[i][1:] for i in kept])
+    # samples up to the first unwritten row are done with, dropped ones included
+    delivered = kept[written] if written < len(kept) else len(samples)
+    DEADBANDS['gdocs'].accept(samples[:delivered], masks[:delivered])
+
+    return delivered
+
+
+def register_sink(name, deliver, **kwargs):
+    """
+    Register a publishing sink, delivered to from its own worker thread and spool cursor.
+
+    :param name: sink name
+    :param deliver: callable taking a list of (sequence number, sample) records and returning how many of them,
+                    from the first one on, were delivered
+    :param kwargs: rpi_spool.SinkWorker batching, overflow, backoff and setup options
+    :return: rpi_spool.SinkWorker object
+    """
+    worker = rpi_spool.SinkWorker(SPOOL, name, deliver, stats=STATS, **kwargs)
+    SINKS[name] = worker
+    DEADBANDS[name] = rpi_deadband.Deadband([DEADBAND[series] for series in PLOTLY_TRACES], DEADBAND_HEARTBEAT)
+
+    return worker
+
+
+def init_sinks(session, gdocs):
+    """
+    Register the Plotly and Google Docs sinks and start their workers; spool cursors of sinks no longer registered
+    are dropped, as they would keep spool segments from ever being deleted.
+
+    :param session: Plotly stream session
+    :param gdocs: Google Docs session or None if unconfigured
     """
     logger = logging.getLogger(sys._getframe().f_code.co_name)
 
-    gdc_worksheet = login_gdocs()
+    register_sink('plotly', lambda records: deliver_plotly(session, records), batch=MAX_POINTS,
+                  max_backlog=MAX_POINTS, max_delay=PLOTLY_MAX_BACKOFF, setup=lambda: backfill_plotly(session))
+    if gdocs is not None:
+        register_sink('gdocs', lambda records: deliver_gdocs(gdocs, records), batch=GDOCS_BATCH_ROWS,
+                      batch_age=GDOCS_BATCH_AGE, max_delay=GDOCS_MAX_BACKOFF)
 
-    if gdc_worksheet is not None:
-        try:
-            gdc_worksheet.append_row((date_stamp, cpu_temp, bmp_temp, dht_hum, bmp_pres, wu_temp))
-            logger.debug('Successfully published data to Google Docs.')
-        except gspread.GSpreadException, e:
-            logger.error('Unable to add new row to Google Docs worksheet: %s' % e)
-        except gspread.httpsession.HTTPError:
-            logger.error('Unable to add new row to Google Docs worksheet')
-        except AttributeError, e:
-            logger.error('Unable to add new row (invalid data) to Google Docs worksheet: %s' % e)
-        except Exception, e:
-            logger.exception('Unable to add new row (unexpected situation): %s' % e)
+    for name in SPOOL.sinks():
+        if name not in SINKS:
+            logger.info('Dropping spool cursor of unregistered sink %s.' % name)
+            SPOOL.unregister(name)
+
+    for name, worker in sorted(SINKS.items()):
+        backlog = SPOOL.depth(name)
+        if backlog:
+            logger.info('Replaying %d samples not yet delivered to %s from %s.' % (backlog, name, SPOOL_DIR))
+        worker.start()
 
 
-def publish_data(s_cpu, s_humidity, s_pressure, s_temp, s_wu):
+def sink_oldest_age(name):
     """
-    Publish all gathered data to PlotLy and Google Docs Spreadsheet.
+    :param name: registered sink name
+    :return: seconds since the capture of the oldest sample not yet delivered to the sink (0 if none)
+    """
+    oldest = SPOOL.oldest(name)
+    return time.time() - oldest if oldest is not None else 0.0
+
 
-    :param s_cpu: Plotly stream for CPU temperature readout
-    :param s_humidity: Plotly stream for DHT humidity readout
-    :param s_pressure: Plotly stream for BMP pressure readout
-    :param s_temp: Plotly stream for BMP temperature readout
-    :param s_wu: Plotly strem for Weather Underground temperature readout
+def read_bmp():
+    """
+    Read BMP temperature and pressure, sharing one temperature conversion and optionally in burst mode.
+
+    :return: tuple of BMP temperature in Celsius and pressure in hPa
     """
     logger = logging.getLogger(sys._getframe().f_code.co_name)
 
-    while True:
-        try:
-            s_cpu.open()
-            s_temp.open()
-            s_humidity.open()
-            s_pressure.open()
-            s_wu.open()
-            logger.debug('Successfully opened stream to PlotLy.')
-        except socket.error, e:
-            logger.error('Socket error connecting to Plotly: %s. Retrying...' % e)
-            backoff_sleep(delay=60)
-            continue
+    bmp = BMP
+    if bmp is None:
+        raise IOError('BMP085 not initialized')
 
-        while True:
-            try:
-                date_stamp, cpu_temp, bmp_temp, dht_hum, bmp_pres, wu_temp = DATA_QUEUE.get()
-
-                # write to Google Docs
-                write_gdocs(date_stamp, cpu_temp, bmp_temp, dht_hum, bmp_pres, wu_temp)
-
-                # push data to Plotly
-                try:
-                    s_cpu.write(dict(x=date_stamp, y=cpu_temp))
-                    s_temp.write(dict(x=date_stamp, y=bmp_temp))
-                    s_humidity.write(dict(x=date_stamp, y=dht_hum))
-                    s_pressure.write(dict(x=date_stamp, y=bmp_pres))
-                    s_wu.write(dict(x=date_stamp, y=wu_temp))
-
-                    backoff_sleep(reset=True)
-                    logger.debug('Successfully published data to PlotLy.')
-                except (IOError, socket.error, plotly.exceptions.PlotlyError, Exception), e:
-                    logger.error('Socket error writing to Plotly: %s. Retrying...' % e)
-                    DATA_QUEUE.put((date_stamp, cpu_temp, bmp_temp, dht_hum, bmp_pres, wu_temp))
-                    backoff_sleep(delay=60)
-                    break
-            finally:
-                try:
-                    s_cpu.close()
-                    s_temp.close()
-                    s_humidity.close()
-                    s_pressure.close()
-                    s_wu.close()
-                except plotly.exceptions.PlotlyError:
-                    pass
+    if BMP085_BURST > 1:
+        bmp_temp, bmp_pres, bmp_spread = bmp.readBurst(BMP085_BURST, BMP085_BURST_FILTER)
+        logger.debug('BMP pressure burst of %d samples, spread %.2f hPa' % (BMP085_BURST, bmp_spread / 100.0))
+    else:
+        bmp_temp, bmp_pres = bmp.readAll()
+    logger.debug('I2C BMP085 statistics: %s' % json.dumps(bmp.i2c.statistics(), sort_keys=True))
 
+    return bmp_temp, bmp_pres / 100.0
 
-def gather_data():
+
+def init_dht():
     """
-    Gather all data from DHT and BMP sensors and graph on Plotly. Tries to be resilient to most intermittent
-    errors.
+    Start the DHT reader at the DHT sensor period, retrying within the DHT readout and cycle deadlines.
+
+    :return: started rpi_dht.DHTReader object
+    """
+    dht = rpi_dht.DHTReader(lambda: Adafruit_DHT.read(DHT_VER, DHT_GPIO), SENSOR_PERIODS['dht'],
+                            min(CYCLE_DEADLINE, SENSOR_PERIODS['dht']), interval=DHT_INTERVAL, window=DHT_WINDOW)
+    dht.start()
+
+    return dht
+
+
+def format_value(value, fmt='%.2f'):
+    """
+    Format a readout value for logging, allowing for missing values.
+
+    :param value: readout value or None
+    :param fmt: format string for present values
+    :return: formatted value
+    """
+    if value is None:
+        return 'n/a'
+    return fmt % value
+
+
+def queue_readings(readings, errors, triggered):
+    """
+    Merge a batch of sensor readouts into the latest readouts and queue a sample for publishing.
+
+    :param readings: dictionary of rpi_acquisition.Reading per sensor name
+    :param errors: dictionary of readout exceptions per sensor name
+    :param triggered: time (epoch seconds) the batch was triggered at by the scheduler
     """
     logger = logging.getLogger(sys._getframe().f_code.co_name)
 
-    init_led()
-    bmp = init_bmp()
-    wu_url = init_weather_underground()
-    s_cpu, s_humidity, s_pressure, s_temp, s_wu = init_plotly()
-    init_gdocs()
+    readings = dict(readings)
+    for name, e in errors.items():
+        last = LATEST_READINGS.get(name, rpi_acquisition.Reading(None, None, True))
+        if BREAKERS[name].degraded:
+            # a degraded sensor publishes gaps until it recovers, its circuit breaker logs the failures
+            readings[name] = rpi_acquisition.Reading(None, last.timestamp, True)
+        else:
+            logger.error(SENSOR_ERRORS[name] % e)
+            readings[name] = last._replace(stale=True)
+
+    now = time.time()
+    for name, reading in readings.items():
+        if name not in errors and reading.stale:
+            if reading.timestamp is None:
+                logger.warning('No %s readout available yet.' % name)
+            else:
+                logger.warning('Stale %s readout from %.1f seconds ago.' % (name, now - reading.timestamp))
+        LATEST_READINGS[name] = reading
+
+    # the sample is stamped with the batch trigger time, which follows the schedule and keeps samples in order even
+    # when a batch only holds cached or last good readouts or waited for a slow sensor; readout capture times are
+    # only kept as readout age (sensor_timestamp_seconds)
+    timestamp = triggered
+
+    def latest(name):
+        if name in LATEST_READINGS:
+            return LATEST_READINGS[name].value
+        return None
 
-    t = threading.Thread(target=publish_data, args=(s_cpu, s_humidity, s_pressure, s_temp, s_wu))
-    t.daemon = True
-    t.start()
+    cpu_temp = latest('cpu')
+    dht_hum, dht_temp = latest('dht') or (None, None)
+    bmp_temp, bmp_pres = latest('bmp') or (None, None)
+    wu_temp = latest('wu')
+
+    # gather all outputs into a single string
+    gathered_out = 'CPU Temperature: %s ºC | ' \
+                   'DHT Humidity: %s %% | ' \
+                   'DHT Temperature: %s ºC | ' \
+                   'BMP Temperature: %s ºC | ' \
+                   'BMP Pressure: %s hPa | ' \
+                   'WU Temperature: %s ºC' % tuple(format_value(v) for v in (cpu_temp, dht_hum, dht_temp,
+                                                                             bmp_temp, bmp_pres, wu_temp))
+    logger.debug(gathered_out)
+
+    sample = (timestamp, cpu_temp, bmp_temp, dht_hum, bmp_pres, wu_temp)
+    if DHT_TEMP_SERIES:
+        sample += (dht_temp,)
+
+    if RING is not None:
+        # the publishing process keeps rollups, spool and history
+        RING.put(sample)
+    else:
+        store_sample(sample)
+
+
+def store_sample(sample):
+    """
+    Account for a sample in the rollups, spool it for the sinks and keep it in local history.
+
+    :param sample: tuple of timestamp and series values
+    """
+    # rollups first, so that the Plotly sink finds the buckets a spooled sample closes
+    ROLLUP.add(sample)
+    SPOOL.append(sample)
+    if STORE is not None:
+        STORE.append(sample)
+
+
+def init_publishing():
+    """
+    Open the spool and local history, rebuild the rollups and start publishing to Plotly and Google Docs.
+
+    :return: tuple of Plotly stream session and Google Docs session or None if unconfigured
+    """
+    global SPOOL
+    global STORE
+    global ROLLUP
+
+    SPOOL = init_spool()
+    STORE = init_store()
+    ROLLUP = init_rollup()
+    session = init_plotly()
+    gdocs = init_gdocs()
+
+    init_sinks(session, gdocs)
+
+    return session, gdocs
+
+
+def publish_samples(acquisition):
+    """
+    Publishing process main loop: take samples from the ring and store them for the sinks; never returns.
+
+    :param acquisition: process id of the acquisition process, the publishing process exits once it is gone
+    """
+    logger = logging.getLogger(sys._getframe().f_code.co_name)
+
+    session, gdocs = init_publishing()
+    init_metrics(lambda registry: publishing_metrics(registry, session, gdocs), PUBLISHER_METRICS_PORT)
+    init_stats(lambda: publishing_stats(session, gdocs))
 
     while True:
-        # pull CPU0 temperature
-        try:
-            cpu_temp = read_rpi_cpu()
-        except RuntimeError, e:
-            logger.error('CPU0 thermal zone reading failure: %s' % e)
-            sys.exit(1)
+        for sample in RING.get(timeout=1.0):
+            store_sample(sample)
 
-        # pull DHT temperature and humidity
-        try:
-            dht_hum, dht_temp = Adafruit_DHT.read_retry(DHT_VER, DHT_GPIO)
-        except RuntimeError, e:
-            logger.error('GPIO DHT reading failure: %s' % e)
-            sys.exit(1)
+        if os.getppid() != acquisition:
+            logger.warning('Acquisition process is gone. Exiting...')
+            sys.exit(0)
 
-        # pull BMP temperature and pressure
-        try:
-            bmp_temp = bmp.readTemperature()
-            bmp_pres = bmp.readPressure() / 100.0
-        except IOError, e:
-            logger.error('I2C BMP085 reading failure: %s' % e)
-            sys.exit(1)
 
-        # pull Weather Underground outdoor temperature
-        wu_temp = read_weather_underground(weather_underground_url=wu_url)
+def stop_publisher():
+    """
+    Terminate the publishing process, letting it close its spool and streams.
+    """
+    global PUBLISHER
+
+    publisher = PUBLISHER
+    if publisher is None:
+        return
+    # cleared first, so that the SIGCHLD handler does not take this exit for a failure
+    PUBLISHER = None
+    try:
+        os.kill(publisher, signal.SIGTERM)
+        os.waitpid(publisher, 0)
+    except OSError:
+        pass
+
+
+def check_publisher(recvd_signal=None, stack_frame=None):
+    """
+    SIGCHLD handler reaping a publishing process which died, exiting with an error so that the process control
+    system (e.g. Supervisor autorestart) restarts both processes instead of sensors filling a ring nobody reads.
+
+    :param recvd_signal: received signal
+    :param stack_frame:  current stack frame
+    """
+    global PUBLISHER
+
+    logger = logging.getLogger(sys._getframe().f_code.co_name)
+
+    publisher = PUBLISHER
+    if publisher is None:
+        return
+    try:
+        pid, status = os.waitpid(publisher, os.WNOHANG)
+    except OSError:
+        return
+    if pid != publisher:
+        return
+
+    PUBLISHER = None
+    if os.WIFSIGNALED(status):
+        logger.error('Publishing process %d killed by signal %d. Exiting...' % (pid, os.WTERMSIG(status)))
+    else:
+        logger.error('Publishing process %d exited with status %d. Exiting...' % (pid, os.WEXITSTATUS(status)))
+    sys.exit(1)
 
-        date_stamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
 
-        # gather all outputs into a single string
-        gathered_out = 'CPU Temperature: %.2f ºC | ' \
-                       'DHT Humidity: %.2f %% | ' \
-                       'DHT Temperature: %.2f ºC | ' \
-                       'BMP Temperature: %.2f ºC | ' \
-                       'BMP Pressure: %.2f hPa | ' \
-                       'WU Temperature: %.2f ºC' % (cpu_temp, dht_hum, dht_temp, bmp_temp, bmp_pres, wu_temp)
-        logger.debug(gathered_out)
+def gather_data():
+    """
+    Gather all data from DHT and BMP sensors and graph on Plotly. Tries to be resilient to most intermittent
+    errors. With SPLIT_PROCESSES the samples are published from a separate process, so that TLS, JSON encoding
+    and spreadsheet work never compete with sensor timing for the interpreter lock.
+    """
+    global RING
+    global PUBLISHER
+    global BMP
+
+    logger = logging.getLogger(sys._getframe().f_code.co_name)
+
+    if SPLIT_PROCESSES:
+        # fork before any thread is started, the processes only share the ring
+        RING = rpi_ring.SampleRing(len(PLOTLY_TRACES), RING_CAPACITY)
+        acquisition = os.getpid()
+        publisher = os.fork()
+        if publisher == 0:
+            try:
+                publish_samples(acquisition)
+            except Exception, e:
+                # startup failures and crashes end the publishing process with an error status for its parent
+                logger.exception('Publishing process failed: %s' % e)
+                sys.exit(1)
+        PUBLISHER = publisher
+        atexit.register(stop_publisher)
+        signal.signal(signal.SIGCHLD, check_publisher)
+        # it may have died before the handler was in place
+        check_publisher()
+        logger.info('Publishing from process %d.' % publisher)
+
+        if ACQUISITION_PRIORITY:
+            try:
+                os.nice(-ACQUISITION_PRIORITY)
+            except OSError, e:
+                logger.warning('Cannot raise acquisition process priority: %s' % e)
+    else:
+        session, gdocs = init_publishing()
+
+    init_led()
+    BMP = init_bmp()
+    dht = init_dht()
+    wu_fetcher = init_weather_underground()
+
+    # every sensor is read concurrently in its own worker at its own cadence, so that a slow one only makes its own
+    # readout stale, and behind its own circuit breaker, so that a failing one is retried without stopping the others
+    readers = {'cpu': read_rpi_cpu,
+               'dht': dht.read,
+               'bmp': read_bmp,
+               'wu': lambda: read_weather_underground(fetcher=wu_fetcher)}
+    recovers = {'bmp': recover_bmp}
+    for name in SENSOR_NAMES:
+        BREAKERS[name] = rpi_acquisition.CircuitBreaker(name, STATS.timed(name, readers[name]),
+                                                        SENSOR_BREAKER_THRESHOLD, SENSOR_RETRY_DELAY,
+                                                        SENSOR_MAX_RETRY_DELAY, recover=recovers.get(name))
+    sources = [rpi_acquisition.SensorSource(name, BREAKERS[name], SENSOR_TIMEOUTS[name], SENSOR_PERIODS[name],
+                                            SENSOR_PHASES[name]) for name in SENSOR_NAMES]
+
+    scheduler = rpi_acquisition.Scheduler(sources, queue_readings, CYCLE_DEADLINE)
+
+    if SPLIT_PROCESSES:
+        init_metrics(lambda registry: acquisition_metrics(registry, dht, wu_fetcher, scheduler), METRICS_PORT)
+        init_stats(lambda: acquisition_stats(dht, scheduler))
+    else:
+        def register(registry):
+            acquisition_metrics(registry, dht, wu_fetcher, scheduler)
+            publishing_metrics(registry, session, gdocs)
+
+        def collect():
+            stats = acquisition_stats(dht, scheduler)
+            stats.update(publishing_stats(session, gdocs))
+            return stats
 
-        DATA_QUEUE.put((date_stamp, cpu_temp, bmp_temp, dht_hum, bmp_pres, wu_temp))
+        init_metrics(register, METRICS_PORT)
+        init_stats(collect)
 
-        time.sleep(SLEEP_DELAY)
+    scheduler.run()
 
 
 def run():
@@ -0,0 +1,426 @@
+# -*- coding: utf-8 -*-
+
+"""Concurrent sensor acquisition for rpi-plot. Each sensor is read in its own worker thread under its own timeout,
+   so that a slow or hung sensor only makes its own reading stale instead of stalling the whole sample, and behind
+   its own circuit breaker, so that a failing sensor is marked degraded and retried with backoff.
+"""
+
+__copyright__ = """Copyright (C) 2014  Dinko Korunic <dinko.korunic@gmail.com>
+
+This program is free software; you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation; either version 2 of the License, or (at your
+option) any later version.
+"""
+
+import os
+import sys
+import time
+import random
+import ctypes
+import logging
+import ctypes.util
+import threading
+import collections
+import Queue
+
+
+# value is None if the sensor never produced one; timestamp is the capture time (epoch seconds)
+Reading = collections.namedtuple('Reading', ['value', 'timestamp', 'stale'])
+
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def _init_monotonic():
+    """
+    Bind clock_gettime(CLOCK_MONOTONIC) from libc (or librt on older glibc).
+
+    :return: monotonic clock function or None if unavailable
+    """
+    for lib_name in ('c', 'rt'):
+        lib_path = ctypes.util.find_library(lib_name)
+        if lib_path is None:
+            continue
+        try:
+            clock_gettime = ctypes.CDLL(lib_path, use_errno=True).clock_gettime
+        except (OSError, AttributeError):
+            continue
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+
+        def monotonic_clock(clock_gettime=clock_gettime):
+            t = _Timespec()
+            if clock_gettime(1, ctypes.byref(t)) != 0:  # CLOCK_MONOTONIC
+                errno = ctypes.get_errno()
+                raise OSError(errno, os.strerror(errno))
+            return t.tv_sec + t.tv_nsec * 1e-9
+
+        return monotonic_clock
+    return None
+
+
+_monotonic = getattr(time, 'monotonic', None) or _init_monotonic()
+
+
+def monotonic():
+    """
+    Clock which is not affected by system time changes (falls back to wall clock if not available).
+
+    :return: seconds from an arbitrary starting point
+    """
+    if _monotonic is None:
+        return time.time()
+    return _monotonic()
+
+
+def backoff(failures, delay, max_delay, jitter, rand=random):
+    """
+    Capped exponential backoff with jitter, shared by everything that retries.
+
+    :param failures: number of consecutive failures so far (1 for the first one)
+    :param delay: backoff after the first failure in seconds
+    :param max_delay: maximal backoff in seconds
+    :param jitter: fraction of the backoff randomly taken off, so that retries do not happen in lockstep
+    :param rand: random.Random instance (or the random module) to draw the jitter from
+    :return: seconds to wait before the next attempt
+    """
+    backoff_delay = min(max_delay, delay * 2 ** min(failures - 1, 30))
+    return rand.uniform(backoff_delay * (1 - jitter), backoff_delay)
+
+
+class SensorDegraded(Exception):
+    """
+    Raised instead of reading a sensor whose circuit breaker is open.
+    """
+
+
+class CircuitBreaker(object):
+    """
+    Sensor read wrapper marking the sensor degraded after consecutive failed reads. A degraded sensor is not read
+    until a capped exponential backoff with jitter expires, when an optional recovery action (e.g. re-opening its
+    bus) and one trial read either bring it back or back it off further.
+    """
+
+    def __init__(self, name, read, threshold=3, delay=10, max_delay=600, jitter=0.5, recover=None):
+        """
+        :param name: sensor name
+        :param read: callable reading the sensor
+        :param threshold: consecutive failed reads after which the sensor is degraded
+        :param delay: initial retry backoff in seconds
+        :param max_delay: maximal retry backoff in seconds
+        :param jitter: fraction of the backoff randomly taken off
+        :param recover: callable run before every trial read of a degraded sensor, or None
+        """
+        self.name = name
+        self.read = read
+        self.threshold = threshold
+        self.delay = delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.recover = recover
+
+        self.degraded = False
+        self.failures = 0  # failed reads
+        self.trips = 0  # times the sensor was marked degraded
+        self.recoveries = 0  # times a degraded sensor came back
+
+        self._consecutive = 0  # consecutive failed reads
+        self._trials = 0  # failed trial reads since the sensor was degraded
+        self._retry_at = 0.0  # monotonic time of the next trial read
+        self._random = random.Random()
+
+    def _failed(self, e):
+        """
+        Account for a failed read, degrading the sensor or backing it off further.
+        """
+        logger = logging.getLogger(sys._getframe().f_code.co_name)
+
+        self.failures += 1
+        self._consecutive += 1
+        if self._consecutive < self.threshold:
+            return
+
+        if not self.degraded:
+            self.degraded = True
+            self.trips += 1
+        self._trials += 1
+        delay = backoff(self._trials, self.delay, self.max_delay, self.jitter, self._random)
+        self._retry_at = monotonic() + delay
+
+        logger.warning('Sensor %s degraded after %d failed reads: %s. Retrying in %.1f seconds.' %
+                       (self.name, self._consecutive, e, delay))
+
+    def __call__(self):
+        """
+        Read the sensor unless it is degraded and backing off.
+
+        :return: sensor value
+        """
+        logger = logging.getLogger(sys._getframe().f_code.co_name)
+
+        if self.degraded:
+            if monotonic() < self._retry_at:
+                raise SensorDegraded('%s sensor degraded, next retry in %.0f seconds' %
+                                     (self.name, self._retry_at - monotonic()))
+            if self.recover is not None:
+                try:
+                    self.recover()
+                except Exception, e:
+                    self._failed(e)
+                    raise
+
+        try:
+            value = self.read()
+        except Exception, e:
+            self._failed(e)
+            raise
+
+        if self.degraded:
+            self.recoveries += 1
+            logger.warning('Sensor %s recovered.' % self.name)
+        self.degraded = False
+        self._consecutive = 0
+        self._trials = 0
+        return value
+
+
+class SensorSource(object):
+    """
+    Sensor read in a dedicated worker thread with a per-read timeout.
+    """
+
+    def __init__(self, name, read, timeout, period=None, phase=0.0):
+        """
+        :param name: sensor name
+        :param read: callable returning the sensor value or a Reading; exceptions are re-raised in the collecting
+                     thread
+        :param timeout: seconds to wait for a read before the reading is marked stale
+        :param period: seconds between reads when run by the Scheduler
+        :param phase: seconds from Scheduler start to the first read
+        """
+        self.name = name
+        self.read = read
+        self.timeout = timeout
+        self.period = period
+        self.phase = phase
+        self.last = None
+        self.listener = None  # called with (source, cycle) from the worker thread once a read is done
+
+        self._requests = Queue.Queue()
+        self._done = threading.Condition()
+        self._cycle = None
+        self._result = None
+        self._busy = False
+
+        t = threading.Thread(target=self._worker, name='sensor-%s' % name)
+        t.daemon = True
+        t.start()
+
+    def _worker(self):
+        """
+        Worker thread loop performing requested reads.
+        """
+        while True:
+            cycle = self._requests.get()
+
+            error = None
+            value = None
+            try:
+                value = self.read()
+            except Exception, e:
+                error = e
+
+            with self._done:
+                self._result = (cycle, value, time.time(), error)
+                self._busy = False
+                self._done.notify_all()
+
+            if self.listener is not None:
+                self.listener(self, cycle)
+
+    def trigger(self, cycle):
+        """
+        Request a read for the given cycle unless the previous read is still in progress.
+
+        :param cycle: cycle identifier
+        :return: True if a read was requested
+        """
+        with self._done:
+            if self._busy:
+                return False
+            self._busy = True
+            self._cycle = cycle
+            self._result = None
+
+        self._requests.put(cycle)
+        return True
+
+    @staticmethod
+    def _reading(result):
+        """
+        Make a Reading out of a worker result; reads may return a Reading with their own capture time and staleness.
+        """
+        if isinstance(result[1], Reading):
+            return result[1]
+        return Reading(result[1], result[2], False)
+
+    def collect(self, cycle, deadline):
+        """
+        Wait until the read for the given cycle is done or the deadline passes.
+
+        :param cycle: cycle identifier
+        :param deadline: absolute monotonic() time after which the reading is marked stale
+        :return: fresh Reading or the last good Reading marked stale
+        """
+        with self._done:
+            if self._cycle == cycle:
+                while self._result is None:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        break
+                    self._done.wait(remaining)
+            result = self._result
+
+        if result is not None and result[0] == cycle:
+            if result[3] is not None:
+                raise result[3]
+            reading = self._reading(result)
+            if not reading.stale:
+                self.last = reading
+            return reading
+
+        # a read which finished after its own cycle deadline still refreshes the last good value
+        if result is not None and result[3] is None:
+            reading = self._reading(result)
+            if not reading.stale and (self.last is None or reading.timestamp > self.last.timestamp):
+                self.last = reading
+
+        if self.last is None:
+            return Reading(None, None, True)
+        return self.last._replace(stale=True)
+
+
+class Scheduler(object):
+    """
+    Drift-free scheduler reading each sensor at its own fixed period and phase on the monotonic clock. Readings of
+    sensors triggered together are merged and handed over as one batch once all of them are done or timed out.
+    """
+
+    def __init__(self, sources, emit, deadline=None):
+        """
+        :param sources: list of SensorSource objects with period set
+        :param emit: called with (dictionary of Readings, dictionary of read exceptions) per sensor name and the
+                     wall clock time (epoch seconds) the batch was triggered at
+        :param deadline: maximum seconds for any batch regardless of per-sensor timeouts
+        """
+        self.sources = sources
+        self.emit = emit
+        self.deadline = deadline
+        self.overruns = dict((source.name, 0) for source in sources)
+
+        self._sources = dict((source.name, source) for source in sources)
+        self._events = Queue.Queue()
+        self._cycle = 0
+        self._next = {}
+        self._outstanding = {}  # name -> (cycle, deadline, batch)
+        self._batches = {}  # batch -> (pending names, readings, errors, trigger time)
+
+        for source in sources:
+            source.listener = self._done
+
+    def _done(self, source, cycle):
+        """
+        Completion listener invoked from sensor worker threads.
+        """
+        self._events.put((source, cycle))
+
+    def _resolve(self, name, reading=None, error=None):
+        """
+        Record a finished or timed out read and emit its batch once complete.
+        """
+        cycle, deadline, batch = self._outstanding.pop(name)
+        pending, readings, errors, triggered = self._batches[batch]
+        pending.discard(name)
+        if error is not None:
+            errors[name] = error
+        else:
+            readings[name] = reading
+        if not pending:
+            del self._batches[batch]
+            self.emit(readings, errors, triggered)
+
+    def _trigger(self, now):
+        """
+        Trigger all due sources as one batch and advance their schedules by whole periods.
+        """
+        due = [source for source in self.sources if self._next[source.name] <= now]
+        if not due:
+            return
+
+        self._cycle += 1
+        batch = self._cycle
+        # the batch is stamped when it is triggered, so that a slow source does not shift it
+        self._batches[batch] = (set(), {}, {}, time.time())
+
+        for source in due:
+            # keep the cadence anchored to the schedule, skipping slots missed while the process was stalled
+            missed = int((now - self._next[source.name]) // source.period)
+            self._next[source.name] += (missed + 1) * source.period
+
+            deadline = now + source.timeout
+            if self.deadline is not None:
+                deadline = min(deadline, now + self.deadline)
+
+            self._batches[batch][0].add(source.name)
+            if source.name in self._outstanding or not source.trigger(self._cycle):
+                # previous read still in progress
+                self.overruns[source.name] += 1
+                self._batches[batch][1][source.name] = source.collect(None, now)
+                self._batches[batch][0].discard(source.name)
+            else:
+                self._outstanding[source.name] = (self._cycle, deadline, batch)
+
+        if not self._batches[batch][0]:
+            pending, readings, errors, triggered = self._batches.pop(batch)
+            self.emit(readings, errors, triggered)
+
+    def run(self):
+        """
+        Scheduler loop; never returns.
+        """
+        start = monotonic()
+        for source in self.sources:
+            self._next[source.name] = start + source.phase
+
+        while True:
+            now = monotonic()
+            self._trigger(now)
+
+            for name, (cycle, deadline, batch) in self._outstanding.items():
+                if deadline <= now:
+                    self._resolve(name, reading=self._sources[name].collect(None, now))
+
+            wakeup = min(self._next.values() + [deadline for cycle, deadline, batch in self._outstanding.values()])
+            try:
+                source, cycle = self._events.get(timeout=max(0.0, wakeup - monotonic()))
+            except Queue.Empty:
+                continue
+
+            while True:
+                outstanding = self._outstanding.get(source.name)
+                if outstanding is not None and outstanding[0] == cycle:
+                    try:
+                        self._resolve(source.name, reading=source.collect(cycle, monotonic()))
+                    except Exception, e:
+                        self._resolve(source.name, error=e)
+                else:
+                    # read finished after its timeout, keep it as the last good value
+                    try:
+                        source.collect(None, monotonic())
+                    except Exception:
+                        pass
+                try:
+                    source, cycle = self._events.get_nowait()
+                except Queue.Empty:
+                    break
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+"""Deadband (change detection) filtering of rpi-plot samples for publishing. A series value is only published when
+   it moves more than a threshold away from the last published value of the series, or when no value of the series
+   has been published for a heartbeat interval, so that flat series do not cost a sink API call per sample.
+"""
+
+__copyright__ = """Copyright (C) 2014  Dinko Korunic <dinko.korunic@gmail.com>
+
+This program is free software; you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation; either version 2 of the License, or (at your
+option) any later version.
+"""
+
+
+class Deadband(object):
+    """
+    Per series deadband filter state of one sink. Deciding (select) and committing (accept) are separate, so that a
+    batch which could not be delivered is decided again on retry against the same state.
+    """
+
+    def __init__(self, thresholds, heartbeat=None):
+        """
+        :param thresholds: per series change in value needed to publish it (0 publishes every change, None every
+                           value)
+        :param heartbeat: seconds of sample time after which a value is published regardless of change (None never)
+        """
+        self.thresholds = tuple(thresholds)
+        self.heartbeat = heartbeat
+
+        self.published = [0] * len(self.thresholds)
+        self.dropped = [0] * len(self.thresholds)
+
+        self._last = [None] * len(self.thresholds)  # (timestamp, value) last published per series
+
+    def _changed(self, last, timestamp, value, threshold):
+        if threshold is None or last is None:
+            return True
+        if self.heartbeat is not None and timestamp - last[0] >= self.heartbeat:
+            return True
+        if value is None or last[1] is None:
+            # a gap starting or ending is a change
+            return (value is None) != (last[1] is None)
+        return abs(value - last[1]) > threshold
+
+    def select(self, samples, whole=False):
+        """
+        Decide which values of a batch of samples to publish, without changing the filter state.
+
+        :param samples: list of tuples of timestamp (epoch seconds) and series values or None
+        :param whole: publish all values of a sample if any of them is due, for sinks writing whole rows
+        :return: list of per series lists of booleans, one for each sample
+        """
+        last = list(self._last)
+
+        masks = []
+        for sample in samples:
+            timestamp = sample[0]
+            mask = [self._changed(last[field], timestamp, value, threshold)
+                    for field, (value, threshold) in enumerate(zip(sample[1:], self.thresholds))]
+            if whole:
+                mask = [any(mask)] * len(mask)
+
+            for field, due in enumerate(mask):
+                if due:
+                    last[field] = (timestamp, sample[field + 1])
+            masks.append(mask)
+
+        return masks
+
+    def accept(self, samples, masks):
+        """
+        Commit the decisions of select() for samples that were delivered.
+
+        :param samples: list of delivered samples, from the first one passed to select() on
+        :param masks: their masks as returned by select()
+        """
+        for sample, mask in zip(samples, masks):
+            for field, due in enumerate(mask):
+                if due:
+                    self._last[field] = (sample[0], sample[field + 1])
+                    self.published[field] += 1
+                else:
+                    self.dropped[field] += 1
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+"""DHT11/DHT22 reader for rpi-plot running in its own thread at its own cadence. Every readout retries a failed
+   read within an adaptive budget capped by a deadline, rejects implausible values, takes the median of a few good
+   reads made within that deadline against the typical DHT22 spikes and keeps the result as a last good value with
+   its capture time, which is read without blocking and fails once it is too old.
+"""
+
+__copyright__ = """Copyright (C) 2014  Dinko Korunic <dinko.korunic@gmail.com>
+
+This program is free software; you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation; either version 2 of the License, or (at your
+option) any later version.
+"""
+
+import sys
+import math
+import time
+import logging
+import threading
+
+import rpi_acquisition
+
+
+def median(values):
+    """
+    :param values: non-empty list of numbers
+    :return: median value
+    """
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+class DHTReader(object):
+    """
+    Background DHT readout with last good value caching.
+    """
+
+    def __init__(self, read, period, deadline, interval=2.0, window=3, max_age=None, humidity=(0.0, 100.0),
+                 temperature=(-40.0, 80.0)):
+        """
+        :param read: callable making one read attempt and returning a tuple of humidity and temperature, or of Nones
+                     on failure (e.g. Adafruit_DHT.read without its retries)
+        :param period: seconds between readouts
+        :param deadline: seconds a readout may spend retrying at most
+        :param interval: seconds between read attempts (2 for DHT22, 1 for DHT11)
+        :param window: number of good reads made within one readout whose median is the readout value, fewer if
+                       the deadline runs out first
+        :param max_age: seconds after which the last good value is reported stale (None is twice the period)
+        :param humidity: plausible (minimum, maximum) humidity in percent, reads outside are rejected
+        :param temperature: plausible (minimum, maximum) temperature in Celsius, reads outside are rejected
+        """
+        self.read_attempt = read
+        self.period = period
+        self.deadline = deadline
+        self.interval = interval
+        self.window = window
+        self.max_age = 2 * period if max_age is None else max_age
+        self.humidity = humidity
+        self.temperature = temperature
+
+        self.attempts = 0  # read attempts
+        self.failures = 0  # failed read attempts
+        self.rejected = 0  # reads outside the plausible range
+        self.missed = 0  # readouts without a single good read
+
+        self._average = 1.0  # moving average of attempts needed for a good read
+        self._last = rpi_acquisition.Reading(None, None, True)
+
+    def start(self):
+        """
+        Start the readout thread as daemon (will exit automatically).
+        """
+        t = threading.Thread(target=self._run, name='dht')
+        t.daemon = True
+        t.start()
+
+    def budget(self):
+        """
+        :return: read attempts allowed for the first good read of the next readout, twice the recent average but
+                 within the deadline
+        """
+        limit = int(self.deadline // self.interval) + 1
+        return max(1, min(limit, int(math.ceil(2 * self._average))))
+
+    def _plausible(self, humidity, temperature):
+        return (self.humidity[0] <= humidity <= self.humidity[1] and
+                self.temperature[0] <= temperature <= self.temperature[1])
+
+    def readout(self):
+        """
+        Make one readout, retrying within the budget, and update the last good value with the median of the good
+        reads made until there are window of them or the deadline runs out.
+
+        :return: True if a good read was made
+        """
+        logger = logging.getLogger(sys._getframe().f_code.co_name)
+
+        budget = self.budget()
+        limit = int(self.deadline // self.interval) + 1
+        reads = []  # (humidity, temperature) of the good reads of this readout
+        for attempt in xrange(1, limit + 1):
+            if not reads and attempt > budget:
+                break
+            if attempt > 1:
+                time.sleep(self.interval)
+
+            self.attempts += 1
+            try:
+                humidity, temperature = self.read_attempt()
+            except Exception, e:
+                logger.debug('DHT read attempt failed: %s' % e)
+                humidity, temperature = None, None
+
+            if humidity is None or temperature is None:
+                self.failures += 1
+                continue
+            if not self._plausible(humidity, temperature):
+                self.rejected += 1
+                logger.debug('Rejecting implausible DHT read: %.1f %%, %.1f C' % (humidity, temperature))
+                continue
+
+            if not reads:
+                self._average += (attempt - self._average) / 4.0
+            reads.append((humidity, temperature))
+            if len(reads) >= self.window:
+                break
+
+        if reads:
+            self._last = rpi_acquisition.Reading((median([value[0] for value in reads]),
+                                                  median([value[1] for value in reads])), time.time(), False)
+            return True
+
+        # a readout that ran out of budget raises the budget of the next ones
+        self._average += (budget + 1 - self._average) / 4.0
+        self.missed += 1
+        logger.warning('No valid DHT read after %d attempts.' % budget)
+        return False
+
+    def _run(self):
+        """
+        Readout loop on the monotonic clock, skipping readouts missed while a slow one was running.
+        """
+        next_readout = rpi_acquisition.monotonic()
+        while True:
+            self.readout()
+
+            now = rpi_acquisition.monotonic()
+            next_readout += (int((now - next_readout) // self.period) + 1) * self.period
+            time.sleep(max(0.0, next_readout - now))
+
+    def read(self):
+        """
+        :return: rpi_acquisition.Reading of the last good (humidity, temperature), stale if there is none yet
+        :raises RuntimeError: if the last good value is older than max_age, so that a sensor that stopped reading
+                              is counted as failing
+        """
+        last = self._last
+        if last.timestamp is None:
+            return last
+        age = time.time() - last.timestamp
+        if age > self.max_age:
+            raise RuntimeError('no valid DHT read for %.0f seconds' % age)
+        return last
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+
+"""Google Docs Spreadsheet session for rpi-plot. Keeps the authenticated connection and the current month worksheet
+   open and appends rows in batches, one cell update per worksheet.
+"""
+
+__copyright__ = """Copyright (C) 2014  Dinko Korunic <dinko.korunic@gmail.com>
+
+This program is free software; you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation; either version 2 of the License, or (at your
+option) any later version.
+"""
+
+import sys
+import socket
+import logging
+import datetime
+
+import gspread
+
+
+# date_stamp, cpu_temp, bmp_temp, dht_hum, bmp_pres, wu_temp
+GDOCS_HEADER = ('Date/Time', 'CPU Temperature [C]', 'BMP Temperature [C]', 'DHT Humidity [%]', 'BMP Pressure [hPa]',
+                'WU Temperature [C]')
+
+
+class GDocsSession(object):
+    """
+    Persistent Google Docs Spreadsheet session with batched row appends.
+    """
+
+    def __init__(self, email, password, sheet, sheet_pattern='%Y-%B', header=GDOCS_HEADER, stats=None):
+        """
+        :param email: Google account e-mail
+        :param password: Google account password
+        :param sheet: spreadsheet name
+        :param sheet_pattern: strftime pattern of worksheet names (one worksheet per pattern value)
+        :param header: column titles of new worksheets, one per row value
+        :param stats: rpi_metrics.StageStats recording batch append latency as stage gdocs, or None
+        """
+        self.email = email
+        self.password = password
+        self.sheet = sheet
+        self.sheet_pattern = sheet_pattern
+        self.header = header
+        self.written = 0
+
+        self._conn = None
+        self._spreadsheet = None
+        self._worksheets = {}  # worksheet name -> worksheet
+        self._blank = {}  # worksheet name -> (first row, count) of rows added by an append that failed
+
+        self._append = self._append_rows
+        if stats is not None:
+            self._append = stats.timed('gdocs', self._append_rows)
+
+    def invalidate(self):
+        """
+        Drop the authenticated session and cached worksheets, forcing a new login on the next write.
+        """
+        self._conn = None
+        self._spreadsheet = None
+        self._worksheets = {}
+
+    def _login(self):
+        """
+        Login to Google Docs and open the spreadsheet, unless already done.
+
+        :return: Google Docs Spreadsheet object or None
+        """
+        logger = logging.getLogger(sys._getframe().f_code.co_name)
+
+        if self._spreadsheet is not None:
+            return self._spreadsheet
+
+        try:
+            self._conn = gspread.login(self.email, self.password)
+        except gspread.GSpreadException, e:
+            logger.error('Problem with Google Docs authentication: %s' % e)
+            return None
+        except (socket.error, socket.gaierror, socket.timeout), e:
+            logger.error('Problem contacting Google Docs: %s. Continuing without.' % e)
+            return None
+
+        try:
+            self._spreadsheet = self._conn.open(self.sheet)
+        except gspread.SpreadsheetNotFound, e:
+            logger.error('No such spreadsheet on Google Docs account: %s' % e)
+            return None
+        except (socket.error, socket.gaierror, socket.timeout), e:
+            logger.error('Problem contacting Google Docs: %s' % e)
+            return None
+        except gspread.httpsession.HTTPError:
+            logger.error('Problem contacting Google Docs.')
+            return None
+        except Exception, e:
+            logger.exception('Unable to contact Google Docs (unexpected situation): %s' % e)
+            return None
+
+        return self._spreadsheet
+
+    def _worksheet(self, sheet_name):
+        """
+        Open (or create) a worksheet by name, reusing the cached handle.
+
+        :param sheet_name: worksheet name
+        :return: Google Docs Spreadsheet worksheet object or None
+        """
+        logger = logging.getLogger(sys._getframe().f_code.co_name)
+
+        if sheet_name in self._worksheets:
+            return self._worksheets[sheet_name]
+
+        gdc = self._login()
+        if gdc is None:
+            return None
+
+        try:
+            gdc_worksheet = gdc.worksheet(sheet_name)
+        except gspread.WorksheetNotFound, e:
+            logger.info('No such worksheet on Google Docs account: %s. Will create it now.' % e)
+
+            # XXX: hardcoded number of columns for now and hardcoded descriptions
+            try:
+                gdc_worksheet = gdc.add_worksheet(title=sheet_name, rows=1, cols=len(self.header))
+                gdc_worksheet.append_row(self.header)
+                logger.debug('Successfully created Google Docs worksheet: %s' % sheet_name)
+            except gspread.GSpreadException, e:
+                logger.error('Unable to create new Google Docs worksheet: %s' % e)
+                return None
+        except gspread.GSpreadException, e:
+            logger.error('Could not open worksheet on Google Docs account: %s' % e)
+            return None
+        except gspread.httpsession.HTTPError:
+            logger.error('Could not open worksheet on Google Docs account.')
+            self.invalidate()
+            return None
+        except Exception, e:
+            logger.exception('Unable to open worksheet on Google Docs (unexpected situation): %s' % e)
+            self.invalidate()
+            return None
+
+        # only the current month worksheet (and possibly the previous one) is ever written to
+        self._worksheets = {sheet_name: gdc_worksheet}
+        return gdc_worksheet
+
+    def _sheet_name(self, date_stamp):
+        """
+        :param date_stamp: date stamp readout
+        :return: worksheet name for the month of the readout
+        """
+        try:
+            stamp = datetime.datetime.strptime(date_stamp[:19], '%Y-%m-%d %H:%M:%S')
+        except (TypeError, ValueError):
+            stamp = datetime.datetime.now()
+        return stamp.strftime(self.sheet_pattern)
+
+    def _append_rows(self, gdc_worksheet, rows):
+        """
+        Append rows to a worksheet in a single batch cell update. Adding rows and filling them are separate calls,
+        so rows left blank by a failed cell update are remembered and filled first on retry.
+
+        :param gdc_worksheet: Google Docs Spreadsheet worksheet object
+        :param rows: list of row tuples
+        """
+        title = gdc_worksheet.title
+        first, blank = self._blank.get(title, (gdc_worksheet.row_count + 1, 0))
+        if blank < len(rows):
+            gdc_worksheet.add_rows(len(rows) - blank)
+            blank = len(rows)
+            self._blank[title] = (first, blank)
+
+        cells = gdc_worksheet.range('A%d:%s%d' % (first, chr(ord('A') + len(self.header) - 1),
+                                                  first + len(rows) - 1))
+        values = [value for row in rows for value in row]
+        for cell, value in zip(cells, values):
+            cell.value = '' if value is None else value
+        gdc_worksheet.update_cells(cells)
+
+        # a retry of fewer rows leaves the rest blank for the next append
+        del self._blank[title]
+        if blank > len(rows):
+            self._blank[title] = (first + len(rows), blank - len(rows))
+
+    def write(self, rows):
+        """
+        Append rows to their monthly worksheets, stopping at the first failure.
+
+        :param rows: list of tuples of date_stamp, cpu_temp, bmp_temp, dht_hum, bmp_pres, wu_temp (and dht_temp
+                     with a header for it)
+        :return: number of rows written, from the first one on
+        """
+        logger = logging.getLogger(sys._getframe().f_code.co_name)
+
+        written = 0
+        while written < len(rows):
+            # batch of consecutive rows belonging to the same worksheet
+            sheet_name = self._sheet_name(rows[written][0])
+            batch = []
+            for row in rows[written:]:
+                if self._sheet_name(row[0]) != sheet_name:
+                    break
+                batch.append(row)
+
+            gdc_worksheet = self._worksheet(sheet_name)
+            if gdc_worksheet is None:
+                break
+
+            try:
+                self._append(gdc_worksheet, batch)
+                logger.debug('Successfully published %d rows to Google Docs.' % len(batch))
+            except gspread.GSpreadException, e:
+                logger.error('Unable to add new rows to Google Docs worksheet: %s' % e)
+                self.invalidate()
+                break
+            except gspread.httpsession.HTTPError:
+                # expired authentication shows up as HTTP errors, login again next time
+                logger.error('Unable to add new rows to Google Docs worksheet')
+                self.invalidate()
+                break
+            except (socket.error, socket.gaierror, socket.timeout), e:
+                logger.error('Problem contacting Google Docs: %s' % e)
+                break
+            except AttributeError, e:
+                logger.error('Unable to add new rows (invalid data) to Google Docs worksheet: %s' % e)
+                self.invalidate()
+                break
+            except Exception, e:
+                logger.exception('Unable to add new rows (unexpected situation): %s' % e)
+                self.invalidate()
+                break
+
+            written += len(batch)
+
+        self.written += written
+        return written
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+
+"""Embedded metrics endpoint for rpi-plot in Prometheus text exposition format. Metric values are pulled at scrape
+   time by cheap collector callables reading state already kept in memory (latest readings, counters), so a scrape
+   never triggers a sensor read and takes no locks shared with the acquisition or publishing threads.
+"""
+
+__copyright__ = """Copyright (C) 2014  Dinko Korunic <dinko.korunic@gmail.com>
+
+This program is free software; you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation; either version 2 of the License, or (at your
+option) any later version.
+"""
+
+import sys
+import math
+import bisect
+import logging
+import threading
+import BaseHTTPServer
+import SocketServer
+
+import rpi_acquisition
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def format_value(value):
+    """
+    :return: sample value in exposition format
+    """
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, (int, long)):
+        return str(value)
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def format_labels(labels):
+    """
+    :return: label set in exposition format
+    """
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"')
+                                                         .replace('\n', '\\n'))
+                             for name, value in sorted(labels.items()))
+
+
+class StageStats(object):
+    """
+    Call counts, failure and retry counts, latency histograms and backoff time per pipeline stage. Recording is a
+    few dict and list operations with no locking, at the cost of a rare lost update when two threads record the
+    same stage at once.
+    """
+
+    # latency histogram bucket upper bounds in seconds (last bucket is open)
+    BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self):
+        self.stages = {}  # stage -> [count, errors, retries, seconds, backoff seconds, histogram]
+
+    def _entry(self, stage):
+        entry = self.stages.get(stage)
+        if entry is None:
+            entry = self.stages.setdefault(stage, [0, 0, 0, 0.0, 0.0, [0] * (len(self.BUCKETS) + 1)])
+        return entry
+
+    def record(self, stage, elapsed, error=False):
+        """
+        Account for one call of a stage.
+
+        :param stage: stage name
+        :param elapsed: seconds the call took
+        :param error: whether the call failed
+        """
+        entry = self._entry(stage)
+        entry[0] += 1
+        if error:
+            entry[1] += 1
+        entry[3] += elapsed
+        entry[5][bisect.bisect_left(self.BUCKETS, elapsed)] += 1
+
+    def retry(self, stage, count=1):
+        """
+        Account for retried calls of a stage.
+        """
+        self._entry(stage)[2] += count
+
+    def backoff(self, stage, seconds):
+        """
+        Account for time a stage spent backing off.
+        """
+        self._entry(stage)[4] += seconds
+
+    def timed(self, stage, func):
+        """
+        :return: wrapper of func recording every call as one of the stage, failed if it raises
+        """
+        def timed_func(*args, **kwargs):
+            started = rpi_acquisition.monotonic()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                self.record(stage, rpi_acquisition.monotonic() - started, error=True)
+                raise
+            self.record(stage, rpi_acquisition.monotonic() - started)
+            return result
+
+        return timed_func
+
+    def snapshot(self):
+        """
+        :return: copy of the counters as plain dicts (JSON serializable)
+        """
+        stages = {}
+        for stage, (count, errors, retries, seconds, backoff, histogram) in self.stages.items():
+            stages[stage] = {'count': count, 'errors': errors, 'retries': retries, 'seconds': seconds,
+                             'backoff_seconds': backoff, 'histogram': list(histogram)}
+        return {'stages': stages, 'buckets': list(self.BUCKETS)}
+
+    def register(self, registry, name='stage'):
+        """
+        Expose the counters and latency histograms on a Registry.
+        """
+        def entries():
+            return sorted(self.stages.items())
+
+        def histograms():
+            for stage, entry in entries():
+                cumulative = 0
+                for bound, count in zip(self.BUCKETS + (float('inf'),), entry[5]):
+                    cumulative += count
+                    yield '_bucket', {'stage': stage, 'le': format_value(bound)}, cumulative
+                yield '_sum', {'stage': stage}, entry[3]
+                yield '_count', {'stage': stage}, entry[0]
+
+        registry.register(name + '_duration_seconds', 'histogram', 'Pipeline stage latency.', histograms)
+        registry.register(name + '_errors_total', 'counter', 'Failed pipeline stage calls.',
+                          lambda: (({'stage': stage}, entry[1]) for stage, entry in entries()))
+        registry.register(name + '_retries_total', 'counter', 'Retried pipeline stage calls.',
+                          lambda: (({'stage': stage}, entry[2]) for stage, entry in entries()))
+        registry.register(name + '_backoff_seconds_total', 'counter', 'Time pipeline stages spent backing off.',
+                          lambda: (({'stage': stage}, entry[4]) for stage, entry in entries()))
+
+
+class Registry(object):
+    """
+    Metric families, each rendered from a collector callable at scrape time.
+    """
+
+    def __init__(self, prefix='rpi_'):
+        """
+        :param prefix: prepended to every metric name
+        """
+        self.prefix = prefix
+        self._families = []  # (name, kind, help, collect) in registration order
+
+    def register(self, name, kind, help, collect):
+        """
+        :param name: metric name without prefix
+        :param kind: gauge, counter, histogram or untyped
+        :param help: one line description
+        :param collect: callable returning an iterable of (labels dictionary, value) or of (name suffix, labels
+                        dictionary, value) for histograms; None values are skipped
+        """
+        self._families.append((self.prefix + name, kind, help, collect))
+
+    def render(self):
+        """
+        :return: all metrics in Prometheus text exposition format
+        """
+        logger = logging.getLogger(sys._getframe().f_code.co_name)
+
+        lines = []
+        for name, kind, help, collect in self._families:
+            try:
+                samples = list(collect())
+            except Exception, e:
+                # a broken collector must not take the whole scrape down
+                logger.exception('Metrics collector %s failed: %s' % (name, e))
+                continue
+
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for sample in samples:
+                suffix, labels, value = sample if len(sample) == 3 else ('',) + tuple(sample)
+                if value is not None:
+                    lines.append('%s%s%s %s' % (name, suffix, format_labels(labels), format_value(value)))
+
+        lines.append('')
+        return '\n'.join(lines)
+
+
+class _MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serves GET /metrics.
+    """
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+
+        body = self.server.registry.render()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        logging.getLogger('metrics').debug('%s %s' % (self.client_address[0], fmt % args))
+
+
+class MetricsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    HTTP server exposing a Registry.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, registry, port, address=''):
+        """
+        :param registry: Registry to serve
+        :param port: TCP port to listen on
+        :param address: address to bind to (all interfaces if empty)
+        """
+        BaseHTTPServer.HTTPServer.__init__(self, (address, port), _MetricsHandler)
+        self.registry = registry
+
+    def start(self):
+        """
+        Serve in a background thread as daemon (will exit automatically).
+        """
+        t = threading.Thread(target=self.serve_forever, name='metrics-http')
+        t.daemon = True
+        t.start()
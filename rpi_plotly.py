@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+"""Persistent Plotly streaming session for rpi-plot. Keeps one stream per trace open, sends heartbeats on idle
+   streams so that Plotly does not drop them and reconnects only a stream which failed, with its own capped
+   exponential backoff with jitter.
+"""
+
+__copyright__ = """Copyright (C) 2014  Dinko Korunic <dinko.korunic@gmail.com>
+
+This program is free software; you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation; either version 2 of the License, or (at your
+option) any later version.
+"""
+
+import sys
+import time
+import random
+import logging
+import threading
+
+import rpi_acquisition
+
+
+class _StreamState(object):
+    """
+    Connection state of a single trace stream.
+    """
+
+    def __init__(self, name, stream):
+        self.name = name
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.opened = False
+        self.failures = 0  # consecutive failures
+        self.retry_at = 0.0  # monotonic time before which the stream is not reconnected
+        self.last_write = 0.0  # monotonic time of the last write or heartbeat
+
+
+class StreamSession(object):
+    """
+    Set of long-lived Plotly streams, one per trace.
+    """
+
+    def __init__(self, streams, heartbeat=30, delay=2, max_delay=1024, jitter=0.5, stats=None):
+        """
+        :param streams: dictionary of plotly.plotly.Stream objects per trace name
+        :param heartbeat: seconds of inactivity after which a heartbeat is sent on an open stream
+        :param delay: initial reconnect backoff in seconds
+        :param max_delay: maximal reconnect backoff in seconds
+        :param jitter: fraction of the backoff randomly taken off, so that streams do not reconnect in lockstep
+        :param stats: rpi_metrics.StageStats recording write latency and reconnect backoff as stage plotly, or None
+        """
+        self.heartbeat = heartbeat
+        self.delay = delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.stats = stats
+
+        self.writes = 0
+        self.failures = 0
+        self.reconnects = 0
+        self.backoff_time = 0.0  # total seconds of reconnect backoff scheduled
+
+        self._streams = dict((name, _StreamState(name, stream)) for name, stream in streams.items())
+        self._random = random.Random()
+        self._closed = False
+
+    def start(self):
+        """
+        Open all streams and start the background heartbeat thread as daemon (will exit automatically).
+        """
+        for state in self._streams.values():
+            with state.lock:
+                self._open(state)
+
+        t = threading.Thread(target=self._keepalive, name='plotly-heartbeat')
+        t.daemon = True
+        t.start()
+
+    def _open(self, state):
+        """
+        Open a stream unless it is open or backing off; called with the stream lock held.
+
+        :return: True if the stream is open
+        """
+        logger = logging.getLogger(sys._getframe().f_code.co_name)
+
+        if state.opened:
+            return True
+        if self._closed or rpi_acquisition.monotonic() < state.retry_at:
+            return False
+
+        try:
+            state.stream.open()
+        except Exception, e:
+            self._failed(state, e)
+            return False
+
+        state.opened = True
+        state.last_write = rpi_acquisition.monotonic()
+        if state.failures:
+            self.reconnects += 1
+        logger.debug('Successfully opened %s stream to PlotLy.' % state.name)
+        return True
+
+    def _failed(self, state, e):
+        """
+        Close a failed stream and schedule its reconnect; called with the stream lock held.
+        """
+        logger = logging.getLogger(sys._getframe().f_code.co_name)
+
+        try:
+            state.stream.close()
+        except Exception:
+            pass
+        state.opened = False
+
+        state.failures += 1
+        self.failures += 1
+        delay = rpi_acquisition.backoff(state.failures, self.delay, self.max_delay, self.jitter, self._random)
+        state.retry_at = rpi_acquisition.monotonic() + delay
+        self.backoff_time += delay
+        if self.stats is not None:
+            self.stats.backoff('plotly', delay)
+
+        logger.error('Error on %s stream to Plotly: %s. Reconnecting in %.1f seconds.' % (state.name, e, delay))
+
+    def write(self, name, data):
+        """
+        Write a point to a trace stream, (re)opening it if needed.
+
+        :param name: trace name
+        :param data: Plotly stream data dictionary
+        :return: True if written, False if the stream failed or is backing off
+        """
+        state = self._streams[name]
+
+        with state.lock:
+            if not self._open(state):
+                return False
+
+            started = rpi_acquisition.monotonic()
+            try:
+                state.stream.write(data)
+            except Exception, e:
+                if self.stats is not None:
+                    self.stats.record('plotly', rpi_acquisition.monotonic() - started, error=True)
+                self._failed(state, e)
+                return False
+            if self.stats is not None:
+                self.stats.record('plotly', rpi_acquisition.monotonic() - started)
+
+            state.failures = 0
+            state.last_write = rpi_acquisition.monotonic()
+            self.writes += 1
+            return True
+
+    def retry_in(self, names=None):
+        """
+        :param names: trace names to consider (all if None)
+        :return: seconds until the first of the given streams may be retried (0 if one is open)
+        """
+        states = [self._streams[name] for name in (names or self._streams.keys())]
+        now = rpi_acquisition.monotonic()
+        return max(0.0, min(0.0 if state.opened else state.retry_at - now for state in states))
+
+    def _keepalive(self):
+        """
+        Background loop sending heartbeats on idle streams and reconnecting failed ones once their backoff expires.
+        """
+        while not self._closed:
+            wakeup = self.heartbeat
+
+            for state in self._streams.values():
+                with state.lock:
+                    if not self._open(state):
+                        wakeup = min(wakeup, max(0.1, state.retry_at - rpi_acquisition.monotonic()))
+                        continue
+
+                    idle = rpi_acquisition.monotonic() - state.last_write
+                    if idle >= self.heartbeat:
+                        try:
+                            state.stream.heartbeat()
+                            state.last_write = rpi_acquisition.monotonic()
+                        except Exception, e:
+                            self._failed(state, e)
+                    else:
+                        wakeup = min(wakeup, self.heartbeat - idle)
+
+            time.sleep(wakeup)
+
+    def close(self):
+        """
+        Close all streams for good.
+        """
+        self._closed = True
+        for state in self._streams.values():
+            with state.lock:
+                if state.opened:
+                    try:
+                        state.stream.close()
+                    except Exception:
+                        pass
+                    state.opened = False
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+"""Shared-memory ring buffer of fixed-size rpi-plot sample records between one producer and one consumer process.
+   The ring is an anonymous shared memory map inherited over fork(). It is lock-free: the producer never waits and
+   overwrites the oldest slot once the ring is full, while the consumer only takes a slot whose sequence number and
+   CRC match the record it expects, so a torn or overwritten record is never consumed and lapped records are
+   counted as lost.
+"""
+
+__copyright__ = """Copyright (C) 2014  Dinko Korunic <dinko.korunic@gmail.com>
+
+This program is free software; you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation; either version 2 of the License, or (at your
+option) any later version.
+"""
+
+import math
+import mmap
+import time
+import zlib
+import struct
+
+
+class SampleRing(object):
+    """
+    Single producer, single consumer ring of (timestamp, value, ...) samples in shared memory.
+    """
+
+    def __init__(self, fields=5, capacity=4096, poll=0.2):
+        """
+        :param fields: number of float values per sample besides the timestamp (None is stored as NaN)
+        :param capacity: number of slots, samples the consumer may fall behind before the oldest are lost
+        :param poll: seconds between checks for new samples while the consumer waits
+        """
+        self.fields = fields
+        self.capacity = capacity
+        self.poll = poll
+
+        # sequence number, int64 microseconds since epoch and float64 values, followed by CRC32 of all of them
+        self._payload = struct.Struct('<qq%dd' % fields)
+        self._slot = struct.Struct('<%dsI' % self._payload.size)
+
+        self.map = mmap.mmap(-1, capacity * self._slot.size)
+
+        # producer side
+        self.written = 0
+        # consumer side
+        self.consumed = 0
+        self.lost = 0  # samples overwritten before the consumer got to them
+        self._next = 0
+
+    def put(self, row):
+        """
+        Write a sample into the next slot, overwriting the oldest one when the ring is full; never blocks.
+
+        :param row: tuple of timestamp (epoch seconds) and fields float values or None
+        """
+        seq = self.written
+        values = [float('nan') if value is None else float(value) for value in row[1:]]
+        payload = self._payload.pack(seq, int(round(row[0] * 1000000)), *values)
+        self._slot.pack_into(self.map, (seq % self.capacity) * self._slot.size, payload,
+                             zlib.crc32(payload) & 0xffffffff)
+        self.written = seq + 1
+
+    def read(self, count=None):
+        """
+        Take the samples written since the last read without waiting.
+
+        :param count: maximum number of samples (None for all available)
+        :return: list of sample tuples, oldest first
+        """
+        samples = []
+        while count is None or len(samples) < count:
+            payload, crc = self._slot.unpack_from(self.map, (self._next % self.capacity) * self._slot.size)
+            if zlib.crc32(payload) & 0xffffffff != crc:
+                # not written yet or being written right now
+                break
+
+            record = self._payload.unpack(payload)
+            seq = record[0]
+            if seq < self._next:
+                # previous lap, not written yet
+                break
+            if seq > self._next:
+                # the producer lapped the consumer, continue from the oldest slot it may not have overwritten yet
+                oldest = seq - self.capacity + 1
+                self.lost += oldest - self._next
+                self._next = oldest
+                continue
+
+            samples.append((record[1] / 1000000.0,) + tuple(None if math.isnan(value) else value
+                                                            for value in record[2:]))
+            self._next += 1
+
+        self.consumed += len(samples)
+        return samples
+
+    def get(self, timeout=None):
+        """
+        Wait for samples.
+
+        :param timeout: seconds to wait for a sample (None waits forever)
+        :return: list of sample tuples, oldest first, empty on timeout
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            samples = self.read()
+            if samples or (deadline is not None and time.time() >= deadline):
+                return samples
+            time.sleep(self.poll)
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+"""Incremental multi-resolution rollups for rpi-plot samples and largest-triangle-three-buckets (LTTB) downsampling.
+   Every sample updates the current min/max/mean/count bucket of each series at each resolution in constant time,
+   so that long time windows can be drawn from a few hundred buckets instead of all raw samples. The buckets can be
+   saved to a snapshot, so that a restart only replays the samples taken since instead of years of history.
+"""
+
+__copyright__ = """Copyright (C) 2014  Dinko Korunic <dinko.korunic@gmail.com>
+
+This program is free software; you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation; either version 2 of the License, or (at your
+option) any later version.
+"""
+
+import os
+import json
+import bisect
+import threading
+import collections
+
+
+# closed bucket of one series at one resolution; start is epoch seconds
+Bucket = collections.namedtuple('Bucket', ['start', 'minimum', 'maximum', 'mean', 'count'])
+
+
+class Rollup(object):
+    """
+    Min/max/mean/count aggregates of every series over fixed time buckets at several resolutions.
+    """
+
+    def __init__(self, resolutions=(60, 3600, 86400), history=(1440, 2160, 3650), fields=5):
+        """
+        :param resolutions: bucket widths in seconds
+        :param history: number of closed buckets kept for each resolution
+        :param fields: number of series per sample
+        """
+        self.resolutions = tuple(resolutions)
+        self.history = dict(zip(self.resolutions, history))
+        self.fields = fields
+
+        self._lock = threading.Lock()
+        # resolution -> per series deque of closed Buckets
+        self._closed = dict((resolution, [collections.deque(maxlen=self.history[resolution])
+                                          for field in xrange(fields)]) for resolution in self.resolutions)
+        # resolution -> per series open bucket as [start, minimum, maximum, total, count] or None
+        self._open = dict((resolution, [None] * fields) for resolution in self.resolutions)
+        self.last = None  # timestamp of the newest sample accounted for
+        self._tied = 0  # number of samples accounted for with that timestamp
+
+    def add(self, row):
+        """
+        Account for a sample in the open bucket of every series and resolution, closing buckets it has moved past.
+
+        :param row: tuple of timestamp (epoch seconds) and fields values or None
+        """
+        timestamp = row[0]
+
+        with self._lock:
+            if timestamp == self.last:
+                self._tied += 1
+            elif self.last is None or timestamp > self.last:
+                self.last = timestamp
+                self._tied = 1
+
+            for resolution in self.resolutions:
+                start = timestamp - timestamp % resolution
+                closed = self._closed[resolution]
+                opened = self._open[resolution]
+
+                for field, value in enumerate(row[1:]):
+                    if value is None:
+                        continue
+
+                    current = opened[field]
+                    if current is not None and current[0] != start:
+                        if start < current[0]:
+                            # samples older than the open bucket are not folded back into closed ones
+                            continue
+                        closed[field].append(Bucket(current[0], current[1], current[2], current[3] / current[4],
+                                                    current[4]))
+                        current = None
+
+                    if current is None:
+                        opened[field] = [start, value, value, float(value), 1]
+                    else:
+                        if value < current[1]:
+                            current[1] = value
+                        if value > current[2]:
+                            current[2] = value
+                        current[3] += value
+                        current[4] += 1
+
+    def replay(self, samples):
+        """
+        Account for the samples not accounted for yet, e.g. those of the local history taken since a snapshot.
+
+        :param samples: iterable of rows as taken by add, in ascending time order
+        :return: number of samples added
+        """
+        with self._lock:
+            last = self.last
+            tied = self._tied
+
+        count = 0
+        for row in samples:
+            if last is not None:
+                if row[0] < last:
+                    continue
+                if row[0] == last and tied > 0:
+                    # samples sharing the timestamp of the newest one are in the same order as when first added
+                    tied -= 1
+                    continue
+            self.add(row)
+            count += 1
+        return count
+
+    def save(self, filename):
+        """
+        Write closed and open buckets of every series and resolution to a snapshot file, replaced atomically.
+
+        :param filename: snapshot file name
+        """
+        with self._lock:
+            snapshot = {'resolutions': list(self.resolutions),
+                        'history': [self.history[resolution] for resolution in self.resolutions],
+                        'fields': self.fields,
+                        'last': self.last,
+                        'tied': self._tied,
+                        'closed': [[[list(bucket) for bucket in closed] for closed in self._closed[resolution]]
+                                   for resolution in self.resolutions],
+                        'open': [[None if current is None else list(current) for current in self._open[resolution]]
+                                 for resolution in self.resolutions]}
+
+        tmp_file = '%s.%d.tmp' % (filename, os.getpid())
+        with open(tmp_file, 'w') as f:
+            json.dump(snapshot, f)
+        os.rename(tmp_file, filename)
+
+    def load(self, filename):
+        """
+        Replace the buckets with those of a snapshot taken with the same resolutions, history and fields.
+
+        :param filename: snapshot file name
+        :return: True if the snapshot was loaded, False if it is missing, unreadable or of another configuration
+        """
+        try:
+            with open(filename, 'r') as f:
+                snapshot = json.load(f)
+            if (snapshot['resolutions'] != list(self.resolutions) or snapshot['fields'] != self.fields or
+                    snapshot['history'] != [self.history[resolution] for resolution in self.resolutions]):
+                return False
+            closed = dict((resolution, [collections.deque((Bucket(*bucket) for bucket in buckets),
+                                                          maxlen=self.history[resolution])
+                                        for buckets in snapshot['closed'][i]])
+                          for i, resolution in enumerate(self.resolutions))
+            opened = dict((resolution, list(snapshot['open'][i])) for i, resolution in enumerate(self.resolutions))
+            last, tied = snapshot['last'], snapshot['tied']
+        except (IOError, ValueError, KeyError, TypeError, IndexError):
+            return False
+        if any(len(closed[resolution]) != self.fields or len(opened[resolution]) != self.fields
+               for resolution in self.resolutions):
+            return False
+
+        with self._lock:
+            self._closed = closed
+            self._open = opened
+            self.last = last
+            self._tied = tied
+        return True
+
+    def buckets(self, resolution, field, start=None, stop=None, partial=True):
+        """
+        :param resolution: one of the configured resolutions
+        :param field: series index
+        :param start: epoch seconds, buckets starting earlier are skipped (None from the oldest kept)
+        :param stop: epoch seconds, buckets starting at or after it are skipped (None to the newest)
+        :param partial: include the open bucket
+        :return: list of Buckets, oldest first
+        """
+        with self._lock:
+            buckets = list(self._closed[resolution][field])
+            current = self._open[resolution][field]
+            if partial and current is not None:
+                buckets.append(Bucket(current[0], current[1], current[2], current[3] / current[4], current[4]))
+
+        starts = [bucket.start for bucket in buckets]
+        first = 0 if start is None else bisect.bisect_left(starts, start)
+        last = len(buckets) if stop is None else bisect.bisect_left(starts, stop)
+        return buckets[first:last]
+
+    def resolution(self, span, now):
+        """
+        :param span: seconds of the time window to draw
+        :param now: epoch seconds of the end of the window
+        :return: finest resolution whose kept buckets cover the whole window
+        """
+        for resolution in sorted(self.resolutions):
+            with self._lock:
+                oldest = [closed[0].start for closed in self._closed[resolution] if closed]
+                full = any(len(closed) == closed.maxlen for closed in self._closed[resolution])
+            if not full or min(oldest or [now]) <= now - span:
+                return resolution
+        return max(self.resolutions)
+
+
+def lttb(points, threshold):
+    """
+    Largest-triangle-three-buckets downsampling: keeps the first and last point and from each of threshold - 2
+    equal buckets in between the point forming the largest triangle with the point kept from the previous bucket
+    and the average of the next bucket, which preserves the visual shape of the series.
+
+    :param points: list of (x, y) tuples with ascending numeric x
+    :param threshold: maximum number of returned points
+    :return: list of (x, y) tuples
+    """
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return list(points)
+
+    sampled = [points[0]]
+    every = (n - 2) / float(threshold - 2)
+    a = 0
+
+    for i in xrange(threshold - 2):
+        # average of the next bucket
+        next_start = int((i + 1) * every) + 1
+        next_stop = min(int((i + 2) * every) + 1, n)
+        next_count = next_stop - next_start
+        avg_x = sum(points[j][0] for j in xrange(next_start, next_stop)) / float(next_count)
+        avg_y = sum(points[j][1] for j in xrange(next_start, next_stop)) / float(next_count)
+
+        # point of the current bucket with the largest triangle
+        ax, ay = points[a]
+        best = -1.0
+        best_index = None
+        for j in xrange(int(i * every) + 1, int((i + 1) * every) + 1):
+            area = abs((ax - avg_x) * (points[j][1] - ay) - (ax - points[j][0]) * (avg_y - ay))
+            if area > best:
+                best = area
+                best_index = j
+
+        sampled.append(points[best_index])
+        a = best_index
+
+    sampled.append(points[-1])
+    return sampled
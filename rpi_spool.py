@@ -0,0 +1,621 @@
+# -*- coding: utf-8 -*-
+
+"""Disk-backed write-ahead spool for rpi-plot samples. Samples are appended as fixed-size binary records to segment
+   files, every sink reads them at its own pace through its own persistent cursor, and segments every sink is done
+   with are deleted. Memory use does not depend on the backlog size and nothing queued is lost on restart.
+"""
+
+__copyright__ = """Copyright (C) 2014  Dinko Korunic <dinko.korunic@gmail.com>
+
+This program is free software; you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation; either version 2 of the License, or (at your
+option) any later version.
+"""
+
+import os
+import sys
+import math
+import time
+import random
+import zlib
+import errno
+import bisect
+import struct
+import logging
+import threading
+
+import rpi_acquisition
+
+
+SEGMENT_SUFFIX = '.seg'
+CURSOR_SUFFIX = '.cursor'
+MAX_FIELDS = 16  # widest record layout recognized when a spool is reopened with another number of fields
+
+
+class Spool(object):
+    """
+    Append-only segmented spool of (timestamp, value, ...) records with per-sink read cursors.
+    """
+
+    def __init__(self, path, fields=5, segment_records=8192, sync_records=32, sync_interval=5.0, max_segments=None):
+        """
+        :param path: spool directory, created if missing
+        :param fields: number of float values per record besides the timestamp (None is stored as NaN); records
+                       spooled with another number of fields are converted on replay, padded with None
+        :param segment_records: records per segment file
+        :param sync_records: fsync after this many appended records
+        :param sync_interval: maximum seconds a record or moved cursor stays unsynced, also enforced by a background
+                              thread when nothing is appended or acknowledged
+        :param max_segments: maximum number of segment files kept, oldest are dropped first (None is unlimited)
+        """
+        self.path = path
+        self.fields = fields
+        self.segment_records = segment_records
+        self.sync_records = sync_records
+        self.sync_interval = sync_interval
+        self.max_segments = max_segments
+
+        # int64 microseconds since epoch, float64 values and CRC32 of both
+        self._payload = struct.Struct('<q%dd' % fields)
+        self._record = struct.Struct('<%dsI' % self._payload.size)
+        self.record_size = self._record.size
+
+        self.dropped = 0  # records lost to max_segments
+        self.truncated = 0  # torn records discarded on replay
+
+        self._lock = threading.Lock()
+        self._appended = threading.Condition(self._lock)
+        self._closing = threading.Condition(self._lock)
+        self._closed = False
+        self._segments = []  # first sequence number of each segment file, ascending
+        self._cursors = {}  # sink name -> next sequence number to read
+        self._oldest = {}  # sink name -> capture time of the record at its cursor, None if it is caught up
+        self._head = 0  # next sequence number to write
+        self._writer = None
+        self._unsynced = 0
+        self._dirty_cursors = set()
+        self._last_sync = time.time()
+
+        try:
+            os.makedirs(path)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        self._replay()
+
+        t = threading.Thread(target=self._sync_loop, name='spool-sync')
+        t.daemon = True
+        t.start()
+
+    def _segment_file(self, first):
+        return os.path.join(self.path, '%016d%s' % (first, SEGMENT_SUFFIX))
+
+    def _cursor_file(self, sink):
+        return os.path.join(self.path, '%s%s' % (sink, CURSOR_SUFFIX))
+
+    def _replay(self):
+        """
+        Recover segments and cursors from disk, discarding a torn tail of the last segment.
+        """
+        logger = logging.getLogger(sys._getframe().f_code.co_name)
+
+        for name in os.listdir(self.path):
+            if name.endswith(SEGMENT_SUFFIX):
+                try:
+                    self._segments.append(int(name[:-len(SEGMENT_SUFFIX)]))
+                except ValueError:
+                    continue
+            elif name.endswith(CURSOR_SUFFIX):
+                try:
+                    with open(os.path.join(self.path, name)) as f:
+                        self._cursors[name[:-len(CURSOR_SUFFIX)]] = int(f.read().strip())
+                except (IOError, ValueError), e:
+                    logger.warning('Ignoring invalid spool cursor %s: %s' % (name, e))
+        self._segments.sort()
+
+        if self._segments:
+            with open(self._segment_file(self._segments[0]), 'rb') as f:
+                fields = self._layout(f.read(self.record_size * 2))
+            if fields != self.fields:
+                logger.warning('Converting spool %s from %d to %d fields per record.' % (self.path, fields,
+                                                                                         self.fields))
+                self._convert(fields)
+
+        if not self._segments:
+            self._head = max(self._cursors.values() or [0])
+        else:
+            last = self._segments[-1]
+            last_file = self._segment_file(last)
+            with open(last_file, 'rb') as f:
+                data = f.read()
+
+            # only the tail of the last segment can be torn by a crash or power loss
+            count = len(data) // self.record_size
+            while count > 0 and self._decode(data[(count - 1) * self.record_size:count * self.record_size]) is None:
+                count -= 1
+            if count * self.record_size != len(data):
+                # a partially written record counts as torn as well
+                self.truncated += -(-len(data) // self.record_size) - count
+                logger.warning('Discarding %d torn bytes at the end of spool segment %s.' %
+                               (len(data) - count * self.record_size, last_file))
+                with open(last_file, 'r+b') as f:
+                    f.truncate(count * self.record_size)
+            self._head = last + count
+
+        tail = self._tail()
+        for sink in self._cursors:
+            self._cursors[sink] = min(max(self._cursors[sink], tail), self._head)
+            self._refresh_oldest(sink)
+
+        logger.info('Spool %s replayed: %d records retained, %d sinks.' % (self.path, self._head - tail,
+                                                                           len(self._cursors)))
+
+    def _layout(self, data):
+        """
+        :param data: start of a segment file
+        :return: number of fields of its records, as found by the first record passing its CRC
+        """
+        for fields in [self.fields] + range(1, MAX_FIELDS + 1):
+            payload_size = struct.calcsize('<q%dd' % fields)
+            if len(data) >= payload_size + 4:
+                payload, crc = struct.unpack_from('<%dsI' % payload_size, data)
+                if zlib.crc32(payload) & 0xffffffff == crc:
+                    return fields
+        return self.fields
+
+    def _convert(self, fields):
+        """
+        Rewrite all segments from records of another number of fields, keeping every record at its position.
+        """
+        payload = struct.Struct('<q%dd' % fields)
+        record = struct.Struct('<%dsI' % payload.size)
+
+        for first in self._segments:
+            segment_file = self._segment_file(first)
+            with open(segment_file, 'rb') as f:
+                data = f.read()
+
+            converted = []
+            for i in xrange(len(data) // record.size):
+                old_payload, crc = record.unpack_from(data, i * record.size)
+                if zlib.crc32(old_payload) & 0xffffffff != crc:
+                    # stays corrupted, so that it is skipped as before
+                    converted.append('\0' * self.record_size)
+                    continue
+                values = payload.unpack(old_payload)
+                row = (values[0] / 1000000.0,) + tuple(None if math.isnan(value) else value
+                                                       for value in values[1:self.fields + 1])
+                converted.append(self._encode(row + (None,) * (self.fields + 1 - len(row))))
+
+            tmp_file = segment_file + '.tmp'
+            with open(tmp_file, 'wb') as f:
+                f.write(''.join(converted))
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp_file, segment_file)
+        self._sync_dir()
+
+    def _tail(self):
+        """
+        :return: sequence number of the oldest retained record
+        """
+        if self._segments:
+            return self._segments[0]
+        return self._head
+
+    def _encode(self, row):
+        values = [float('nan') if value is None else float(value) for value in row[1:]]
+        payload = self._payload.pack(int(round(row[0] * 1000000)), *values)
+        return self._record.pack(payload, zlib.crc32(payload) & 0xffffffff)
+
+    def _decode(self, data):
+        payload, crc = self._record.unpack(data)
+        if zlib.crc32(payload) & 0xffffffff != crc:
+            return None
+        record = self._payload.unpack(payload)
+        return (record[0] / 1000000.0,) + tuple(None if math.isnan(value) else value for value in record[1:])
+
+    def _refresh_oldest(self, sink):
+        """
+        Look up the capture time of the first valid record at the sink cursor; called with the lock held whenever
+        the cursor moves, so that oldest() never touches the disk.
+        """
+        seq = self._cursors[sink]
+        oldest = None
+        while seq < self._head:
+            first = self._segments[bisect.bisect_right(self._segments, seq) - 1]
+            with open(self._segment_file(first), 'rb') as f:
+                f.seek((seq - first) * self.record_size)
+                data = f.read(self.record_size)
+            row = self._decode(data) if len(data) == self.record_size else None
+            if row is not None:
+                oldest = row[0]
+                break
+            seq += 1
+        self._oldest[sink] = oldest
+
+    def register(self, sink):
+        """
+        Register a sink; a new sink starts reading at the oldest retained record.
+
+        :param sink: sink name (used as the cursor file name)
+        """
+        with self._lock:
+            if sink not in self._cursors:
+                self._cursors[sink] = self._tail()
+                self._dirty_cursors.add(sink)
+                self._refresh_oldest(sink)
+
+    def unregister(self, sink):
+        """
+        Forget a sink, so that its cursor no longer holds back compaction.
+
+        :param sink: sink name
+        """
+        with self._lock:
+            self._cursors.pop(sink, None)
+            self._oldest.pop(sink, None)
+            self._dirty_cursors.discard(sink)
+            try:
+                os.unlink(self._cursor_file(sink))
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+    def sinks(self):
+        """
+        :return: names of registered sinks, including ones restored from disk
+        """
+        return self._cursors.keys()
+
+    def append(self, row):
+        """
+        Append a record.
+
+        :param row: tuple of timestamp (epoch seconds) and fields float values or None
+        :return: sequence number of the record
+        """
+        record = self._encode(row)
+
+        with self._lock:
+            if self._writer is None or self._head - self._segments[-1] >= self.segment_records:
+                self._rotate()
+
+            self._writer.write(record)
+            self._writer.flush()
+            seq = self._head
+            self._head += 1
+            for sink, cursor in self._cursors.items():
+                if cursor == seq:
+                    # the sink was caught up, this record is now the oldest one it has not acknowledged
+                    self._oldest[sink] = row[0]
+            self._unsynced += 1
+
+            if self._unsynced >= self.sync_records or time.time() - self._last_sync >= self.sync_interval:
+                self._sync()
+
+            self._appended.notify_all()
+
+        return seq
+
+    def _rotate(self):
+        """
+        Start a new segment file (or reopen the last one after replay) and enforce max_segments.
+        """
+        logger = logging.getLogger(sys._getframe().f_code.co_name)
+
+        if self._writer is not None:
+            self._sync()
+            self._writer.close()
+            self._writer = None
+
+        if not self._segments or self._head - self._segments[-1] >= self.segment_records:
+            self._segments.append(self._head)
+        self._writer = open(self._segment_file(self._segments[-1]), 'ab')
+        self._sync_dir()
+
+        while self.max_segments is not None and len(self._segments) > self.max_segments:
+            first = self._segments.pop(0)
+            lost = self._tail() - first
+            self.dropped += lost
+            logger.warning('Spool full, dropping %d oldest records.' % lost)
+            os.unlink(self._segment_file(first))
+
+        tail = self._tail()
+        for sink, cursor in self._cursors.items():
+            if cursor < tail:
+                self._cursors[sink] = tail
+                self._dirty_cursors.add(sink)
+                self._refresh_oldest(sink)
+
+    def _sync_dir(self):
+        """
+        Make segment creation and deletion durable.
+        """
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def _sync(self):
+        """
+        fsync pending records and persist moved cursors; called with the lock held.
+        """
+        if self._writer is not None and self._unsynced:
+            os.fsync(self._writer.fileno())
+        self._unsynced = 0
+
+        for sink in self._dirty_cursors:
+            cursor_file = self._cursor_file(sink)
+            tmp_file = cursor_file + '.tmp'
+            with open(tmp_file, 'w') as f:
+                f.write('%d\n' % self._cursors[sink])
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp_file, cursor_file)
+        self._dirty_cursors.clear()
+
+        self._last_sync = time.time()
+
+    def _sync_loop(self):
+        """
+        Sync pending records and cursors sync_interval after they were written at most, until the spool is closed.
+        """
+        with self._lock:
+            while not self._closed:
+                if self._unsynced or self._dirty_cursors:
+                    due = self._last_sync + self.sync_interval - time.time()
+                    if due <= 0:
+                        self._sync()
+                        continue
+                else:
+                    # anything written while waiting is due by the next wakeup
+                    due = self.sync_interval
+                self._closing.wait(due)
+
+    def sync(self):
+        """
+        fsync pending records and persist cursors now.
+        """
+        with self._lock:
+            self._sync()
+
+    def read(self, sink, count=1, timeout=None, start=None):
+        """
+        Read records after the sink cursor without moving it; records are only consumed by ack().
+
+        :param sink: registered sink name
+        :param count: maximum number of records to return
+        :param timeout: seconds to wait for a record if there is none (None waits forever)
+        :param start: sequence number to read from instead of the sink cursor, for reading ahead before an ack()
+        :return: list of (sequence number, row) tuples, empty on timeout
+        """
+        with self._lock:
+            if start is None:
+                start = self._cursors[sink]
+
+            records = []
+            waited = False
+            while not records:
+                start = max(start, self._tail())
+                if start >= self._head:
+                    if timeout is None:
+                        self._appended.wait()
+                    elif not waited:
+                        self._appended.wait(timeout)
+                        waited = True
+                    else:
+                        break
+                    continue
+
+                # corrupted records are skipped, reading on until a valid one is found
+                stop = min(self._head, start + count)
+                while start < stop:
+                    index = bisect.bisect_right(self._segments, start) - 1
+                    first = self._segments[index]
+                    chunk = min(stop, first + self.segment_records) - start
+                    with open(self._segment_file(first), 'rb') as f:
+                        f.seek((start - first) * self.record_size)
+                        data = f.read(chunk * self.record_size)
+                    for i in xrange(len(data) // self.record_size):
+                        row = self._decode(data[i * self.record_size:(i + 1) * self.record_size])
+                        if row is not None:
+                            records.append((start + i, row))
+                    start += chunk
+
+            return records
+
+    def ack(self, sink, seq):
+        """
+        Move the sink cursor past a record; the cursor is persisted at the next sync.
+
+        :param sink: registered sink name
+        :param seq: sequence number of the last record the sink is done with
+        """
+        with self._lock:
+            if seq + 1 > self._cursors[sink]:
+                self._cursors[sink] = min(seq + 1, self._head)
+                self._dirty_cursors.add(sink)
+                self._refresh_oldest(sink)
+            if time.time() - self._last_sync >= self.sync_interval:
+                self._sync()
+
+    def skip(self, sink, keep):
+        """
+        Move the sink cursor forward so that at most keep records are left unacknowledged.
+
+        :param sink: registered sink name
+        :param keep: number of newest records to keep
+        :return: number of skipped records
+        """
+        with self._lock:
+            skipped = self._head - keep - self._cursors[sink]
+            if skipped <= 0:
+                return 0
+            self._cursors[sink] += skipped
+            self._dirty_cursors.add(sink)
+            self._refresh_oldest(sink)
+            return skipped
+
+    def depth(self, sink):
+        """
+        :param sink: registered sink name
+        :return: number of records the sink has not acknowledged yet
+        """
+        # two plain reads, so that monitoring never waits for the spool lock
+        return self._head - self._cursors[sink]
+
+    def oldest(self, sink):
+        """
+        :param sink: registered sink name
+        :return: capture time (epoch seconds) of the oldest record the sink has not acknowledged, None if none
+        """
+        # kept up to date as the cursor moves, so that monitoring neither waits for the spool lock nor reads disk
+        return self._oldest.get(sink)
+
+    def compact(self):
+        """
+        Delete segments which every sink has read past.
+
+        :return: number of deleted segment files
+        """
+        with self._lock:
+            low = min(self._cursors.values() or [self._head])
+            deleted = 0
+            # the segment being written to is never deleted
+            while len(self._segments) > 1 and self._segments[1] <= low:
+                os.unlink(self._segment_file(self._segments.pop(0)))
+                deleted += 1
+            if deleted:
+                self._sync_dir()
+            return deleted
+
+    def close(self):
+        """
+        Sync and close the spool.
+        """
+        with self._lock:
+            self._closed = True
+            self._closing.notify_all()
+            self._sync()
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+
+class SinkWorker(object):
+    """
+    Delivers spooled records to one sink from its own thread and spool cursor, with its own batching, retry backoff
+    and overflow policy, so that a slow or failing sink never holds back the others and each sink acknowledges
+    every record exactly once.
+    """
+
+    def __init__(self, spool, name, deliver, batch=1, batch_age=0, max_backlog=None, delay=2, max_delay=1024,
+                 jitter=0.5, setup=None, stats=None):
+        """
+        :param spool: Spool to read from
+        :param name: sink name, also the name of its spool cursor
+        :param deliver: callable taking a list of (sequence number, row) records and returning how many of them,
+                        from the first one on, were delivered; exceptions count as nothing delivered
+        :param batch: maximum number of records delivered at once
+        :param batch_age: seconds to wait for a full batch after the oldest record was captured
+        :param max_backlog: undelivered records kept for the sink, older ones are skipped (None keeps all)
+        :param delay: initial retry backoff in seconds
+        :param max_delay: maximal retry backoff in seconds
+        :param jitter: fraction of the backoff randomly taken off
+        :param setup: callable run once in the worker thread before the first delivery, or None
+        :param stats: rpi_metrics.StageStats recording retries and backoff under the sink name, or None
+        """
+        self.spool = spool
+        self.name = name
+        self.deliver = deliver
+        self.batch = batch
+        self.batch_age = batch_age
+        self.max_backlog = max_backlog
+        self.delay = delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.setup = setup
+        self.stats = stats
+
+        self.delivered = 0
+        self.skipped = 0
+        self.failures = 0
+
+        self._random = random.Random()
+        spool.register(name)
+
+    def start(self):
+        """
+        Start the delivery thread as daemon (will exit automatically).
+        """
+        t = threading.Thread(target=self._run, name='sink-%s' % self.name)
+        t.daemon = True
+        t.start()
+
+    def _records(self):
+        """
+        Wait for the next batch of records, skipping the ones over max_backlog.
+        """
+        while True:
+            if self.max_backlog is not None:
+                self.skipped += self.spool.skip(self.name, self.max_backlog)
+
+            records = self.spool.read(self.name, self.batch)
+            if len(records) >= self.batch or not self.batch_age:
+                return records
+
+            # wait for a full batch until the oldest record is batch_age old
+            remaining = self.batch_age - (time.time() - records[0][1][0])
+            if remaining <= 0:
+                return records
+            while remaining > 0 and self.spool.depth(self.name) < self.batch:
+                time.sleep(min(remaining, 1.0))
+                remaining -= 1.0
+
+    def _run(self):
+        """
+        Delivery loop.
+        """
+        logger = logging.getLogger(sys._getframe().f_code.co_name)
+
+        if self.setup is not None:
+            try:
+                self.setup()
+            except Exception, e:
+                logger.exception('Unable to set up %s sink (unexpected situation): %s' % (self.name, e))
+
+        failures = 0
+        while True:
+            records = self._records()
+
+            try:
+                delivered = self.deliver(records)
+            except Exception, e:
+                logger.exception('Unable to deliver to %s sink (unexpected situation): %s' % (self.name, e))
+                delivered = 0
+
+            if delivered:
+                self.spool.ack(self.name, records[delivered - 1][0])
+                self.spool.compact()
+                self.delivered += delivered
+                failures = 0
+
+            if delivered < len(records):
+                failures += 1
+                self.failures += 1
+                delay = rpi_acquisition.backoff(failures, self.delay, self.max_delay, self.jitter, self._random)
+                logger.warning('Delivered %d of %d records to %s sink. Retrying in %.1f seconds.' %
+                               (delivered, len(records), self.name, delay))
+                if self.stats is not None:
+                    self.stats.retry(self.name)
+                    self.stats.backoff(self.name, delay)
+                time.sleep(delay)
@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+
+"""Local time-series store for rpi-plot samples. Samples are kept in memory-mapped columnar segment files with an
+   int64 timestamp column and one float32 column per series, so history loads without parsing and time ranges are
+   found by binary search through a sparse in-memory time index.
+"""
+
+__copyright__ = """Copyright (C) 2014  Dinko Korunic <dinko.korunic@gmail.com>
+
+This program is free software; you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation; either version 2 of the License, or (at your
+option) any later version.
+"""
+
+import os
+import sys
+import math
+import mmap
+import errno
+import bisect
+import struct
+import logging
+import threading
+
+
+SEGMENT_SUFFIX = '.ts'
+SEGMENT_MAGIC = 'RPTS'
+SEGMENT_VERSION = 1
+
+# magic, version, number of float32 columns, capacity in rows, number of rows written
+_HEADER = struct.Struct('<4sHHIq')
+HEADER_SIZE = 32
+
+
+class _Segment(object):
+    """
+    One memory-mapped segment file of fixed capacity; an existing file keeps its own number of columns.
+    """
+
+    def __init__(self, filename, fields, capacity, create=False):
+        self.filename = filename
+        self.fields = fields
+        self.capacity = capacity
+
+        size = HEADER_SIZE + capacity * (8 + 4 * fields)
+        with open(filename, 'w+b' if create else 'r+b') as f:
+            if create:
+                f.write(_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, fields, capacity, 0))
+                f.truncate(size)
+            self.map = mmap.mmap(f.fileno(), size if create else 0)
+
+        magic, version, self.fields, self.capacity, self.count = _HEADER.unpack_from(self.map, 0)
+        if magic != SEGMENT_MAGIC or version != SEGMENT_VERSION:
+            self.map.close()
+            raise ValueError('%s is not a time-series segment' % filename)
+
+        self._column_offset = HEADER_SIZE + 8 * self.capacity
+
+    def timestamp(self, row):
+        """
+        :return: timestamp (microseconds since epoch) of a row
+        """
+        return struct.unpack_from('<q', self.map, HEADER_SIZE + 8 * row)[0]
+
+    def append(self, timestamp, values):
+        """
+        Write a row after the last one; the row becomes visible once the header count is updated.
+        """
+        row = self.count
+        struct.pack_into('<q', self.map, HEADER_SIZE + 8 * row, timestamp)
+        for column, value in enumerate(values):
+            struct.pack_into('<f', self.map, self._column_offset + 4 * (column * self.capacity + row), value)
+        self.count += 1
+        struct.pack_into('<q', self.map, 12, self.count)
+
+    def rows(self, start, stop):
+        """
+        :return: tuple of timestamp list and column lists for rows [start, stop)
+        """
+        n = stop - start
+        timestamps = struct.unpack_from('<%dq' % n, self.map, HEADER_SIZE + 8 * start)
+        columns = [struct.unpack_from('<%df' % n, self.map, self._column_offset + 4 * (column * self.capacity + start))
+                   for column in xrange(self.fields)]
+        return timestamps, columns
+
+    def close(self):
+        self.map.close()
+
+
+class TimeSeriesStore(object):
+    """
+    Append-only store of (timestamp, value, ...) samples with time range lookup.
+    """
+
+    def __init__(self, path, fields=5, segment_rows=65536, index_stride=256, sync_rows=32, max_segments=None):
+        """
+        :param path: store directory, created if missing
+        :param fields: number of float values per sample besides the timestamp (None is stored as NaN); samples
+                       stored with another number of fields are read padded with None
+        :param segment_rows: rows per segment file
+        :param index_stride: rows between two entries of the in-memory sparse time index
+        :param sync_rows: flush the memory map of the current segment after this many appended rows
+        :param max_segments: maximum number of segment files kept, oldest are deleted first (None is unlimited)
+        """
+        logger = logging.getLogger(sys._getframe().f_code.co_name)
+
+        self.path = path
+        self.fields = fields
+        self.segment_rows = segment_rows
+        self.index_stride = index_stride
+        self.sync_rows = sync_rows
+        self.max_segments = max_segments
+
+        self._lock = threading.Lock()
+        self._segments = []  # _Segment objects, oldest first
+        self._first = 0  # number of the oldest segment file
+        self._index = []  # timestamp of every index_stride-th row
+        self._index_rows = []  # row numbers of the index entries
+        self._last = None  # timestamp of the newest row
+        self._unsynced = 0
+
+        try:
+            os.makedirs(path)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        numbers = []
+        for name in os.listdir(path):
+            if name.endswith(SEGMENT_SUFFIX):
+                try:
+                    numbers.append(int(name[:-len(SEGMENT_SUFFIX)]))
+                except ValueError:
+                    continue
+        numbers.sort()
+
+        # only the newest run of consecutively numbered segments is loaded
+        while len(numbers) > 1 and numbers[-1] - numbers[0] != len(numbers) - 1:
+            numbers.pop(0)
+
+        for number in numbers:
+            segment = _Segment(self._segment_file(number), fields, segment_rows)
+            self.segment_rows = segment.capacity
+            self._segments.append(segment)
+        if numbers:
+            self._first = numbers[0]
+        if self._segments and self._segments[-1].fields != fields:
+            logger.warning('Converting time-series segment %s from %d to %d columns.' %
+                           (self._segments[-1].filename, self._segments[-1].fields, fields))
+            self._segments[-1] = self._convert(self._segments[-1])
+
+        for row in xrange(self._base(), self._end(), self.index_stride):
+            self._index.append(self._timestamp(row))
+            self._index_rows.append(row)
+        if self._end() > self._base():
+            self._last = self._timestamp(self._end() - 1)
+
+        logger.info('Time-series store %s loaded: %d samples in %d segments.' % (path, len(self), len(numbers)))
+
+    def _convert(self, segment):
+        """
+        Rewrite a segment with the current number of columns, so that samples can be appended to it.
+
+        :return: converted _Segment object
+        """
+        samples = self._decode(*segment.rows(0, segment.count))
+        segment.close()
+
+        tmp_file = segment.filename + '.tmp'
+        converted = _Segment(tmp_file, self.fields, self.segment_rows, create=True)
+        for sample in samples:
+            converted.append(int(round(sample[0] * 1000000)),
+                             [float('nan') if value is None else value for value in sample[1:]])
+        converted.map.flush()
+        converted.close()
+        os.rename(tmp_file, segment.filename)
+
+        return _Segment(segment.filename, self.fields, self.segment_rows)
+
+    def _segment_file(self, number):
+        return os.path.join(self.path, '%08d%s' % (number, SEGMENT_SUFFIX))
+
+    def _base(self):
+        """
+        :return: row number of the oldest stored row
+        """
+        return self._first * self.segment_rows
+
+    def _end(self):
+        """
+        :return: row number after the newest stored row
+        """
+        if not self._segments:
+            return self._base()
+        return (self._first + len(self._segments) - 1) * self.segment_rows + self._segments[-1].count
+
+    def __len__(self):
+        return self._end() - self._base()
+
+    def _timestamp(self, row):
+        segment = self._segments[row // self.segment_rows - self._first]
+        return segment.timestamp(row % self.segment_rows)
+
+    def append(self, row):
+        """
+        Append a sample. Timestamps are kept non-decreasing for the time index, an earlier one is raised to the
+        timestamp of the newest stored sample.
+
+        :param row: tuple of timestamp (epoch seconds) and fields float values or None
+        """
+        timestamp = int(round(row[0] * 1000000))
+        values = [float('nan') if value is None else value for value in row[1:]]
+
+        with self._lock:
+            if self._last is not None and timestamp < self._last:
+                timestamp = self._last
+
+            if not self._segments or self._segments[-1].count >= self.segment_rows:
+                self._rotate()
+
+            end = self._end()
+            self._segments[-1].append(timestamp, values)
+            if end % self.index_stride == 0:
+                self._index.append(timestamp)
+                self._index_rows.append(end)
+            self._last = timestamp
+
+            self._unsynced += 1
+            if self._unsynced >= self.sync_rows:
+                self._sync()
+
+    def _rotate(self):
+        """
+        Start a new segment file and enforce max_segments; called with the lock held.
+        """
+        if self._segments:
+            self._sync()
+            number = self._first + len(self._segments)
+        else:
+            number = self._first
+        self._segments.append(_Segment(self._segment_file(number), self.fields, self.segment_rows, create=True))
+
+        while self.max_segments is not None and len(self._segments) > self.max_segments:
+            segment = self._segments.pop(0)
+            segment.close()
+            os.unlink(segment.filename)
+            self._first += 1
+            while self._index_rows and self._index_rows[0] < self._base():
+                self._index.pop(0)
+                self._index_rows.pop(0)
+
+    def _sync(self):
+        if self._segments and self._unsynced:
+            self._segments[-1].map.flush()
+        self._unsynced = 0
+
+    def sync(self):
+        """
+        Flush the current segment to disk.
+        """
+        with self._lock:
+            self._sync()
+
+    def _find(self, timestamp, end):
+        """
+        Binary search for the first row at or after a timestamp; called with the lock held.
+
+        :param timestamp: timestamp in microseconds since epoch
+        :param end: row number after the newest row
+        :return: row number
+        """
+        i = bisect.bisect_left(self._index, timestamp)
+        low = self._index_rows[i - 1] if i > 0 else self._base()
+        high = self._index_rows[i] if i < len(self._index_rows) else end
+        while low < high:
+            middle = (low + high) // 2
+            if self._timestamp(middle) < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _rows(self, start, stop):
+        """
+        Select the row range of a time range.
+
+        :return: tuple of first row, row after the last one and snapshot of the segment list
+        """
+        with self._lock:
+            end = self._end()
+            first = self._base() if start is None else self._find(int(round(start * 1000000)), end)
+            last = end if stop is None else self._find(int(round(stop * 1000000)), end)
+            return first, last, (self._first, list(self._segments))
+
+    def _decode(self, timestamps, columns):
+        """
+        :return: list of sample tuples with epoch seconds timestamps and None for NaN, padded to fields values
+        """
+        padding = (None,) * (self.fields - len(columns))
+        return [(timestamp / 1000000.0,) + tuple(None if math.isnan(value) else value
+                                                 for value in values[:self.fields]) + padding
+                for timestamp, values in zip(timestamps, zip(*columns) or [()] * len(timestamps))]
+
+    def _read(self, first, last, number, segments, chunk):
+        """
+        Iterate over decoded rows [first, last) of a segment list snapshot.
+        """
+        row = first
+        while row < last:
+            segment = segments[row // self.segment_rows - number]
+            offset = row % self.segment_rows
+            n = min(chunk, last - row, self.segment_rows - offset)
+            for sample in self._decode(*segment.rows(offset, offset + n)):
+                yield sample
+            row += n
+
+    def scan(self, start=None, stop=None, chunk=4096):
+        """
+        Iterate over samples in a time range without loading the range into memory.
+
+        :param start: epoch seconds of the first sample (None from the oldest)
+        :param stop: epoch seconds after the last sample (None to the newest at the time of the call)
+        :param chunk: rows decoded at once
+        :return: iterator of sample tuples
+        """
+        first, last, (number, segments) = self._rows(start, stop)
+        return self._read(first, last, number, segments, chunk)
+
+    def tail(self, count, stop=None):
+        """
+        :param count: maximum number of samples
+        :param stop: epoch seconds after the last sample (None to the newest)
+        :return: list of the newest samples before stop, oldest first
+        """
+        first, last, (number, segments) = self._rows(None, stop)
+        return list(self._read(max(first, last - count), last, number, segments, count or 1))
+
+    def close(self):
+        """
+        Flush and unmap all segments.
+        """
+        with self._lock:
+            self._sync()
+            for segment in self._segments:
+                segment.close()
+            self._segments = []
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+
+"""Weather Underground current conditions fetcher for rpi-plot. Keeps one keep-alive HTTP connection, caches the
+   parsed observation for a TTL, revalidates it with conditional requests and backs off as told by rate-limit
+   headers, exposing how old the returned temperature is.
+"""
+
+__copyright__ = """Copyright (C) 2014  Dinko Korunic <dinko.korunic@gmail.com>
+
+This program is free software; you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation; either version 2 of the License, or (at your
+option) any later version.
+"""
+
+import sys
+import time
+import json
+import errno
+import socket
+import logging
+import threading
+import httplib
+import urlparse
+
+import rpi_acquisition
+
+
+class WeatherUnderground(object):
+    """
+    Cached Weather Underground outdoor temperature fetcher.
+    """
+
+    def __init__(self, url, ttl=600, timeout=30, fallback=None):
+        """
+        :param url: full Weather Underground API url for current city, state and with proper API key
+        :param ttl: seconds to serve the cached observation without contacting Weather Underground
+        :param timeout: socket timeout in seconds
+        :param fallback: temperature in Celsius to return before the first successful fetch
+        """
+        parts = urlparse.urlsplit(url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path or '/'
+        if parts.query:
+            self.path = '?'.join([self.path, parts.query])
+
+        self.ttl = ttl
+        self.timeout = timeout
+
+        self.temp_c = fallback
+        self.fetched = None  # epoch time at which temp_c was last confirmed by Weather Underground
+        self.failed = False  # last refresh attempt failed
+        self.requests = 0
+        self.not_modified = 0
+
+        self._lock = threading.Lock()
+        self._conn = None
+        self._reused = False  # the pooled connection already served a response
+        self._etag = None
+        self._last_modified = None
+        self._expires = 0.0  # monotonic time until which the cached observation is served
+        self._blocked = 0.0  # monotonic time until which rate limiting forbids requests
+
+    def age(self):
+        """
+        :return: seconds since the current temperature was confirmed or None if it never was
+        """
+        if self.fetched is None:
+            return None
+        return max(0.0, time.time() - self.fetched)
+
+    def _connection(self):
+        """
+        :return: pooled keep-alive connection, opened if needed
+        """
+        if self._conn is None:
+            if self.scheme == 'https':
+                self._conn = httplib.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+            else:
+                self._conn = httplib.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self._reused = False
+        return self._conn
+
+    def close(self):
+        """
+        Close the pooled connection.
+        """
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    @staticmethod
+    def _dropped(e):
+        """
+        :return: True if an error before any response means the server closed an idle keep-alive connection
+        """
+        if isinstance(e, httplib.BadStatusLine):
+            return True
+        return (isinstance(e, socket.error) and not isinstance(e, socket.timeout) and
+                e.errno in (errno.ECONNRESET, errno.EPIPE))
+
+    def _request(self):
+        """
+        Issue a conditional GET on the pooled connection, reconnecting once if the server dropped it while idle.
+        Timeouts and failures on a fresh connection are raised right away, so that a hung API costs one timeout.
+
+        :return: tuple of response and body
+        """
+        headers = {'Connection': 'keep-alive'}
+        if self._etag is not None:
+            headers['If-None-Match'] = self._etag
+        if self._last_modified is not None:
+            headers['If-Modified-Since'] = self._last_modified
+
+        while True:
+            conn = self._connection()
+            reused = self._reused
+            try:
+                conn.request('GET', self.path, headers=headers)
+                response = conn.getresponse()
+            except (httplib.HTTPException, socket.error), e:
+                self.close()
+                # idle keep-alive connections are routinely closed by the server, retry those on a new one
+                if reused and self._dropped(e):
+                    continue
+                raise
+
+            try:
+                body = response.read()
+            except (httplib.HTTPException, socket.error):
+                self.close()
+                raise
+
+            self._reused = True
+            self.requests += 1
+            if response.getheader('connection', '').lower() == 'close' or response.version < 11:
+                self.close()
+            return response, body
+
+    def _hold_off(self, response, now):
+        """
+        Honour Retry-After and X-RateLimit-* response headers.
+        """
+        delay = None
+
+        retry_after = response.getheader('retry-after')
+        if retry_after is not None:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                delay = None
+
+        if response.getheader('x-ratelimit-remaining') == '0':
+            try:
+                delay = max(delay or 0.0, float(response.getheader('x-ratelimit-reset')) - time.time())
+            except (TypeError, ValueError):
+                pass
+
+        if delay is not None and delay > 0:
+            self._blocked = now + delay
+
+    def _max_age(self, response):
+        """
+        :return: freshness lifetime in seconds, the larger of Cache-Control max-age and configured TTL
+        """
+        for directive in response.getheader('cache-control', '').split(','):
+            name, _, value = directive.strip().partition('=')
+            if name.lower() == 'max-age':
+                try:
+                    return max(self.ttl, int(value))
+                except ValueError:
+                    break
+        return self.ttl
+
+    def _parse(self, body):
+        """
+        :return: temperature in Celsius from Weather Underground JSON or None if invalid
+        """
+        logger = logging.getLogger(sys._getframe().f_code.co_name)
+
+        try:
+            parsed_json = json.loads(body)
+        except ValueError, e:
+            logger.warning('Invalid JSON from Weather Undeground API: %s' % e)
+            return None
+
+        try:
+            temp_c = parsed_json['current_observation']['temp_c']
+        except (KeyError, TypeError), e:
+            logger.warning('Invalid JSON from Weather Undeground API: %s' % e)
+            return None
+
+        if isinstance(temp_c, int):
+            temp_c = float(temp_c)
+        elif not isinstance(temp_c, float):
+            logger.warning('Received non-float temperature from Weather Underground: %s' % str(temp_c))
+            return None
+
+        return temp_c
+
+    def refresh(self):
+        """
+        Contact Weather Underground unless the cached observation is fresh or rate limiting is in effect.
+        """
+        logger = logging.getLogger(sys._getframe().f_code.co_name)
+
+        now = rpi_acquisition.monotonic()
+        if now < self._expires:
+            return
+        if now < self._blocked:
+            logger.info('Weather Underground rate limited for another %d seconds.' % (self._blocked - now))
+            return
+
+        try:
+            response, body = self._request()
+        except (httplib.HTTPException, socket.error), e:
+            logger.error('Could not communicate with Weather Underground API: %s' % e)
+            self.failed = True
+            return
+        except Exception, e:
+            logger.exception('Unable to contact Weather Underground (unexpected situation): %s' % e)
+            self.close()
+            self.failed = True
+            return
+
+        self._hold_off(response, now)
+
+        if response.status == httplib.NOT_MODIFIED:
+            self.not_modified += 1
+            self.fetched = time.time()
+            self._expires = now + self._max_age(response)
+            self.failed = False
+            return
+
+        if response.status != httplib.OK:
+            logger.error('Weather Underground API returned HTTP %d %s.' % (response.status, response.reason))
+            self.failed = True
+            return
+
+        temp_c = self._parse(body)
+        if temp_c is None:
+            self.failed = True
+            return
+
+        self.temp_c = temp_c
+        self.fetched = time.time()
+        self._expires = now + self._max_age(response)
+        self._etag = response.getheader('etag')
+        self._last_modified = response.getheader('last-modified')
+        self.failed = False
+
+    def read(self):
+        """
+        Poll Weather Underground (or the cache) for current outdoor temperature in Celsius.
+
+        :return: rpi_acquisition.Reading with the confirmation time as timestamp, stale if the last refresh failed
+        """
+        with self._lock:
+            self.refresh()
+            return rpi_acquisition.Reading(self.temp_c, self.fetched, self.failed or self.fetched is None)
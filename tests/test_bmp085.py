@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+"""BMP085 driver against the simulated SMBus."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from Adafruit_I2C import Adafruit_I2C
+from Adafruit_BMP085 import BMP085, BMP085Compensator, numpy
+from Simulated_SMBus import SimulatedSMBus, SimulatedBMP085
+
+
+def simulated_bmp(mode=1, cal=BMP085.DATASHEET_CAL, **kwargs):
+    bus = SimulatedSMBus()
+    chip = bus.attach(SimulatedBMP085(cal=cal))
+    return BMP085(mode=mode, bus=bus, **kwargs), chip
+
+
+class BMP085Test(unittest.TestCase):
+
+    def test_datasheet_example(self):
+        bmp, chip = simulated_bmp(mode=0)
+        self.assertEqual(bmp.readTemperature(), 15.0)
+        self.assertEqual(bmp.readPressure(), 69964)
+        bmp.i2c.close()
+
+    def test_calibration_is_one_transaction(self):
+        bus = SimulatedSMBus()
+        bus.attach(SimulatedBMP085())
+        bmp = BMP085(bus=bus)
+        self.assertEqual(bus.transactions, 1)
+        self.assertEqual(bmp._cal_AC1, BMP085.DATASHEET_CAL[0])
+        bmp.i2c.close()
+
+    def test_burst_refreshes_expired_temperature(self):
+        bmp, chip = simulated_bmp(tempMaxSamples=1)
+        self.assertEqual(bmp.readBurst(3)[0], 15.0)
+
+        chip.ut += 500
+        bmp.startPressure()
+        self.assertGreater(bmp.readBurst(3)[0], 15.0)
+        self.assertRaises(ValueError, bmp.readBurst, 0)
+        bmp.i2c.close()
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_compensator_matches_scalar(self):
+        ut = numpy.arange(20000, 36000, 1601)
+        up = numpy.arange(15000, 45000, 3001)
+        for mode in range(4):
+            bmp, chip = simulated_bmp(mode=mode)
+            temperatures, pressures = bmp.compensator().compensate(ut, up << mode)
+            for i in xrange(len(ut)):
+                b5 = bmp.calcB5(int(ut[i]))
+                self.assertEqual(temperatures[i], bmp.calcTemperature(b5))
+                self.assertEqual(pressures[i], bmp.calcPressure(int(up[i]) << mode, b5))
+            bmp.i2c.close()
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_compensator_rejects_invalid_mode(self):
+        self.assertRaises(ValueError, BMP085Compensator, BMP085.DATASHEET_CAL, 4)
+
+
+class BusTest(unittest.TestCase):
+
+    def test_failed_construction_releases_bus(self):
+        bus = SimulatedSMBus()
+        bus.failNext(1)
+        self.assertRaises(IOError, BMP085, bus=bus)
+        self.assertNotIn(1, Adafruit_I2C.busManager.transactions())
+        # the next attempt opens the bus afresh
+        bus.attach(SimulatedBMP085())
+        bmp = BMP085(bus=bus)
+        self.assertEqual(bmp.i2c.handle.refs, 1)
+        bmp.i2c.close()
+
+    def test_reopen_bus_held_by_another_device(self):
+        bus = SimulatedSMBus()
+        other = Adafruit_I2C(0x40, bus=bus)
+        self.assertTrue(Adafruit_I2C.reopenBus())
+        self.assertEqual(other.handle.reopens, 1)
+        other.close()
+        self.assertFalse(Adafruit_I2C.reopenBus())
+
+
+class CalibrationCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='rpi-bmp085-')
+        self.cache = os.path.join(self.path, 'calibration.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_swapped_sensor_is_not_served_from_cache(self):
+        bmp, chip = simulated_bmp(calCache=self.cache)
+        bmp.i2c.close()
+        self.assertTrue(os.path.exists(self.cache))
+
+        swapped = (BMP085.DATASHEET_CAL[0] + 100,) + BMP085.DATASHEET_CAL[1:]
+        bmp, chip = simulated_bmp(cal=swapped, calCache=self.cache)
+        self.assertEqual(bmp._cal_AC1, swapped[0])
+        bmp.i2c.close()
+
+    def test_failed_chip_id_read_is_not_cached(self):
+        bus = SimulatedSMBus()
+        bus.attach(SimulatedBMP085())
+        bus.failNext(1)
+        bmp = BMP085(bus=bus, calCache=self.cache)
+        self.assertEqual(bmp._cal_AC1, BMP085.DATASHEET_CAL[0])
+        self.assertFalse(os.path.exists(self.cache))
+        bmp.i2c.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
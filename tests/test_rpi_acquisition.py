@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+"""Sensor scheduling and circuit breaking."""
+
+import time
+import Queue
+import threading
+import unittest
+
+import rpi_acquisition
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def test_batch_is_stamped_when_triggered(self):
+        def slow():
+            time.sleep(0.3)
+            return 2.0
+
+        sources = [rpi_acquisition.SensorSource('fast', lambda: 1.0, timeout=1.0, period=0.5),
+                   rpi_acquisition.SensorSource('slow', slow, timeout=1.0, period=0.5)]
+        batches = Queue.Queue()
+        scheduler = rpi_acquisition.Scheduler(sources, lambda readings, errors, triggered:
+                                              batches.put((readings, errors, triggered, time.time())))
+        t = threading.Thread(target=scheduler.run)
+        t.daemon = True
+        t.start()
+
+        first = batches.get(timeout=5)
+        second = batches.get(timeout=5)
+        for readings, errors, triggered, emitted in (first, second):
+            self.assertEqual(sorted(readings), ['fast', 'slow'])
+            self.assertFalse(errors)
+            # emitted once the slow source is done, stamped before it
+            self.assertGreaterEqual(emitted - triggered, 0.25)
+        self.assertAlmostEqual(second[2] - first[2], 0.5, delta=0.1)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fail = True
+        self.reads = 0
+        self.calls = []
+
+    def read(self):
+        self.reads += 1
+        self.calls.append('read')
+        if self.fail:
+            raise IOError('sensor gone')
+        return 1.0
+
+    def recover(self):
+        self.calls.append('recover')
+
+    def breaker(self, **kwargs):
+        return rpi_acquisition.CircuitBreaker('test', self.read, threshold=3, delay=0.1, max_delay=0.4, jitter=0,
+                                              **kwargs)
+
+    def test_degraded_after_threshold(self):
+        breaker = self.breaker()
+        for i in xrange(2):
+            self.assertRaises(IOError, breaker)
+        self.assertFalse(breaker.degraded)
+
+        self.assertRaises(IOError, breaker)
+        self.assertTrue(breaker.degraded)
+        self.assertEqual((breaker.failures, breaker.trips), (3, 1))
+
+    def test_degraded_sensor_is_not_read_while_backing_off(self):
+        breaker = self.breaker()
+        for i in xrange(3):
+            self.assertRaises(IOError, breaker)
+
+        self.assertRaises(rpi_acquisition.SensorDegraded, breaker)
+        self.assertEqual(self.reads, 3)
+
+        # a failed trial read doubles the backoff
+        time.sleep(0.15)
+        self.assertRaises(IOError, breaker)
+        self.assertEqual(self.reads, 4)
+        time.sleep(0.15)
+        self.assertRaises(rpi_acquisition.SensorDegraded, breaker)
+        self.assertEqual(breaker.trips, 1)
+
+    def test_recover_runs_before_trial_read(self):
+        breaker = self.breaker(recover=self.recover)
+        for i in xrange(3):
+            self.assertRaises(IOError, breaker)
+        self.assertNotIn('recover', self.calls)
+
+        time.sleep(0.15)
+        self.fail = False
+        self.assertEqual(breaker(), 1.0)
+        self.assertEqual(self.calls[-2:], ['recover', 'read'])
+
+    def test_recovery_resets(self):
+        breaker = self.breaker()
+        for i in xrange(3):
+            self.assertRaises(IOError, breaker)
+
+        time.sleep(0.15)
+        self.fail = False
+        self.assertEqual(breaker(), 1.0)
+        self.assertFalse(breaker.degraded)
+        self.assertEqual(breaker.recoveries, 1)
+
+        # it takes threshold failures again to degrade, with the initial backoff
+        self.fail = True
+        for i in xrange(3):
+            self.assertRaises(IOError, breaker)
+        self.assertEqual(breaker.trips, 2)
+        time.sleep(0.15)
+        self.assertRaises(IOError, breaker)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+"""Deadband filtering of published series."""
+
+import unittest
+
+import rpi_deadband
+
+
+class DeadbandTest(unittest.TestCase):
+
+    def test_threshold(self):
+        deadband = rpi_deadband.Deadband([0.5, 0, None])
+        samples = [(1000.0, 20.0, 1.0, 5.0), (1001.0, 20.3, 1.0, 5.0), (1002.0, 20.6, 1.5, 5.0)]
+        masks = deadband.select(samples)
+        self.assertEqual(masks, [[True, True, True], [False, False, True], [True, True, True]])
+
+    def test_select_does_not_change_state(self):
+        deadband = rpi_deadband.Deadband([0.5])
+        samples = [(1000.0, 20.0), (1001.0, 20.1)]
+        self.assertEqual(deadband.select(samples), deadband.select(samples))
+
+        # only the delivered part of a batch is committed, the rest is decided again on retry
+        masks = deadband.select(samples)
+        deadband.accept(samples[:1], masks[:1])
+        self.assertEqual(deadband.select(samples[1:]), [[False]])
+        self.assertEqual(deadband.select([(1002.0, 20.6)]), [[True]])
+
+    def test_gaps_are_changes(self):
+        deadband = rpi_deadband.Deadband([1.0])
+        samples = [(1000.0, 20.0), (1001.0, None), (1002.0, None), (1003.0, 20.0)]
+        self.assertEqual(deadband.select(samples), [[True], [True], [False], [True]])
+
+    def test_heartbeat(self):
+        deadband = rpi_deadband.Deadband([1.0], heartbeat=60)
+        samples = [(1000.0 + 30 * i, 20.0) for i in xrange(5)]
+        self.assertEqual(deadband.select(samples), [[True], [False], [True], [False], [True]])
+
+    def test_whole_rows(self):
+        deadband = rpi_deadband.Deadband([1.0, 1.0])
+        samples = [(1000.0, 20.0, 50.0), (1001.0, 20.1, 52.0), (1002.0, 20.2, 52.1)]
+        self.assertEqual(deadband.select(samples, whole=True), [[True, True], [True, True], [False, False]])
+
+    def test_counters(self):
+        deadband = rpi_deadband.Deadband([1.0, None])
+        samples = [(1000.0, 20.0, 1.0), (1001.0, 20.1, 1.0), (1002.0, 22.0, 1.0)]
+        deadband.accept(samples, deadband.select(samples))
+        self.assertEqual(deadband.published, [2, 3])
+        self.assertEqual(deadband.dropped, [1, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+"""DHT readouts with retries and median filtering."""
+
+import unittest
+
+import rpi_dht
+
+
+def reads(*values):
+    values = list(values)
+    return lambda: values.pop(0)
+
+
+class DHTReaderTest(unittest.TestCase):
+
+    def reader(self, read, **kwargs):
+        kwargs.setdefault('window', 3)
+        return rpi_dht.DHTReader(read, period=60, deadline=0.01, interval=0.001, **kwargs)
+
+    def test_spike_is_filtered_within_readout(self):
+        dht = self.reader(reads((50.0, 20.0), (99.0, 35.0), (51.0, 21.0)))
+        self.assertTrue(dht.readout())
+        self.assertEqual(dht.read().value, (51.0, 21.0))
+        self.assertEqual(dht.attempts, 3)
+
+    def test_readouts_do_not_share_reads(self):
+        dht = self.reader(reads((40.0, 10.0), (40.0, 10.0), (40.0, 10.0),
+                                (60.0, 30.0), (60.0, 30.0), (60.0, 30.0)))
+        dht.readout()
+        dht.readout()
+        self.assertEqual(dht.read().value, (60.0, 30.0))
+
+    def test_failed_and_implausible_reads_are_retried(self):
+        dht = self.reader(reads((None, None), (45.0, 22.0), (150.0, 20.0), (46.0, 23.0)), window=1)
+        self.assertTrue(dht.readout())
+        self.assertEqual(dht.read().value, (45.0, 22.0))
+        self.assertTrue(dht.readout())
+        self.assertEqual(dht.read().value, (46.0, 23.0))
+        self.assertEqual((dht.attempts, dht.failures, dht.rejected), (4, 1, 1))
+
+    def test_readout_without_good_read_is_missed(self):
+        dht = self.reader(lambda: (None, None))
+        budget = dht.budget()
+        self.assertFalse(dht.readout())
+        self.assertEqual(dht.attempts, budget)
+        self.assertEqual(dht.missed, 1)
+        self.assertTrue(dht.read().stale)
+        self.assertGreater(dht.budget(), budget)
+
+
+if __name__ == '__main__':
+    unittest.main()
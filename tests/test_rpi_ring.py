@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+"""SampleRing overwrite and torn record rejection."""
+
+import unittest
+
+import rpi_ring
+
+
+class SampleRingTest(unittest.TestCase):
+
+    def test_read_in_order(self):
+        ring = rpi_ring.SampleRing(fields=2, capacity=4)
+        ring.put((1.0, 10.0, None))
+        ring.put((2.0, 20.0, 21.0))
+
+        self.assertEqual(ring.read(), [(1.0, 10.0, None), (2.0, 20.0, 21.0)])
+        self.assertEqual(ring.read(), [])
+        self.assertEqual(ring.consumed, 2)
+
+    def test_overwrite_counts_lost(self):
+        ring = rpi_ring.SampleRing(fields=1, capacity=4)
+        for i in xrange(6):
+            ring.put((float(i), float(i)))
+
+        # the two oldest samples were overwritten before they were read
+        self.assertEqual([sample[0] for sample in ring.read()], [2.0, 3.0, 4.0, 5.0])
+        self.assertEqual(ring.lost, 2)
+
+        ring.put((6.0, 6.0))
+        self.assertEqual(ring.read(), [(6.0, 6.0)])
+        self.assertEqual(ring.lost, 2)
+
+    def test_corrupted_slot_is_not_consumed(self):
+        ring = rpi_ring.SampleRing(fields=1, capacity=4)
+        ring.put((1.0, 1.0))
+        ring.put((2.0, 2.0))
+
+        # a record torn by a write in progress fails its CRC
+        offset = ring._slot.size + 12
+        ring.map[offset] = chr(ord(ring.map[offset]) ^ 0xff)
+
+        self.assertEqual(ring.read(), [(1.0, 1.0)])
+        self.assertEqual(ring.read(), [])
+
+        # rewriting the slot (as the producer finishing its write would) makes it readable again
+        ring.written = 1
+        ring.put((2.0, 2.0))
+        self.assertEqual(ring.read(), [(2.0, 2.0)])
+
+    def test_get_times_out(self):
+        ring = rpi_ring.SampleRing(fields=1, capacity=2, poll=0.01)
+        self.assertEqual(ring.get(timeout=0.05), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
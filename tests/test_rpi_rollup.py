@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+"""Rollup buckets, snapshots and LTTB downsampling."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import rpi_rollup
+
+
+class RollupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='rpi-rollup-')
+        self.snapshot = os.path.join(self.path, 'rollup.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def rollup(self, **kwargs):
+        kwargs.setdefault('resolutions', (10, 100))
+        kwargs.setdefault('history', (5, 5))
+        kwargs.setdefault('fields', 2)
+        return rpi_rollup.Rollup(**kwargs)
+
+    def test_buckets(self):
+        rollup = self.rollup()
+        for i in xrange(25):
+            rollup.add((1000.0 + i, float(i), None if i % 2 else 1.0))
+
+        self.assertEqual(rollup.buckets(10, 0, partial=False),
+                         [rpi_rollup.Bucket(1000.0, 0.0, 9.0, 4.5, 10),
+                          rpi_rollup.Bucket(1010.0, 10.0, 19.0, 14.5, 10)])
+        self.assertEqual(rollup.buckets(10, 0)[-1], rpi_rollup.Bucket(1020.0, 20.0, 24.0, 22.0, 5))
+        self.assertEqual([bucket.count for bucket in rollup.buckets(10, 1)], [5, 5, 3])
+        self.assertEqual(rollup.buckets(100, 0, partial=False), [])
+        self.assertEqual(len(rollup.buckets(10, 0, start=1010.0, stop=1020.0)), 1)
+
+    def test_snapshot_and_replay(self):
+        samples = [(1000.0 + i, float(i), -float(i)) for i in xrange(30)]
+        # clamped timestamps of the local history tie
+        samples[15] = (1014.0, 15.0, -15.0)
+
+        whole = self.rollup()
+        for sample in samples:
+            whole.add(sample)
+
+        rollup = self.rollup()
+        for sample in samples[:15]:
+            rollup.add(sample)
+        rollup.save(self.snapshot)
+
+        restored = self.rollup()
+        self.assertTrue(restored.load(self.snapshot))
+        self.assertEqual(restored.last, 1014.0)
+        # the history is scanned from the newest sample of the snapshot on
+        self.assertEqual(restored.replay(samples[14:]), 15)
+        for resolution in (10, 100):
+            for field in (0, 1):
+                self.assertEqual(restored.buckets(resolution, field), whole.buckets(resolution, field))
+
+    def test_snapshot_of_other_configuration_is_ignored(self):
+        rollup = self.rollup()
+        rollup.add((1000.0, 1.0, 2.0))
+        rollup.save(self.snapshot)
+
+        self.assertFalse(self.rollup(history=(5, 6)).load(self.snapshot))
+        self.assertFalse(self.rollup(fields=3).load(self.snapshot))
+        self.assertFalse(self.rollup().load(os.path.join(self.path, 'missing.json')))
+
+        with open(self.snapshot, 'w') as f:
+            f.write('{"resolutions": [10, 1')
+        self.assertFalse(self.rollup().load(self.snapshot))
+
+    def test_resolution_covers_span(self):
+        rollup = self.rollup()
+        for i in xrange(100):
+            rollup.add((1000.0 + i, float(i), None))
+
+        self.assertEqual(rollup.resolution(40, 1100.0), 10)
+        # the 10 seconds buckets kept do not reach back far enough
+        self.assertEqual(rollup.resolution(80, 1100.0), 100)
+
+
+class LTTBTest(unittest.TestCase):
+
+    def test_short_series_is_kept(self):
+        points = [(i, i * i) for i in xrange(5)]
+        self.assertEqual(rpi_rollup.lttb(points, 5), points)
+        self.assertEqual(rpi_rollup.lttb(points, 2), points)
+
+    def test_keeps_ends_and_threshold(self):
+        points = [(i, (i * 7) % 11) for i in xrange(100)]
+        sampled = rpi_rollup.lttb(points, 10)
+        self.assertEqual(len(sampled), 10)
+        self.assertEqual(sampled[0], points[0])
+        self.assertEqual(sampled[-1], points[-1])
+        self.assertEqual(sampled, sorted(sampled))
+
+    def test_keeps_spike(self):
+        points = [(i, 0.0) for i in xrange(100)]
+        points[37] = (37, 50.0)
+        self.assertIn((37, 50.0), rpi_rollup.lttb(points, 8))
+
+
+if __name__ == '__main__':
+    unittest.main()
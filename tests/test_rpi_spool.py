@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+"""Spool replay of torn segment tails and sink cursors."""
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+import rpi_spool
+
+
+class SpoolReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='rpi-spool-')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def spool(self):
+        return rpi_spool.Spool(self.path, fields=2, segment_records=4)
+
+    def last_segment(self):
+        return os.path.join(self.path, sorted(name for name in os.listdir(self.path)
+                                              if name.endswith(rpi_spool.SEGMENT_SUFFIX))[-1])
+
+    def fill(self, count):
+        spool = self.spool()
+        spool.register('sink')
+        for i in xrange(count):
+            spool.append((1000.0 + i, float(i), None))
+        spool.close()
+
+    def test_truncated_record_is_discarded(self):
+        self.fill(6)
+        segment = self.last_segment()
+        with open(segment, 'r+b') as f:
+            # power loss half way through the last record
+            f.truncate(os.path.getsize(segment) - 5)
+
+        spool = self.spool()
+        self.assertEqual(spool.truncated, 1)
+        rows = [row for seq, row in spool.read('sink', count=10, timeout=0)]
+        self.assertEqual(rows, [(1000.0 + i, float(i), None) for i in xrange(5)])
+
+        # appending goes on right after the last intact record
+        self.assertEqual(spool.append((2000.0, 1.0, 2.0)), 5)
+        self.assertEqual(spool.read('sink', count=10, timeout=0)[-1], (5, (2000.0, 1.0, 2.0)))
+        spool.close()
+
+    def test_torn_record_is_discarded(self):
+        self.fill(3)
+        segment = self.last_segment()
+        with open(segment, 'ab') as f:
+            # a whole record worth of garbage fails its CRC
+            f.write('\xff' * (os.path.getsize(segment) // 3))
+
+        spool = self.spool()
+        self.assertEqual(spool.truncated, 1)
+        self.assertEqual(len(spool.read('sink', count=10, timeout=0)), 3)
+        self.assertEqual(spool.append((2000.0, None, None)), 3)
+        spool.close()
+
+    def test_cursor_survives_reopen(self):
+        self.fill(5)
+        spool = self.spool()
+        spool.ack('sink', 2)
+        spool.close()
+
+        spool = self.spool()
+        self.assertEqual([seq for seq, row in spool.read('sink', count=10, timeout=0)], [3, 4])
+        spool.close()
+
+    def test_idle_spool_is_synced(self):
+        spool = rpi_spool.Spool(self.path, fields=2, sync_records=1000, sync_interval=0.1)
+        spool.register('sink')
+        spool.append((1000.0, 1.0, 2.0))
+        spool.ack('sink', 0)
+        self.assertTrue(spool._unsynced)
+
+        # nothing else is appended or acknowledged, the records and cursor are still synced in time
+        time.sleep(0.3)
+        self.assertFalse(spool._unsynced or spool._dirty_cursors)
+        with open(os.path.join(self.path, 'sink' + rpi_spool.CURSOR_SUFFIX)) as f:
+            self.assertEqual(f.read().strip(), '1')
+        spool.close()
+
+    def test_oldest_follows_cursor(self):
+        spool = self.spool()
+        spool.register('sink')
+        self.assertEqual(spool.oldest('sink'), None)
+
+        for i in xrange(6):
+            spool.append((1000.0 + i, float(i), None))
+        self.assertEqual(spool.oldest('sink'), 1000.0)
+
+        spool.ack('sink', 1)
+        self.assertEqual(spool.oldest('sink'), 1002.0)
+        spool.skip('sink', 1)
+        self.assertEqual(spool.oldest('sink'), 1005.0)
+        spool.ack('sink', 5)
+        self.assertEqual(spool.oldest('sink'), None)
+
+        spool.append((2000.0, None, None))
+        self.assertEqual(spool.oldest('sink'), 2000.0)
+        spool.close()
+
+        # restored on replay
+        spool = self.spool()
+        self.assertEqual(spool.oldest('sink'), 2000.0)
+        spool.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
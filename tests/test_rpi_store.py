@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+"""TimeSeriesStore segment rotation, range lookup and width conversion."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import rpi_store
+
+
+class TimeSeriesStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='rpi-store-')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def store(self, fields=2, **kwargs):
+        kwargs.setdefault('segment_rows', 4)
+        kwargs.setdefault('index_stride', 2)
+        return rpi_store.TimeSeriesStore(self.path, fields=fields, **kwargs)
+
+    def segments(self):
+        return sorted(name for name in os.listdir(self.path) if name.endswith(rpi_store.SEGMENT_SUFFIX))
+
+    def test_scan_across_segments(self):
+        store = self.store()
+        for i in xrange(10):
+            store.append((1000.0 + i, float(i), None if i % 2 else -float(i)))
+
+        self.assertEqual(len(store), 10)
+        self.assertEqual(len(self.segments()), 3)
+        self.assertEqual([sample[0] for sample in store.scan(1003.0, 1007.0)], [1003.0, 1004.0, 1005.0, 1006.0])
+        self.assertEqual(store.tail(2), [(1008.0, 8.0, -8.0), (1009.0, 9.0, None)])
+        store.close()
+
+    def test_max_segments_drops_oldest(self):
+        store = self.store(max_segments=2)
+        for i in xrange(10):
+            store.append((1000.0 + i, float(i), None))
+
+        # the current segment holds 2 samples, the one before it 4
+        self.assertEqual(len(self.segments()), 2)
+        self.assertEqual([sample[0] for sample in store.scan()], [1004.0 + i for i in xrange(6)])
+        self.assertEqual([sample[0] for sample in store.scan(1000.0, 1006.0)], [1004.0, 1005.0])
+        store.close()
+
+    def test_reopen_keeps_samples(self):
+        store = self.store()
+        for i in xrange(6):
+            store.append((1000.0 + i, float(i), None))
+        store.close()
+
+        store = self.store()
+        self.assertEqual(len(store), 6)
+        store.append((1006.0, 6.0, None))
+        self.assertEqual(store.tail(1), [(1006.0, 6.0, None)])
+        store.close()
+
+    def test_earlier_timestamp_is_clamped(self):
+        store = self.store()
+        store.append((1000.0, 1.0, None))
+        store.append((999.0, 2.0, None))
+        self.assertEqual(store.tail(2), [(1000.0, 1.0, None), (1000.0, 2.0, None)])
+        store.close()
+
+    def test_width_conversion(self):
+        store = self.store(fields=2)
+        for i in xrange(6):
+            store.append((1000.0 + i, float(i), 10.0 + i))
+        store.close()
+
+        # a third series was added, old samples read padded and the partial segment takes wider samples
+        store = self.store(fields=3)
+        store.append((1006.0, 6.0, 16.0, 26.0))
+        samples = list(store.scan())
+        self.assertEqual(samples[0], (1000.0, 0.0, 10.0, None))
+        self.assertEqual(samples[5], (1005.0, 5.0, 15.0, None))
+        self.assertEqual(samples[6], (1006.0, 6.0, 16.0, 26.0))
+        store.close()
+
+        # and back to two series
+        store = self.store(fields=2)
+        self.assertEqual(store.tail(1), [(1006.0, 6.0, 16.0)])
+        self.assertEqual(len(store), 7)
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
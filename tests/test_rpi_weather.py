@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+"""WeatherUnderground fetcher against a local stand-in HTTP server."""
+
+import json
+import time
+import threading
+import unittest
+import BaseHTTPServer
+import SocketServer
+
+import rpi_weather
+
+
+class _StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serves the next queued (status, headers, body) response and records every request.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers.items()))
+        status, headers, body = self.server.responses.pop(0)
+        if status is None:
+            # hung API
+            time.sleep(1.0)
+            self.close_connection = 1
+            return
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if self.server.drop:
+            # idle keep-alive connection closed without telling the client
+            self.close_connection = 1
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def observation(temp_c):
+    return json.dumps({'current_observation': {'temp_c': temp_c}})
+
+
+class WeatherUndergroundTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = _StandInServer(('127.0.0.1', 0), _StandInHandler)
+        self.server.responses = []
+        self.server.requests = []
+        self.server.connections = 0
+        self.server.drop = False
+        t = threading.Thread(target=self.server.serve_forever)
+        t.daemon = True
+        t.start()
+
+        # zero TTL, so that every read revalidates
+        self.fetcher = rpi_weather.WeatherUnderground('http://127.0.0.1:%d/api/conditions.json' %
+                                                      self.server.server_address[1], ttl=0, timeout=5)
+
+    def tearDown(self):
+        self.fetcher.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_not_modified_keeps_observation(self):
+        self.server.responses = [(200, {'ETag': '"v1"'}, observation(21.5)),
+                                 (304, {'ETag': '"v1"'}, '')]
+
+        first = self.fetcher.read()
+        second = self.fetcher.read()
+
+        self.assertEqual(first.value, 21.5)
+        self.assertEqual(second.value, 21.5)
+        self.assertFalse(second.stale)
+        self.assertEqual(self.fetcher.not_modified, 1)
+        self.assertEqual(self.server.requests[1].get('if-none-match'), '"v1"')
+        # both requests went over one keep-alive connection
+        self.assertEqual(self.server.connections, 1)
+
+    def test_retry_after_holds_off(self):
+        self.server.responses = [(200, {}, observation(18.0)),
+                                 (503, {'Retry-After': '3600'}, 'busy')]
+
+        self.fetcher.read()
+        failed = self.fetcher.read()
+        held_off = self.fetcher.read()
+
+        self.assertTrue(failed.stale)
+        self.assertEqual(held_off.value, 18.0)
+        # the third read is answered without contacting the server
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.fetcher.requests, 2)
+
+    def test_rate_limit_headers_hold_off(self):
+        self.server.responses = [(200, {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '9999999999'},
+                                  observation(10))]
+
+        self.assertEqual(self.fetcher.read().value, 10.0)
+        self.assertEqual(self.fetcher.read().value, 10.0)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_dropped_keep_alive_connection_is_retried(self):
+        self.server.drop = True
+        self.server.responses = [(200, {}, observation(5.0)), (200, {}, observation(6.0))]
+
+        self.assertEqual(self.fetcher.read().value, 5.0)
+        time.sleep(0.1)
+        reading = self.fetcher.read()
+
+        self.assertEqual(reading.value, 6.0)
+        self.assertFalse(reading.stale)
+        self.assertEqual(self.server.connections, 2)
+
+    def test_timeout_is_not_retried(self):
+        self.fetcher.timeout = 0.2
+        self.server.responses = [(None, {}, ''), (200, {}, observation(5.0))]
+
+        started = time.time()
+        reading = self.fetcher.read()
+
+        self.assertTrue(reading.stale)
+        self.assertLess(time.time() - started, 0.35)
+        self.assertEqual(len(self.server.requests), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()